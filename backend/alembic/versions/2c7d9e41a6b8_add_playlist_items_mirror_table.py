@@ -0,0 +1,46 @@
+"""Add playlist_items table mirroring the items of YouTube playlists
+
+Revision ID: 2c7d9e41a6b8
+Revises: 88ee06196c10
+Create Date: 2026-10-19 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c7d9e41a6b8'
+down_revision: Union[str, Sequence[str], None] = '88ee06196c10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('playlist_items',
+        sa.Column('id', sa.String(length=64), nullable=False),
+        sa.Column('playlist_id', sa.String(length=64), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=64), nullable=False),
+        sa.Column('etag', sa.String(length=64), nullable=False),
+        sa.Column('video_id', sa.String(length=32), nullable=False),
+        sa.Column('title', sa.String(length=128), nullable=False),
+        sa.ForeignKeyConstraint(['playlist_id'], ['playlists.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('playlist_position', 'playlist_items', ['playlist_id', 'position'], unique=False)
+
+    op.add_column('playlists', sa.Column('items_etag', sa.String(length=64), nullable=True))
+    op.add_column('playlists', sa.Column('items_synced_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('playlists', 'items_synced_at')
+    op.drop_column('playlists', 'items_etag')
+
+    op.drop_index('playlist_position', table_name='playlist_items')
+    op.drop_table('playlist_items')
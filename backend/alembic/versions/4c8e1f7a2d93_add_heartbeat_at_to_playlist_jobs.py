@@ -0,0 +1,28 @@
+"""Add heartbeat_at column to playlist_jobs
+
+Revision ID: 4c8e1f7a2d93
+Revises: 6a1f8c3e7d52
+Create Date: 2026-10-20 09:12:47.318205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8e1f7a2d93'
+down_revision: Union[str, Sequence[str], None] = '6a1f8c3e7d52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('playlist_jobs', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('playlist_jobs', 'heartbeat_at')
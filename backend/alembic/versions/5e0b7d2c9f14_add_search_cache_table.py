@@ -0,0 +1,33 @@
+"""Add search_cache table storing YouTube search results
+
+Revision ID: 5e0b7d2c9f14
+Revises: a41f0c83d2e5
+Create Date: 2026-10-19 16:02:48.730519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0b7d2c9f14'
+down_revision: Union[str, Sequence[str], None] = 'a41f0c83d2e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('search_cache',
+        sa.Column('query', sa.String(length=255), nullable=False),
+        sa.Column('results', sa.JSON(), nullable=False),
+        sa.Column('fetched_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('query')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('search_cache')
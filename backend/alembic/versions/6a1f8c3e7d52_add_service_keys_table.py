@@ -0,0 +1,40 @@
+"""Add service_keys table and created_by_service_id column to users
+
+Revision ID: 6a1f8c3e7d52
+Revises: 9d2c47e1a0f6
+Create Date: 2026-10-19 22:41:09.583127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6a1f8c3e7d52'
+down_revision: Union[str, Sequence[str], None] = '9d2c47e1a0f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('service_keys',
+        sa.Column('id', sa.String(length=16), nullable=False),
+        sa.Column('name', sa.String(length=64), nullable=False),
+        sa.Column('key_hash', sa.String(length=64), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('revoked_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.add_column('users', sa.Column('created_by_service_id', sa.String(length=16), nullable=True))
+    op.create_foreign_key('fk_users_created_by_service_id', 'users', 'service_keys', ['created_by_service_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('fk_users_created_by_service_id', 'users', type_='foreignkey')
+    op.drop_column('users', 'created_by_service_id')
+    op.drop_table('service_keys')
@@ -0,0 +1,56 @@
+"""Add playlist_jobs and playlist_job_items tables for building playlists in the background
+
+Revision ID: 7b4e2a90d1c3
+Revises: c93a1f6e8b27
+Create Date: 2026-10-19 18:45:33.907214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b4e2a90d1c3'
+down_revision: Union[str, Sequence[str], None] = 'c93a1f6e8b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('playlist_jobs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(length=64), nullable=False),
+        sa.Column('privacy_status', sa.String(length=16), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('detail', sa.String(length=256), nullable=True),
+        sa.Column('playlist_id', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['playlist_id'], ['playlists.id'], ondelete='SET NULL'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('playlist_job_items',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('song_title', sa.String(length=64), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('detail', sa.String(length=256), nullable=True),
+        sa.Column('video_id', sa.String(length=32), nullable=True),
+        sa.Column('video_title', sa.String(length=128), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['playlist_jobs.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('job_position', 'playlist_job_items', ['job_id', 'position'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('job_position', table_name='playlist_job_items')
+    op.drop_table('playlist_job_items')
+    op.drop_table('playlist_jobs')
@@ -0,0 +1,39 @@
+"""Add quota_ledger table recording YouTube Data API usage
+
+Revision ID: a41f0c83d2e5
+Revises: 2c7d9e41a6b8
+Create Date: 2026-10-19 14:37:05.118240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41f0c83d2e5'
+down_revision: Union[str, Sequence[str], None] = '2c7d9e41a6b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('quota_ledger',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('method', sa.String(length=64), nullable=False),
+        sa.Column('units', sa.Integer(), nullable=False),
+        sa.Column('priority', sa.String(length=16), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='SET NULL'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_quota_ledger_created_at'), 'quota_ledger', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_quota_ledger_created_at'), table_name='quota_ledger')
+    op.drop_table('quota_ledger')
@@ -0,0 +1,41 @@
+"""Add video_metadata table storing the title and channel of YouTube videos
+
+Revision ID: c93a1f6e8b27
+Revises: 5e0b7d2c9f14
+Create Date: 2026-10-19 17:21:10.264093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c93a1f6e8b27'
+down_revision: Union[str, Sequence[str], None] = '5e0b7d2c9f14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('video_metadata',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('video_title', sa.String(length=128), nullable=False),
+        sa.Column('channel_name', sa.String(length=128), nullable=False),
+        sa.Column('fetched_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # seed with the videos users have already saved
+    op.execute(
+        "INSERT INTO video_metadata (id, video_title, channel_name, fetched_at) "
+        "SELECT id, MAX(video_title), MAX(channel_name), NOW() FROM videos "
+        "WHERE id IS NOT NULL GROUP BY id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('video_metadata')
@@ -0,0 +1,31 @@
+"""Add account columns binding playlists and quota usage to YouTube accounts
+
+Revision ID: e5d81c3b7a60
+Revises: 7b4e2a90d1c3
+Create Date: 2026-10-19 20:14:52.381746
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5d81c3b7a60'
+down_revision: Union[str, Sequence[str], None] = '7b4e2a90d1c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # existing rows belong to the account configured by the original single-project settings
+    op.add_column('playlists', sa.Column('account', sa.String(length=64), server_default='default', nullable=False))
+    op.add_column('quota_ledger', sa.Column('account', sa.String(length=64), server_default='default', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('quota_ledger', 'account')
+    op.drop_column('playlists', 'account')
@@ -0,0 +1,110 @@
+"""
+The pool of YouTube accounts (Google Cloud projects with their own API key, OAuth credentials and daily quota)
+the backend spreads its calls across. New work goes to the account with the most quota left today, while
+existing playlists stay bound to the account that created them, since only its owner can edit a playlist.
+"""
+from .config import settings, YouTubeAccountSettings
+from .credentials import CredentialManager
+from . import quota
+
+YT_SCOPES = ["https://www.googleapis.com/auth/youtubepartner",
+             "https://www.googleapis.com/auth/youtube",
+             "https://www.googleapis.com/auth/youtube.force-ssl"]
+
+def _secret(value):
+    return value.get_secret_value() if value is not None else None
+
+class YouTubeAccount:
+    """
+    A single YouTube account: its API key, its credentials (if it can act as a channel), and its quota scheduler
+    """
+    def __init__(self, account_settings: YouTubeAccountSettings):
+        self.name = account_settings.name
+        self.api_key = account_settings.api_key.get_secret_value()
+        self.scheduler = quota.get_scheduler(self.name, account_settings.daily_quota)
+
+        # the manager refreshes the access token in the background before it expires, and single-flights
+        # any refresh googleapiclient triggers on demand
+        self.credential_manager = None
+        if account_settings.refresh_token is not None:
+            self.credential_manager = CredentialManager(
+                refresh_margin = settings.GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS,
+                token = _secret(account_settings.token),
+                refresh_token = _secret(account_settings.refresh_token),
+                token_uri = account_settings.token_uri,
+                client_id = _secret(account_settings.client_id),
+                client_secret = _secret(account_settings.client_secret),
+                scopes = YT_SCOPES
+            )
+
+    @property
+    def credentials(self):
+        return self.credential_manager.credentials if self.credential_manager is not None else None
+
+class AccountPool:
+    """
+    Selects which YouTube account each call is made with
+    """
+    def __init__(self, account_settings: list[YouTubeAccountSettings]):
+        if not account_settings:
+            raise ValueError("At least one YouTube account must be configured")
+
+        self.accounts = dict()
+        for entry in account_settings:
+            if entry.name in self.accounts:
+                raise ValueError(f"Duplicate YouTube account name '{entry.name}'")
+            self.accounts[entry.name] = YouTubeAccount(entry)
+
+    def __iter__(self):
+        return iter(self.accounts.values())
+
+    def get(self, name: str):
+        """
+        Returns the account with a given name. Raises KeyError if no such account is configured
+        (e.g. a playlist was created with an account that has since been removed).
+        """
+        if name not in self.accounts:
+            raise KeyError(f"YouTube account '{name}' is not configured")
+        return self.accounts[name]
+
+    def select(self):
+        """
+        Returns the account with the most quota left today
+        """
+        if len(self.accounts) == 1:
+            return next(iter(self.accounts.values()))
+        return max(self.accounts.values(), key = lambda account: account.scheduler.remaining())
+
+    def usage(self, user_id: int | None = None):
+        """
+        Summarizes today's usage across all accounts, in the form of QuotaScheduler.usage
+        """
+        summaries = [account.scheduler.usage(user_id) for account in self.accounts.values()]
+        return {'daily_budget': sum(summary['daily_budget'] for summary in summaries),
+                'bulk_budget': sum(summary['bulk_budget'] for summary in summaries),
+                'used': sum(summary['used'] for summary in summaries),
+                'remaining': sum(summary['remaining'] for summary in summaries),
+                'user_used': sum(summary['user_used'] for summary in summaries),
+                'resets_in': summaries[0]['resets_in']}
+
+def _default_account_settings():
+    # the account configured by the original single-project settings
+    return YouTubeAccountSettings(
+        name = quota.DEFAULT_ACCOUNT,
+        api_key = settings.YT_API_KEY,
+        token = settings.GOOGLE_TOKEN,
+        refresh_token = settings.GOOGLE_REFRESH_TOKEN,
+        token_uri = settings.GOOGLE_TOKEN_URI.get_secret_value(),
+        client_id = settings.GOOGLE_CLIENT_ID,
+        client_secret = settings.GOOGLE_CLIENT_SECRET,
+        daily_quota = settings.YT_DAILY_QUOTA
+    )
+
+def _all_account_settings():
+    # YT_ACCOUNTS are extra accounts. The default account is always included, since existing playlists are 
+    # bound to it, unless YT_ACCOUNTS configures an account with its name
+    if any(entry.name == quota.DEFAULT_ACCOUNT for entry in settings.YT_ACCOUNTS):
+        return settings.YT_ACCOUNTS
+    return [_default_account_settings()] + settings.YT_ACCOUNTS
+
+pool = AccountPool(_all_account_settings())
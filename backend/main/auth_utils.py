@@ -1,21 +1,25 @@
 import jwt
 from jwt import PyJWTError
-from pwdlib import PasswordHash
-from fastapi import Depends, status, HTTPException
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import Depends, status, HTTPException, Header
+from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
+from sqlalchemy import delete
 from sqlalchemy.orm import Session
 
 import datetime
 from datetime import timedelta
+import uuid
 
-from . import schema, database, models
+from . import schema, database, models, service_keys, passwords
 from .config import settings
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl = 'login')
+# requests carry either a bearer token, or a service key along with the user the service acts as
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl = 'login', auto_error = False)
+service_key_scheme = APIKeyHeader(name = 'X-API-Key', auto_error = False)
 
 SECRET_KEY = settings.SECRET_KEY.get_secret_value()
 ALGORITHM = settings.ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+REFRESH_TOKEN_EXPIRE_DAYS = settings.REFRESH_TOKEN_EXPIRE_DAYS
 
 def create_access_token(data: dict):
     # copy input dictionary so that input is not modified
@@ -36,6 +40,10 @@ def verify_access_token(token: str, credentials_exception):
     try:
         # get payload from user's token
         payload = jwt.decode(token, SECRET_KEY, algorithms = [ALGORITHM])
+
+        # refresh tokens can only be exchanged for access tokens, not used in their place
+        if payload.get('type') == 'refresh':
+            raise credentials_exception
         
         # get values stored in payload. In our case, it's just one value 
         id: str = payload.get('user_id')
@@ -50,24 +58,105 @@ def verify_access_token(token: str, credentials_exception):
     
     return token_data
 
-def get_current_user(token: str = Depends(oauth2_scheme),
+def create_refresh_token(db: Session, user_id: int):
+    """
+    Generates a refresh token for a user and records it as usable. Commits the session.
+    """
+    now = datetime.datetime.now(datetime.UTC)
+    expire = now + timedelta(days = REFRESH_TOKEN_EXPIRE_DAYS)
+    jti = str(uuid.uuid4())
+
+    # forget the user's tokens which have expired
+    db.execute(delete(models.RefreshToken)
+               .where(models.RefreshToken.user_id == user_id)
+               .where(models.RefreshToken.expires_at < now.replace(tzinfo = None)))
+    db.add(models.RefreshToken(jti = jti, user_id = user_id, expires_at = expire.replace(tzinfo = None)))
+    db.commit()
+
+    return jwt.encode({'user_id': user_id, 'type': 'refresh', 'jti': jti, 'exp': expire}, 
+                      SECRET_KEY, algorithm = ALGORITHM)
+
+def redeem_refresh_token(db: Session, token: str, credentials_exception):
+    """
+    Checks a refresh token and marks it as used, so that it can't be redeemed again.
+    Unlike logging in, this doesn't hash a password: it costs a signature check and a primary key lookup.
+    Returns:
+        int: the id of the user the token was issued to
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms = [ALGORITHM])
+    except PyJWTError:
+        raise credentials_exception
+    
+    if payload.get('type') != 'refresh' or payload.get('jti') is None:
+        raise credentials_exception
+    
+    # a token which was already redeemed has no row, and neither does a token issued to a deleted user
+    result = db.execute(delete(models.RefreshToken)
+                        .where(models.RefreshToken.jti == payload['jti'])
+                        .where(models.RefreshToken.user_id == payload.get('user_id')))
+    if result.rowcount != 1:
+        db.rollback()
+        raise credentials_exception
+    db.commit()
+
+    return payload['user_id']
+
+def get_current_service(api_key: str | None = Depends(service_key_scheme),
+                        db: Session = Depends(database.get_db)):
+    """
+    Returns the ServiceKey the request is authenticated with, or None if it carries no service key
+    """
+    if api_key is None:
+        return None
+    
+    service = service_keys.verify_service_key(db, api_key)
+    if service is None:
+        raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
+                            detail = 'Invalid service key')
+    return service
+
+def get_current_user(token: str | None = Depends(oauth2_scheme),
+                     service: models.ServiceKey | None = Depends(get_current_service),
+                     act_as_user: int | None = Header(None, alias = 'X-Act-As-User'),
                      db: Session = Depends(database.get_db)):
     credentials_exception = HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
                                           detail = f'Could not validate credentials',
                                           headers = {'WWW-Authenticate': 'Bearer'})
     
+    if service is not None:
+        if act_as_user is None:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST,
+                                detail = 'X-Act-As-User header is required with a service key')
+        
+        user = db.get(models.User, act_as_user)
+        if user is None or user.created_by_service_id != service.id:
+            raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
+                                detail = f'Service cannot act as user {act_as_user}')
+        return user
+    
+    if token is None:
+        raise credentials_exception
+    
     token_data = verify_access_token(token, credentials_exception)
 
     user = db.query(models.User).filter(models.User.id == token_data.id).first()
 
     return user
 
-pwd_hash = PasswordHash.recommended()
-
+# hashing runs on its own bounded pool of threads (see passwords.py)
 def hash(password: str):
-    return pwd_hash.hash(password)
+    return passwords.pool.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str):
-    return pwd_hash.verify(plain_password, hashed_password)
+    return passwords.pool.verify_and_update(plain_password, hashed_password)[0]
+
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """
+    Returns:
+        tuple[bool, str | None]: whether the password matches, and a rehash of it if the argon2 parameters
+        have changed since `hashed_password` was made
+    """
+    return passwords.pool.verify_and_update(plain_password, hashed_password)
 
     
\ No newline at end of file
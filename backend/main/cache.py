@@ -0,0 +1,109 @@
+"""
+Caches of YouTube Data API responses shared by all users. A search costs 100 quota units, and the same
+well-known songs are searched for by many users, so search results are stored in the `search_cache` table
+keyed by the normalized query and served from there until they expire. Likewise, the title and channel of
+every video seen are stored in the `video_metadata` table keyed by video id.
+"""
+from googleapiclient.discovery import Resource
+
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
+
+from typing import List
+import datetime
+
+from . import youtube
+from .config import settings
+from .models import SearchCacheEntry, VideoMetadata
+
+SEARCH_CACHE_TTL = datetime.timedelta(hours = settings.SEARCH_CACHE_TTL_HOURS)
+SEARCH_RESULTS_PER_QUERY = 5    # one search.list call costs the same no matter how many results it returns
+VIDEO_METADATA_TTL = datetime.timedelta(hours = settings.VIDEO_METADATA_TTL_HOURS)
+
+def normalize_query(query_string: str):
+    """
+    Maps queries which YouTube would treat the same (e.g. differing only in case or spacing) to one cache key
+    """
+    return " ".join(query_string.split()).casefold()
+
+def search_videos(db: Session, query_string: str, yt_service: Resource):
+    """
+    Returns the top YouTube search results for a query, searching YouTube only if no fresh results are cached.
+    Returns:
+        tuple: the cache entry holding the results, and a bool which is True if it was served from the cache
+    """
+    key = normalize_query(query_string)
+    now = datetime.datetime.now()
+
+    entry = db.get(SearchCacheEntry, key)
+    if entry is not None and now - entry.fetched_at < SEARCH_CACHE_TTL:
+        return entry, True
+
+    try:
+        results = youtube.search_videos(key, yt_service, max_results = SEARCH_RESULTS_PER_QUERY)
+    except youtube.CircuitOpenError:
+        # while YouTube is unavailable, expired results are better than none
+        if entry is None:
+            raise
+        return entry, True
+
+    # upsert, so that concurrent misses for the same query overwrite each other rather than conflict
+    stmt = insert(SearchCacheEntry).values(query = key, results = results, fetched_at = now)
+    db.execute(stmt.on_duplicate_key_update(results = stmt.inserted.results,
+                                            fetched_at = stmt.inserted.fetched_at))
+    _store_videos(db, results, now)
+    db.commit()
+
+    entry = db.get(SearchCacheEntry, key, populate_existing = True)
+    return entry, False
+
+def _row_to_video(row: VideoMetadata):
+    return {'id': row.id,
+            'video_title': row.video_title,
+            'channel_name': row.channel_name,
+            'link': 'http://youtu.be/' + row.id}
+
+def _store_videos(db: Session, videos: List[dict], fetched_at: datetime.datetime):
+    # upsert, so that concurrent requests storing the same videos overwrite each other rather than conflict
+    if not videos:
+        return
+    stmt = insert(VideoMetadata).values([{'id': video['id'],
+                                          'video_title': video['video_title'],
+                                          'channel_name': video['channel_name'],
+                                          'fetched_at': fetched_at} for video in videos])
+    db.execute(stmt.on_duplicate_key_update(video_title = stmt.inserted.video_title,
+                                            channel_name = stmt.inserted.channel_name,
+                                            fetched_at = stmt.inserted.fetched_at))
+
+def get_videos(db: Session, video_ids: List[str], yt_service: Resource):
+    """
+    Returns the title and channel of up to 50 videos. Videos with fresh metadata are answered from the
+    `video_metadata` table, and the rest are fetched with a single call to the YouTube Data API.
+    Args:
+        video_ids: a list of at most 50 YouTube video ids
+    Returns:
+        dict: maps each video id found to a dict of form {'id': ..., 'video_title': ..., 'channel_name': ..., 'link': ...}.
+        Ids of videos which don't exist are omitted.
+    """
+    now = datetime.datetime.now()
+    video_ids = list(dict.fromkeys(video_ids))     # drop duplicates, keeping order
+
+    rows = db.execute(select(VideoMetadata).where(VideoMetadata.id.in_(video_ids))).scalars().all()
+    found = {row.id: _row_to_video(row) for row in rows if now - row.fetched_at < VIDEO_METADATA_TTL}
+
+    misses = [video_id for video_id in video_ids if video_id not in found]
+    if misses:
+        try:
+            fetched = youtube.fetch_videos(misses, yt_service)
+        except youtube.CircuitOpenError:
+            # while YouTube is unavailable, serve expired metadata if every video has some
+            expired = {row.id: _row_to_video(row) for row in rows}
+            if any(video_id not in expired for video_id in misses):
+                raise
+            return expired
+        _store_videos(db, fetched, now)
+        db.commit()
+        found.update({video['id']: video for video in fetched})
+
+    return found
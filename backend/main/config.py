@@ -1,5 +1,20 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import SecretStr
+from pydantic import BaseModel, SecretStr
+from typing import List
+
+class YouTubeAccountSettings(BaseModel):
+    """
+    Credentials of one Google Cloud project with access to the YouTube Data API. 
+    OAuth fields may be omitted for read-only use (e.g. against a fake YouTube server).
+    """
+    name: str
+    api_key: SecretStr
+    token: SecretStr | None = None
+    refresh_token: SecretStr | None = None
+    token_uri: str = "https://oauth2.googleapis.com/token"
+    client_id: SecretStr | None = None
+    client_secret: SecretStr | None = None
+    daily_quota: int | None = None      # defaults to YT_DAILY_QUOTA
 
 class Settings(BaseSettings):
     YT_API_KEY: SecretStr
@@ -15,10 +30,35 @@ class Settings(BaseSettings):
     GOOGLE_TOKEN_URI: SecretStr
     GOOGLE_CLIENT_ID: SecretStr
     GOOGLE_CLIENT_SECRET: SecretStr
+    GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS: int = 300   # how long before expiry the access token is refreshed in the background
 
     SECRET_KEY: SecretStr
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30          # how long a refresh token can be exchanged for new access tokens
+
+    # argon2 cost of password hashes. Existing hashes are upgraded when their user next logs in
+    ARGON2_TIME_COST: int = 3                    # iterations
+    ARGON2_MEMORY_COST: int = 65536              # KiB
+    ARGON2_PARALLELISM: int = 4                  # lanes
+    PASSWORD_HASH_WORKERS: int = 2               # max password hashes computed at once
+    PASSWORD_HASH_QUEUE_LIMIT: int = 16          # max password hashes waiting for a worker before requests get 503
+
+    PLAYLIST_SYNC_INTERVAL_MINUTES: int = 60     # how often playlist mirrors are reconciled with YouTube. 0 disables
+
+    YT_DAILY_QUOTA: int = 10000                  # units per day granted to the Google Cloud project
+    YT_INTERACTIVE_QUOTA_RESERVE: float = 0.2    # fraction of the daily quota that bulk work cannot use
+    YT_BULK_QUOTA_USER_CAP: float = 0.25         # max fraction of the bulk quota a single user can use per day
+
+    YT_ACCOUNTS: List[YouTubeAccountSettings] = []  # JSON list of extra projects to spread load across, alongside the 
+                                                    # 'default' project configured by YT_API_KEY and GOOGLE_* (unless
+                                                    # an entry named 'default' replaces it)
+    YT_API_ENDPOINT: str | None = None           # overrides https://youtube.googleapis.com/ (e.g. to use a fake YouTube server)
+    YT_HTTP_TIMEOUT_SECONDS: float = 10.0        # max time to wait on a single call to the YouTube Data API
+    YT_STATS_LOG_MINUTES: int = 15               # how often credential refresh and circuit breaker stats are logged. 0 disables
+
+    SEARCH_CACHE_TTL_HOURS: int = 24 * 7         # how long cached YouTube search results are served before re-searching
+    VIDEO_METADATA_TTL_HOURS: int = 24 * 30      # how long cached video titles and channels are served before re-fetching
 
     model_config = SettingsConfigDict(env_file = '.env.dev', env_file_encoding = 'utf-8',
                                       extra = 'ignore')
@@ -0,0 +1,133 @@
+"""
+OAuth credentials for the YouTube Data API, shared by every request. Access tokens are refreshed by a
+background task shortly before they expire, so requests don't pay for the refresh. A refresh that does
+happen on demand (e.g. after a 401) is single-flighted: concurrent callers wait for one refresh instead
+of each making their own.
+"""
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from google.auth.exceptions import RefreshError
+
+from collections import deque
+import asyncio
+import datetime
+import logging
+import statistics
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REFRESH_RETRY_DELAY = 30    # seconds to wait before retrying a failed background refresh
+REFRESH_CHECK_INTERVAL = 60 # max seconds between background checks of the token's expiry
+
+class _ManagedCredentials(Credentials):
+    """
+    Credentials whose refreshes go through a CredentialManager. googleapiclient calls `refresh` itself
+    when the token is invalid or a request is rejected with 401.
+    """
+    def refresh(self, request):
+        self._manager.refresh(reason = 'on_demand', request = request)
+
+class CredentialManager:
+    """
+    Owns a set of OAuth credentials, refreshing them proactively and serializing refreshes
+    """
+    def __init__(self, refresh_margin: int, **credential_kwargs):
+        """
+        Args:
+            refresh_margin: seconds before expiry at which the background task refreshes the token
+            credential_kwargs: arguments passed to `google.oauth2.credentials.Credentials`
+        """
+        self.credentials = _ManagedCredentials(**credential_kwargs)
+        self.credentials._manager = self
+        self.refresh_margin = datetime.timedelta(seconds = refresh_margin)
+
+        self._lock = threading.Lock()
+        self._generation = 0        # incremented by every successful refresh
+
+        # metrics
+        self.refresh_count = 0
+        self.failure_count = 0
+        self.last_refresh_at = None
+        self.last_failure = None
+        self._latencies = deque(maxlen = 100)   # seconds taken by recent refreshes
+
+    def _expires_within(self, margin: datetime.timedelta):
+        # tokens loaded from settings have no known expiry, so they are refreshed once to learn it
+        expiry = self.credentials.expiry   # naive UTC
+        if expiry is None or self.credentials.token is None:
+            return True
+        return expiry - datetime.datetime.now(datetime.UTC).replace(tzinfo = None) <= margin
+
+    def refresh(self, reason: str = 'on_demand', request: Request | None = None):
+        """
+        Refreshes the access token. If another thread refreshes while this one waits for the lock,
+        the token it obtained is used instead of refreshing again.
+        Args:
+            reason: 'on_demand' when a caller needs a valid token now, 'proactive' for the background task.
+                Proactive refreshes are skipped if the token isn't close to expiring.
+        """
+        generation = self._generation
+        with self._lock:
+            if self._generation != generation and self.credentials.valid:
+                return      # refreshed while waiting
+            if reason == 'proactive' and not self._expires_within(self.refresh_margin):
+                return
+
+            start = time.perf_counter()
+            try:
+                Credentials.refresh(self.credentials, request or Request())
+            except Exception as e:
+                self.failure_count += 1
+                self.last_failure = f"{type(e).__name__}: {e}"
+                logger.warning(f"{reason} refresh of YouTube credentials failed after "
+                               f"{time.perf_counter() - start:.3f}s: {e}")
+                raise
+
+            latency = time.perf_counter() - start
+            self._latencies.append(latency)
+            self.refresh_count += 1
+            self.last_refresh_at = datetime.datetime.now()
+            self._generation += 1
+            logger.info(f"{reason} refresh of YouTube credentials took {latency:.3f}s, "
+                        f"token expires at {self.credentials.expiry} UTC")
+
+    def seconds_until_refresh(self):
+        """
+        Returns the number of seconds until the token enters the refresh margin (0 if it already has)
+        """
+        if self.credentials.expiry is None:
+            return 0
+        now = datetime.datetime.now(datetime.UTC).replace(tzinfo = None)
+        return max((self.credentials.expiry - self.refresh_margin - now).total_seconds(), 0)
+
+    def stats(self):
+        """
+        Summarizes refreshes so far
+        """
+        latencies = list(self._latencies)
+        return {'refreshes': self.refresh_count,
+                'failures': self.failure_count,
+                'last_refresh_at': self.last_refresh_at,
+                'last_failure': self.last_failure,
+                'expires_at': self.credentials.expiry,
+                'median_latency': statistics.median(latencies) if latencies else None,
+                'max_latency': max(latencies) if latencies else None}
+
+    async def run_refresh_loop(self):
+        """
+        Refreshes the token shortly before it expires, until cancelled
+        """
+        while True:
+            try:
+                await asyncio.sleep(min(self.seconds_until_refresh(), REFRESH_CHECK_INTERVAL))
+                await asyncio.to_thread(self.refresh, 'proactive')
+            except asyncio.CancelledError:
+                raise
+            except RefreshError:
+                # already counted and logged. Requests will retry the refresh on demand in the meantime
+                await asyncio.sleep(REFRESH_RETRY_DELAY)
+            except Exception as e:
+                logger.exception(f"Unexpected error in credential refresh loop: {e}")
+                await asyncio.sleep(REFRESH_RETRY_DELAY)
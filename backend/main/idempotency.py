@@ -0,0 +1,103 @@
+"""
+Support for the `Idempotency-Key` header on routes which create things on YouTube (playlists, playlist items).
+The first request with a given key is recorded along with its response; a retry with the same key gets the
+stored response back instead of repeating the work, so clients can safely retry these routes.
+"""
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+
+import datetime
+import hashlib
+import json
+
+from .models import IdempotencyKey
+
+KEY_TTL = datetime.timedelta(hours = 24)            # how long a completed response is replayed for
+IN_PROGRESS_TIMEOUT = datetime.timedelta(minutes = 5)   # after this, an unfinished request is presumed dead
+IN_PROGRESS_RETRY_AFTER = 2                             # seconds a client is asked to wait while its key is in use
+
+def _fingerprint(route: str, body: dict):
+    return hashlib.sha256(json.dumps([route, jsonable_encoder(body)], sort_keys = True).encode()).hexdigest()
+
+def begin(db: Session, user_id: int, key: str | None, route: str, body: dict):
+    """
+    Claims an idempotency key for a request.
+    Args:
+        key: the value of the Idempotency-Key header, or None if the client didn't send one
+        route: identifies the operation (e.g. 'POST /playlists/{id}/items' with the id filled in)
+        body: the request body, used to detect a key being reused for a different request
+    Returns:
+        IdempotencyKey | None: the record for the key, or None if no key was sent. If the record already has
+        a response (i.e. `record.status_code` is not None), the request is a replay and the route should return
+        `replay(record)` without doing anything else.
+    """
+    if key is None:
+        return None
+
+    now = datetime.datetime.now()
+    fingerprint = _fingerprint(route, body)
+
+    # forget expired keys, and requests which never finished (e.g. the server restarted mid-request)
+    db.execute(delete(IdempotencyKey)
+               .where(IdempotencyKey.user_id == user_id)
+               .where(IdempotencyKey.key == key)
+               .where((IdempotencyKey.created_at < now - KEY_TTL) |
+                      ((IdempotencyKey.status_code == None) & (IdempotencyKey.created_at < now - IN_PROGRESS_TIMEOUT))))
+
+    record = db.get(IdempotencyKey, (key, user_id))
+    if record is None:
+        record = IdempotencyKey(user_id = user_id, key = key, fingerprint = fingerprint, created_at = now)
+        db.add(record)
+        try:
+            db.commit()
+            return record
+        except IntegrityError:
+            # claimed by a concurrent request
+            db.rollback()
+            raise HTTPException(status_code = status.HTTP_409_CONFLICT,
+                                detail = "A request with this Idempotency-Key is in progress",
+                                headers = {'Retry-After': str(IN_PROGRESS_RETRY_AFTER)})
+    db.commit()
+
+    # key already claimed
+    if record.fingerprint != fingerprint:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST,
+                            detail = "Idempotency-Key was already used for a different request")
+    if record.status_code is None:
+        raise HTTPException(status_code = status.HTTP_409_CONFLICT,
+                            detail = "A request with this Idempotency-Key is in progress",
+                            headers = {'Retry-After': str(IN_PROGRESS_RETRY_AFTER)})
+    return record
+
+def complete(db: Session, record: IdempotencyKey | None, response, status_code: int = status.HTTP_200_OK):
+    """
+    Stores the response of a request so that it can be replayed
+    """
+    if record is None:
+        return
+    record.status_code = status_code
+    record.response = jsonable_encoder(response)
+    db.commit()
+
+def abandon(db: Session, record: IdempotencyKey | None):
+    """
+    Releases the key of a request which failed, so that a retry with the same key is carried out
+    """
+    if record is None:
+        return
+    db.rollback()
+    db.delete(record)
+    db.commit()
+
+def replay(record: IdempotencyKey):
+    """
+    Returns the stored response of a completed request
+    """
+    return JSONResponse(status_code = record.status_code,
+                        content = record.response,
+                        headers = {'Idempotent-Replayed': 'true'})
@@ -0,0 +1,317 @@
+"""
+Background jobs which build playlists from lists of song titles. Building a playlist takes one or two calls
+to the YouTube Data API per song, which is too long to keep a request open for, so the playlist job routes
+record a job and respond immediately while `run_playlist_job` does the work. Progress is written to the
+`playlist_jobs` and `playlist_job_items` tables after every song so it can be polled.
+"""
+from googleapiclient.discovery import Resource
+from googleapiclient.errors import HttpError
+
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+
+from fastapi.encoders import jsonable_encoder
+
+from typing import List
+import asyncio
+import datetime
+import json
+import logging
+import time
+
+from . import youtube, mirror, cache, accounts
+from .database import Session as SessionLocal
+from .models import PlaylistJob, PlaylistJobItem, Playlist, Canonical, AltName, Video
+from .quota import QuotaLedger, QuotaExceededError
+
+logger = logging.getLogger(__name__)
+
+EVENTS_POLL_INTERVAL = 0.5      # seconds between checks for progress while streaming a job's events
+EVENTS_KEEPALIVE_INTERVAL = 15  # seconds of silence after which a keep-alive comment is sent
+FINISHED_STATUSES = ('succeeded', 'failed')
+
+# a job's heartbeat is updated before each song, and a song takes at most a few calls (each with bounded
+# retries and timeouts), so a job not heard from for this long has lost its worker
+JOB_HEARTBEAT_TIMEOUT = datetime.timedelta(minutes = 10)
+INTERRUPTED_CHECK_INTERVAL = 300    # seconds between checks for jobs whose worker died
+
+def create_playlist_job(db: Session, user_id: int, title: str, privacy_status: str, song_titles: List[str]):
+    """
+    Records a new playlist job. The job does nothing until `run_playlist_job` is called with its id.
+    """
+    job = PlaylistJob(
+        user_id = user_id,
+        title = title,
+        privacy_status = privacy_status,
+        status = 'pending',
+        created_at = datetime.datetime.now()
+    )
+    job.items = [PlaylistJobItem(position = pos, song_title = song_title, status = 'pending')
+                 for pos, song_title in enumerate(song_titles)]
+
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def summarize_job(job: PlaylistJob):
+    """
+    Converts a job into the form of a PlaylistJobResponse
+    """
+    return {'id': job.id,
+            'title': job.title,
+            'status': job.status,
+            'detail': job.detail,
+            'playlist_id': job.playlist_id,
+            'link': job.playlist.link if job.playlist is not None else None,
+            'created_at': job.created_at,
+            'finished_at': job.finished_at,
+            'items': [{'position': item.position,
+                       'song_title': item.song_title,
+                       'status': item.status,
+                       'detail': item.detail,
+                       'video_id': item.video_id,
+                       'video_title': item.video_title}
+                      for item in job.items]}
+
+def _find_song(db: Session, user_id: int, song_title: str):
+    # songs are looked up by any of their names, as in GET /songs?exact_match=true
+    return db.scalar(select(Canonical)
+                     .join(AltName, Canonical.id == AltName.canonical_id)
+                     .where(AltName.title == song_title)
+                     .where(AltName.user_id == user_id))
+
+def _resolve_item(db: Session, user_id: int, item: PlaylistJobItem, yt_service: Resource):
+    """
+    Finds the video for a song: the one saved for it if there is one, otherwise the top YouTube search result,
+    which is then saved (creating the song if needed).
+    """
+    song = _find_song(db, user_id, item.song_title)
+    video = song.video if song is not None else None
+
+    if video is not None:
+        item.detail = 'Fetched from database'
+    else:
+        entry, cached = cache.search_videos(db, item.song_title, yt_service)
+        if not entry.results:
+            raise LookupError(f"No videos found for '{item.song_title}'")
+        top_result = entry.results[0]
+
+        if song is None:
+            song = Canonical(user_id = user_id, title = item.song_title)
+            song.alt_names.append(AltName(user_id = user_id, title = item.song_title))
+            db.add(song)
+            db.flush()
+
+        video = Video(
+            id = top_result['id'],
+            canonical_name_id = song.id,
+            link = top_result['link'],
+            user_id = user_id,
+            video_title = top_result['video_title'],
+            channel_name = top_result['channel_name']
+        )
+        db.add(video)
+        item.detail = 'Fetched from YouTube'
+
+    item.video_id = video.id
+    item.video_title = video.video_title
+    item.status = 'resolved'
+
+def _describe(e: Exception):
+    # message recorded for a song that failed
+    if isinstance(e, HttpError):
+        return youtube.http_exception_from(e).detail
+    if isinstance(e, IntegrityError):
+        return "Conflicts with an existing song or video"
+    if youtube.is_uncertain_write(e):
+        return youtube.uncertain_write_exception().detail
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return "YouTube did not respond"
+    return str(e)
+
+def _beat(job: PlaylistJob):
+    # committed along with the job's next change
+    job.heartbeat_at = datetime.datetime.now()
+
+def _finish(db: Session, job: PlaylistJob, status: str, detail: str):
+    job.status = status
+    job.detail = detail
+    job.finished_at = datetime.datetime.now()
+    db.commit()
+
+def run_playlist_job(job_id: int):
+    """
+    Builds the playlist described by a job. All songs are resolved to videos first, and the playlist is only
+    created if every song was resolved. Videos are then inserted one at a time. Intended to be run outside
+    of a request (e.g. as a background task), since it opens its own database session and YouTube client.
+    """
+    with SessionLocal() as db:
+        job = db.get(PlaylistJob, job_id)
+        if job is None or job.status != 'pending':
+            return
+
+        job.status = 'running'
+        _beat(job)
+        db.commit()
+
+        # the whole job runs with one account, since the account which creates the playlist must also fill it
+        ledger = QuotaLedger(user_id = job.user_id, priority = 'interactive')
+        account = accounts.pool.select()
+        with youtube.build_yt_service(ledger, account) as yt_service:
+            try:
+                _run_playlist_job(db, job, yt_service, account.name)
+            except Exception as e:
+                logger.exception(f"Playlist job {job_id} failed: {e}")
+                db.rollback()
+                _finish(db, job, 'failed', "Unexpected error while building playlist")
+
+def _run_playlist_job(db: Session, job: PlaylistJob, yt_service: Resource, account: str):
+    # resolve every song before creating the playlist, so that a bad title doesn't leave a partial playlist
+    for item in job.items:
+        _beat(job)
+        try:
+            _resolve_item(db, job.user_id, item, yt_service)
+            db.commit()
+        except (HttpError, TimeoutError, ConnectionError, QuotaExceededError, youtube.CircuitOpenError, 
+                LookupError, IntegrityError) as e:
+            db.rollback()
+            item.status = 'failed'
+            item.detail = _describe(e)
+            db.commit()
+
+    failed = [item for item in job.items if item.status == 'failed']
+    if failed:
+        _finish(db, job, 'failed', f"Could not find videos for {len(failed)} of {len(job.items)} songs. Playlist not created")
+        return
+
+    _beat(job)
+    db.commit()
+    try:
+        playlist_editor = youtube.PlaylistEditor(
+            mode = 'create_new',
+            title = job.title,
+            privacy_status = job.privacy_status,
+            yt_service = yt_service
+        )
+    except (HttpError, TimeoutError, ConnectionError, QuotaExceededError, youtube.CircuitOpenError) as e:
+        _finish(db, job, 'failed', f"Could not create playlist. {_describe(e)}")
+        return
+
+    playlist = Playlist(
+        id = playlist_editor.id,
+        playlist_title = job.title,
+        link = playlist_editor.link,
+        user_id = job.user_id,
+        created_at = datetime.datetime.now(),
+        account = account,
+        items_synced_at = datetime.datetime.now()     # new playlist is empty, so mirror is trivially in sync
+    )
+    db.add(playlist)
+    job.playlist_id = playlist.id
+    db.commit()
+
+    stale = False   # once an insert fails, the editor's items can't be trusted to match YouTube
+    for item in job.items:
+        _beat(job)
+        try:
+            playlist_editor.insert_video(video_id = item.video_id, yt_service = yt_service)
+        except (HttpError, TimeoutError, ConnectionError, QuotaExceededError, youtube.CircuitOpenError) as e:
+            stale = True
+            item.status = 'failed'
+            item.detail = _describe(e)
+            db.commit()
+            continue
+
+        item.status = 'inserted'
+        if stale:
+            db.commit()
+        else:
+            mirror.write_items(db, playlist, playlist_editor.items)     # commits
+    
+    if stale:
+        mirror.mark_stale(db, playlist)
+
+    failed = [item for item in job.items if item.status == 'failed']
+    if failed:
+        _finish(db, job, 'succeeded', f"Playlist created, but {len(failed)} of {len(job.items)} videos could not be inserted")
+    else:
+        _finish(db, job, 'succeeded', "Playlist created")
+
+def fail_interrupted_jobs():
+    """
+    Marks pending or running jobs whose worker stopped (e.g. the server restarted) as failed, since background
+    tasks do not survive their process. A job is presumed interrupted once it hasn't made progress for
+    `JOB_HEARTBEAT_TIMEOUT`, so jobs which other workers are still building are left alone.
+    """
+    now = datetime.datetime.now()
+    with SessionLocal() as db:
+        result = db.execute(update(PlaylistJob)
+                            .where(PlaylistJob.status.in_(['pending', 'running']))
+                            .where(func.coalesce(PlaylistJob.heartbeat_at, PlaylistJob.created_at) < now - JOB_HEARTBEAT_TIMEOUT)
+                            .values(status = 'failed',
+                                    detail = "Interrupted by a server restart",
+                                    finished_at = now))
+        db.commit()
+    if result.rowcount:
+        logger.warning(f"Marked {result.rowcount} interrupted playlist jobs as failed")
+
+async def run_interrupted_jobs_loop():
+    """
+    Runs `fail_interrupted_jobs` every `INTERRUPTED_CHECK_INTERVAL` seconds until cancelled, so that jobs of
+    a worker which died are failed without waiting for a restart
+    """
+    while True:
+        try:
+            await asyncio.to_thread(fail_interrupted_jobs)
+        except Exception as e:
+            logger.exception(f"Check for interrupted playlist jobs failed: {e}")
+        await asyncio.sleep(INTERRUPTED_CHECK_INTERVAL)
+
+def load_job_summary(job_id: int):
+    """
+    Returns the summary of a job (see `summarize_job`) read in a fresh session, or None if it doesn't exist
+    """
+    with SessionLocal() as db:
+        job = db.get(PlaylistJob, job_id)
+        return summarize_job(job) if job is not None else None
+
+def _sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+async def stream_job_events(job_id: int):
+    """
+    Yields the progress of a job as Server-Sent Events until it finishes. An `item` event (with the fields of 
+    a PlaylistJobItemResponse) is sent whenever a song's progress changes, and a `job` event (with the fields
+    of a PlaylistJobResponse, minus `items`) whenever the job's status changes. The last event is always a 
+    `job` event with status 'succeeded' or 'failed'.
+    """
+    sent = dict()       # last data sent for the job and each item
+    last_sent_at = time.monotonic()
+
+    while True:
+        summary = await asyncio.to_thread(load_job_summary, job_id)
+        if summary is None:
+            return
+        
+        for item in summary.pop('items'):
+            if sent.get(item['position']) != item:
+                sent[item['position']] = item
+                last_sent_at = time.monotonic()
+                yield _sse('item', item)
+
+        if sent.get('job') != summary:
+            sent['job'] = summary
+            last_sent_at = time.monotonic()
+            yield _sse('job', summary)
+
+        if summary['status'] in FINISHED_STATUSES:
+            return
+        
+        # comments are ignored by clients, but stop proxies and read timeouts from closing an idle stream
+        if time.monotonic() - last_sent_at >= EVENTS_KEEPALIVE_INTERVAL:
+            last_sent_at = time.monotonic()
+            yield ": keep-alive\n\n"
+
+        await asyncio.sleep(EVENTS_POLL_INTERVAL)
@@ -1,13 +1,65 @@
-from fastapi import FastAPI
-from .router import authentication, playlists, songs, users, alt_names
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+import asyncio
 
-app = FastAPI()
+from .router import authentication, playlists, playlist_jobs, songs, users, alt_names, videos, quota as quota_router
+from . import mirror, quota, jobs, accounts, youtube
+from .config import settings
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # jobs whose worker died (e.g. in the previous process) are failed, now and periodically
+    interrupted_jobs_task = asyncio.create_task(jobs.run_interrupted_jobs_loop())
+
+    # refresh the YouTube access tokens before they expire, so requests never wait on a refresh
+    credential_refresh_tasks = [asyncio.create_task(account.credential_manager.run_refresh_loop())
+                                for account in accounts.pool if account.credential_manager is not None]
+
+    # periodically repair drift between the playlist items mirror and YouTube
+    reconciliation_task = None
+    if mirror.SYNC_INTERVAL_MINUTES > 0:
+        reconciliation_task = asyncio.create_task(mirror.run_reconciliation_loop())
+    
+    # log credential refresh and circuit breaker stats
+    stats_log_task = None
+    if settings.YT_STATS_LOG_MINUTES > 0:
+        stats_log_task = asyncio.create_task(youtube.run_stats_log_loop())
+    
+    yield
+
+    if stats_log_task is not None:
+        stats_log_task.cancel()
+    interrupted_jobs_task.cancel()
+    for task in credential_refresh_tasks:
+        task.cancel()
+    if reconciliation_task is not None:
+        reconciliation_task.cancel()
+
+app = FastAPI(lifespan = lifespan)
 
 app.include_router(authentication.router)
 app.include_router(users.router)
 app.include_router(songs.router)
 app.include_router(alt_names.router)
 app.include_router(playlists.router)
+app.include_router(playlist_jobs.router)
+app.include_router(videos.router)
+app.include_router(quota_router.router)
+
+@app.exception_handler(quota.QuotaExceededError)
+async def quota_exceeded_handler(request: Request, e: quota.QuotaExceededError):
+    # raised by any call to the YT API that doesn't fit in the caller's budget
+    return JSONResponse(status_code = status.HTTP_429_TOO_MANY_REQUESTS,
+                        content = {'detail': str(e)},
+                        headers = {'Retry-After': str(e.retry_after)})
+
+@app.exception_handler(youtube.CircuitOpenError)
+async def circuit_open_handler(request: Request, e: youtube.CircuitOpenError):
+    # raised instead of calling the YT API while it is failing
+    return JSONResponse(status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content = {'detail': str(e)},
+                        headers = {'Retry-After': str(e.retry_after)})
 
 @app.get("/")
 async def root():
@@ -0,0 +1,181 @@
+"""
+Local mirror of the items in YouTube playlists. Playlist item routes read from the `playlist_items` table
+and write every successful change through to it, so viewing a playlist costs no quota. A periodic
+reconciliation job compares the mirror against the etags reported by YouTube and repairs any drift
+(e.g. from edits made directly on YouTube).
+"""
+from googleapiclient.discovery import Resource
+from googleapiclient.errors import HttpError
+
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session
+
+from typing import List
+import asyncio
+import contextlib
+import datetime
+import logging
+
+from . import youtube, accounts
+from .config import settings
+from .database import Session as SessionLocal
+from .models import Playlist, PlaylistItem
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL_MINUTES = settings.PLAYLIST_SYNC_INTERVAL_MINUTES
+SYNC_BATCH_SIZE = 50    # max number of playlists reconciled per run
+
+def _row_to_item(row: PlaylistItem):
+    return {'kind': row.kind,
+            'etag': row.etag,
+            'item_id': row.id,
+            'video_id': row.video_id,
+            'title': row.title}
+
+def get_items(db: Session, playlist: Playlist, yt_service: Resource):
+    """
+    Returns the items of a playlist from the mirror. If the playlist has never been mirrored
+    (or the mirror was marked stale), then it is first seeded from the YouTube Data API. While YouTube is
+    unavailable (i.e. the circuit breaker is open), a stale mirror is served as the last known snapshot.
+    Returns:
+        list: a list of dicts of form {'kind': ..., 'etag': ..., 'item_id': ..., 'video_id': ..., 'title': ...}
+    """
+    if playlist.items_synced_at is None:
+        try:
+            reconcile_playlist(db, playlist, yt_service)
+        except youtube.CircuitOpenError:
+            if not playlist.items:
+                raise
+            logger.info(f"Serving stale mirror of playlist {playlist.id} while YouTube is unavailable")
+
+    return [_row_to_item(row) for row in playlist.items]
+
+def lock_items(db: Session, playlist: Playlist, yt_service: Resource):
+    """
+    Returns the items of a playlist (as `get_items` does) for an edit, holding a lock on the playlist's row
+    until the edit is committed (e.g. by `write_items` or `mark_stale`) or rolled back. Concurrent edits of a
+    playlist then run one at a time, each starting from the mirror as the previous edit left it.
+    """
+    # seeding the mirror commits, so it is done before the lock is taken
+    get_items(db, playlist, yt_service)
+
+    # end the current transaction, so that reads after the lock see edits committed while waiting for it
+    db.commit()
+    db.refresh(playlist, with_for_update = True)
+    return [_row_to_item(row) for row in playlist.items]
+
+def write_items(db: Session, playlist: Playlist, items: List[dict], etag: str | None = None):
+    """
+    Makes the mirror of a playlist match `items`. Only rows that changed are touched.
+    Args:
+        items: the full, ordered list of items in the playlist, as dicts of form
+            {'kind': ..., 'etag': ..., 'item_id': ..., 'video_id': ..., 'title': ...}
+        etag: the etag reported by YouTube for `items`. Should be `None` when writing through a local change,
+            in which case the next reconciliation will fetch the playlist in full.
+    """
+    existing = {row.id: row for row in playlist.items}
+
+    for pos, item in enumerate(items):
+        row = existing.pop(item['item_id'], None)
+        if row is None:
+            db.add(PlaylistItem(
+                id = item['item_id'],
+                playlist_id = playlist.id,
+                position = pos,
+                kind = item['kind'],
+                etag = item['etag'],
+                video_id = item['video_id'],
+                title = item['title']
+            ))
+            continue
+
+        if row.position != pos:
+            row.position = pos
+        if row.etag != item['etag']:
+            row.etag = item['etag']
+            row.video_id = item['video_id']
+            row.title = item['title']
+
+    # anything left over is no longer in the playlist
+    for row in existing.values():
+        db.delete(row)
+
+    playlist.items_etag = etag
+    if playlist.items_synced_at is None:
+        playlist.items_synced_at = datetime.datetime.now()
+
+    db.commit()
+    db.refresh(playlist)
+
+def mark_stale(db: Session, playlist: Playlist):
+    """
+    Flags the mirror of a playlist as untrustworthy (e.g. after YouTube rejected a change because the
+    mirror was out of date), so that it is reseeded from YouTube on the next read.
+    """
+    playlist.items_synced_at = None
+    playlist.items_etag = None
+    db.commit()
+
+def reconcile_playlist(db: Session, playlist: Playlist, yt_service: Resource):
+    """
+    Fetches the items of a playlist from the YouTube Data API and repairs the mirror if it drifted.
+    The playlist's row is locked (as by `lock_items`) from before the fetch until the mirror is written, so an
+    edit can't land in between and then be overwritten by the older items fetched.
+    Returns:
+        bool: True if the mirror was modified, False if it already matched YouTube
+    """
+    db.commit()
+    db.refresh(playlist, with_for_update = True)
+    etag, items = youtube.fetch_playlist_items(playlist.id, yt_service)
+
+    drifted = etag != playlist.items_etag
+    if drifted:
+        write_items(db, playlist, items, etag = etag)
+
+    playlist.items_synced_at = datetime.datetime.now()
+    db.commit()
+
+    return drifted
+
+def reconcile_stale_playlists():
+    """
+    Reconciles the playlists which haven't been synced within the last `PLAYLIST_SYNC_INTERVAL_MINUTES`,
+    oldest first. Intended to be run periodically outside of a request.
+    """
+    cutoff = datetime.datetime.now() - datetime.timedelta(minutes = SYNC_INTERVAL_MINUTES)
+    repaired = 0
+
+    with SessionLocal() as db, contextlib.ExitStack() as stack:
+        stmt = (select(Playlist)
+                .where(or_(Playlist.items_synced_at == None, Playlist.items_synced_at < cutoff))
+                .order_by(Playlist.items_synced_at)
+                .limit(SYNC_BATCH_SIZE))
+        playlists = db.execute(stmt).scalars().all()
+
+        yt_services = dict()    # one client per account, since each playlist is read with the account owning it
+        for playlist in playlists:
+            try:
+                if playlist.account not in yt_services:
+                    account = accounts.pool.get(playlist.account)
+                    yt_services[playlist.account] = stack.enter_context(youtube.build_yt_service(account = account))
+                repaired += reconcile_playlist(db, playlist, yt_services[playlist.account])
+            except (HttpError, TimeoutError, ConnectionError, KeyError) as e:
+                db.rollback()
+                logger.warning(f"Could not reconcile playlist {playlist.id}: {e}")
+            except youtube.CircuitOpenError:
+                logger.warning(f"YouTube is unavailable, postponing reconciliation")
+                break
+
+    logger.info(f"Reconciled {len(playlists)} playlists, repaired {repaired}")
+
+async def run_reconciliation_loop():
+    """
+    Runs `reconcile_stale_playlists` every `PLAYLIST_SYNC_INTERVAL_MINUTES` until cancelled
+    """
+    while True:
+        try:
+            await asyncio.to_thread(reconcile_stale_playlists)
+        except Exception as e:
+            logger.exception(f"Playlist reconciliation failed: {e}")
+        await asyncio.sleep(SYNC_INTERVAL_MINUTES * 60)
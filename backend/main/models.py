@@ -1,8 +1,8 @@
 from .database import Base
 from typing import List, Optional
 from datetime import datetime
-from sqlalchemy import ForeignKey, UniqueConstraint
-from sqlalchemy import String, Integer, DateTime
+from sqlalchemy import ForeignKey, UniqueConstraint, Index
+from sqlalchemy import String, Integer, DateTime, JSON
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 class Canonical(Base):
@@ -46,8 +46,69 @@ class Playlist(Base):
     link: Mapped[str] = mapped_column(String(128), unique = True, nullable = False)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete = "CASCADE"), nullable = False)
     created_at: Mapped[datetime] = mapped_column(DateTime, nullable = False)
+    account: Mapped[str] = mapped_column(String(64), nullable = False, server_default = "default")  # YouTube account which owns the playlist
+    items_etag: Mapped[str] = mapped_column(String(64), nullable = True)           # etag of items as last fetched from YouTube
+    items_synced_at: Mapped[datetime] = mapped_column(DateTime, nullable = True)   # None if items have never been mirrored
 
     user = relationship("User")
+    items = relationship("PlaylistItem", back_populates = "playlist", cascade = "all, delete", passive_deletes = True,
+                         order_by = "PlaylistItem.position")
+
+class PlaylistItem(Base):
+    __tablename__ = "playlist_items"
+
+    # local mirror of the items in a YouTube playlist
+    id: Mapped[str] = mapped_column(String(64), primary_key = True)   # playlist item id assigned by YouTube
+    playlist_id: Mapped[str] = mapped_column(ForeignKey("playlists.id", ondelete = "CASCADE"), nullable = False)
+    position: Mapped[int] = mapped_column(Integer, nullable = False)
+    kind: Mapped[str] = mapped_column(String(64), nullable = False)
+    etag: Mapped[str] = mapped_column(String(64), nullable = False)
+    video_id: Mapped[str] = mapped_column(String(32), nullable = False)
+    title: Mapped[str] = mapped_column(String(128), nullable = False)
+
+    __table_args__ = (
+        Index("playlist_position", "playlist_id", "position"),
+    )
+
+    playlist = relationship("Playlist", back_populates = "items")
+
+class PlaylistJob(Base):
+    __tablename__ = "playlist_jobs"
+
+    # a playlist being built in the background from a list of song titles
+    id: Mapped[int] = mapped_column(primary_key = True, autoincrement = True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete = "CASCADE"), nullable = False)
+    title: Mapped[str] = mapped_column(String(64), nullable = False)
+    privacy_status: Mapped[str] = mapped_column(String(16), nullable = False)
+    status: Mapped[str] = mapped_column(String(16), nullable = False)      # 'pending', 'running', 'succeeded' or 'failed'
+    detail: Mapped[str] = mapped_column(String(256), nullable = True)
+    playlist_id: Mapped[str] = mapped_column(ForeignKey("playlists.id", ondelete = "SET NULL"), nullable = True)  # set once created
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable = False)
+    finished_at: Mapped[datetime] = mapped_column(DateTime, nullable = True)
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime, nullable = True)  # updated as a running job makes progress
+
+    playlist = relationship("Playlist")
+    items = relationship("PlaylistJobItem", back_populates = "job", cascade = "all, delete", passive_deletes = True,
+                         order_by = "PlaylistJobItem.position")
+
+class PlaylistJobItem(Base):
+    __tablename__ = "playlist_job_items"
+
+    # progress of a single song within a playlist job
+    id: Mapped[int] = mapped_column(primary_key = True, autoincrement = True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("playlist_jobs.id", ondelete = "CASCADE"), nullable = False)
+    position: Mapped[int] = mapped_column(Integer, nullable = False)
+    song_title: Mapped[str] = mapped_column(String(64), nullable = False)
+    status: Mapped[str] = mapped_column(String(16), nullable = False)      # 'pending', 'resolved', 'inserted' or 'failed'
+    detail: Mapped[str] = mapped_column(String(256), nullable = True)
+    video_id: Mapped[str] = mapped_column(String(32), nullable = True)
+    video_title: Mapped[str] = mapped_column(String(128), nullable = True)
+
+    __table_args__ = (
+        Index("job_position", "job_id", "position"),
+    )
+
+    job = relationship("PlaylistJob", back_populates = "items")
 
 class Video(Base):
     __tablename__ = "videos"
@@ -64,12 +125,73 @@ class Video(Base):
     title = relationship("Canonical", back_populates = "video")
     user = relationship("User", back_populates = "videos")
 
+class QuotaLedgerEntry(Base):
+    __tablename__ = "quota_ledger"
+
+    # one row per call made against the YouTube Data API quota
+    id: Mapped[int] = mapped_column(primary_key = True, autoincrement = True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete = "SET NULL"), nullable = True)    # None for system work
+    account: Mapped[str] = mapped_column(String(64), nullable = False, server_default = "default")  # YouTube account charged
+    method: Mapped[str] = mapped_column(String(64), nullable = False)
+    units: Mapped[int] = mapped_column(Integer, nullable = False)
+    priority: Mapped[str] = mapped_column(String(16), nullable = False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable = False, index = True)    # UTC
+
+class SearchCacheEntry(Base):
+    __tablename__ = "search_cache"
+
+    # top YouTube search results for a query, shared by all users
+    query: Mapped[str] = mapped_column(String(255), primary_key = True)    # normalized, see cache.normalize_query
+    results: Mapped[list] = mapped_column(JSON, nullable = False)
+    fetched_at: Mapped[datetime] = mapped_column(DateTime, nullable = False)
+
+class VideoMetadata(Base):
+    __tablename__ = "video_metadata"
+
+    # title and channel of YouTube videos, shared by all users
+    id: Mapped[str] = mapped_column(String(32), primary_key = True)   # YouTube video id
+    video_title: Mapped[str] = mapped_column(String(128), nullable = False)
+    channel_name: Mapped[str] = mapped_column(String(128), nullable = False)
+    fetched_at: Mapped[datetime] = mapped_column(DateTime, nullable = False)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # the response to a request sent with an Idempotency-Key header, replayed if the request is retried
+    key: Mapped[str] = mapped_column(String(128), primary_key = True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete = "CASCADE"), primary_key = True)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable = False)     # hash of the route and request body
+    status_code: Mapped[int] = mapped_column(Integer, nullable = True)        # None while the request is in progress
+    response: Mapped[dict] = mapped_column(JSON, nullable = True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable = False)
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    # refresh tokens are JWTs; a row exists for each one that can still be used. Each is single-use, since
+    # exchanging it for a new access token also replaces it with a new refresh token
+    jti: Mapped[str] = mapped_column(String(36), primary_key = True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete = "CASCADE"), nullable = False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable = False)
+
+class ServiceKey(Base):
+    __tablename__ = "service_keys"
+
+    # the API key of a trusted service (see service_keys.py). Only an HMAC of the key's secret is stored
+    id: Mapped[str] = mapped_column(String(16), primary_key = True)
+    name: Mapped[str] = mapped_column(String(64), unique = True, nullable = False)
+    key_hash: Mapped[str] = mapped_column(String(64), nullable = False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable = False)
+    revoked_at: Mapped[datetime] = mapped_column(DateTime, nullable = True)
+
 class User(Base):
     __tablename__ = "users"
 
     id: Mapped[int] = mapped_column(primary_key = True, autoincrement = True)
     username: Mapped[str] = mapped_column(String(64), unique = True, nullable = False)
     password: Mapped[str] = mapped_column(String(256), nullable = False)
+    # the service which may act as this user, if any
+    created_by_service_id: Mapped[str] = mapped_column(ForeignKey("service_keys.id", ondelete = "SET NULL", name = "fk_users_created_by_service_id"), nullable = True)
 
     canonicals = relationship("Canonical", cascade = "all, delete", passive_deletes = True)
     alt_names = relationship("AltName", cascade = "all, delete", passive_deletes = True)
@@ -0,0 +1,116 @@
+"""
+Password hashing on a dedicated, bounded pool of threads. Argon2 is deliberately slow, so hashing in the
+request thread pool lets a burst of logins (e.g. a bot restarting and logging in every guild) starve
+unrelated requests. Here at most `PASSWORD_HASH_WORKERS` hashes run at once and at most
+`PASSWORD_HASH_QUEUE_LIMIT` more wait for a worker; beyond that, requests are turned away with 503
+instead of piling up.
+Hashing is still synchronous for the caller: the request thread blocks until its hash is done, so this must
+only be called from sync routes (which FastAPI runs in its thread pool), never from the event loop.
+"""
+from fastapi import HTTPException, status
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import logging
+import statistics
+import threading
+import time
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+class PasswordHashPool:
+    """
+    Runs hashes and verifications on its own threads, keeping track of how many are queued
+    """
+    def __init__(self, hasher: PasswordHash, workers: int, queue_limit: int):
+        """
+        Args:
+            workers: max number of hashes computed at once
+            queue_limit: max number of hashes waiting for a worker. Further hashes are rejected with 503
+        """
+        self.hasher = hasher
+        self._executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+
+        # metrics
+        self.queued = 0             # submitted but not started
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self._waits = deque(maxlen = 100)       # seconds recent hashes spent queued
+        self._durations = deque(maxlen = 100)   # seconds recent hashes took
+
+    def _run(self, func, *args):
+        # blocks the calling thread until the result is ready. Since slots are bounded, so is the number of 
+        # request threads waiting here
+        if not self._slots.acquire(blocking = False):
+            with self._lock:
+                self.rejected += 1
+            logger.warning("Password hash queue is full, rejecting request")
+            raise HTTPException(status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail = "Too many logins in progress. Please retry shortly",
+                                headers = {'Retry-After': '1'})
+        
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        def task():
+            started_at = time.perf_counter()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self._waits.append(started_at - submitted_at)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self._durations.append(time.perf_counter() - started_at)
+
+        try:
+            return self._executor.submit(task).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str):
+        return self._run(self.hasher.hash, password)
+
+    def verify_and_update(self, password: str, hashed_password: str):
+        """
+        Returns:
+            tuple[bool, str | None]: whether the password matches, and a new hash of it if the old one was
+            made with different parameters than the current ones
+        """
+        return self._run(self.hasher.verify_and_update, password, hashed_password)
+
+    def stats(self):
+        """
+        Summarizes the pool's load
+        """
+        with self._lock:
+            waits, durations = list(self._waits), list(self._durations)
+            return {'queued': self.queued,
+                    'running': self.running,
+                    'max_queued': self.max_queued,
+                    'completed': self.completed,
+                    'rejected': self.rejected,
+                    'median_wait': statistics.median(waits) if waits else None,
+                    'max_wait': max(waits) if waits else None,
+                    'median_duration': statistics.median(durations) if durations else None}
+
+pool = PasswordHashPool(
+    PasswordHash((Argon2Hasher(time_cost = settings.ARGON2_TIME_COST,
+                               memory_cost = settings.ARGON2_MEMORY_COST,
+                               parallelism = settings.ARGON2_PARALLELISM),)),
+    workers = settings.PASSWORD_HASH_WORKERS,
+    queue_limit = settings.PASSWORD_HASH_QUEUE_LIMIT
+)
@@ -0,0 +1,203 @@
+"""
+Accounting for the YouTube Data API's daily quota. Every call made by the backend is charged to a ledger
+before it is sent to Google, so that work can be rejected here instead of by YouTube with `quotaExceeded`.
+Each YouTube account (i.e. Google Cloud project, see accounts.py) has its own quota and its own scheduler.
+"""
+from fastapi import Depends, Header
+
+from sqlalchemy import select, func, distinct
+
+from typing import Literal
+from zoneinfo import ZoneInfo
+import datetime
+import threading
+
+from . import auth_utils
+from .config import settings
+from .database import Session as SessionLocal
+from .models import QuotaLedgerEntry
+
+# unit cost of each YouTube Data API method, keyed by the method id used by googleapiclient
+# see https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'youtube.search.list': 100,
+    'youtube.videos.list': 1,
+    'youtube.playlists.list': 1,
+    'youtube.playlists.insert': 50,
+    'youtube.playlists.update': 50,
+    'youtube.playlists.delete': 50,
+    'youtube.playlistItems.list': 1,
+    'youtube.playlistItems.insert': 50,
+    'youtube.playlistItems.update': 50,
+    'youtube.playlistItems.delete': 50,
+}
+DEFAULT_COST = 1
+
+Priority = Literal['interactive', 'bulk']
+
+DEFAULT_ACCOUNT = 'default'     # the account configured by the GOOGLE_* and YT_API_KEY settings
+
+# the quota resets at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+class QuotaExceededError(Exception):
+    """Raised when a call would exceed the daily budget available to its caller"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds until the quota resets
+
+def _quota_day_bounds():
+    """
+    Returns the start of the current quota day and the number of seconds until the next one.
+    Times are naive UTC, matching the `created_at` column of the ledger.
+    """
+    now = datetime.datetime.now(QUOTA_TIMEZONE)
+    start = now.replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+    end = start + datetime.timedelta(days = 1)
+
+    start_utc = start.astimezone(datetime.UTC).replace(tzinfo = None)
+    seconds_left = int((end - now).total_seconds()) + 1
+    return start_utc, seconds_left
+
+class QuotaScheduler:
+    """
+    Decides whether a call may be made, and records it in the ledger if so.
+
+    Interactive calls may draw on the whole daily budget. Bulk calls may only draw on the budget minus
+    a reserve kept for interactive work, and each user doing bulk work gets a fair share of that:
+    the bulk budget divided by the number of users who have used quota today, capped so that
+    the first user of the day can't use it all before anyone else shows up.
+    """
+    def __init__(self, daily_budget: int, interactive_reserve: float, bulk_user_cap: float, 
+                 account: str = DEFAULT_ACCOUNT):
+        """
+        Args:
+            daily_budget: the number of units available per day
+            interactive_reserve: the fraction of `daily_budget` which bulk work cannot use
+            bulk_user_cap: the max fraction of the bulk budget a single user can use
+            account: the name of the YouTube account whose quota this scheduler manages
+        """
+        self.account = account
+        self.daily_budget = daily_budget
+        self.bulk_budget = int(daily_budget * (1 - interactive_reserve))
+        self.bulk_user_cap = int(self.bulk_budget * bulk_user_cap)
+        self._lock = threading.Lock()   # serializes check-and-record so concurrent calls can't overdraw
+
+    def charge(self, method: str, user_id: int | None = None, priority: Priority = 'interactive'):
+        """
+        Records a call in the ledger, or raises QuotaExceededError if it doesn't fit in the caller's budget.
+        Args:
+            method: the method id of the call (e.g. 'youtube.search.list')
+            user_id: the user on whose behalf the call is made. `None` for system work (e.g. background jobs)
+            priority: 'interactive' for calls a user is waiting on, 'bulk' for imports and background work
+        Returns:
+            int: the number of units charged
+        """
+        units = QUOTA_COSTS.get(method, DEFAULT_COST)
+        day_start, seconds_left = _quota_day_bounds()
+
+        with self._lock, SessionLocal() as db:
+            used = db.scalar(select(func.coalesce(func.sum(QuotaLedgerEntry.units), 0))
+                             .where(QuotaLedgerEntry.created_at >= day_start)
+                             .where(QuotaLedgerEntry.account == self.account))
+
+            if priority == 'interactive':
+                if used + units > self.daily_budget:
+                    raise QuotaExceededError("Daily YouTube quota exhausted", seconds_left)
+            else:
+                if used + units > self.bulk_budget:
+                    raise QuotaExceededError("Daily YouTube quota for bulk work exhausted", seconds_left)
+
+                user_used = db.scalar(select(func.coalesce(func.sum(QuotaLedgerEntry.units), 0))
+                                      .where(QuotaLedgerEntry.created_at >= day_start)
+                                      .where(QuotaLedgerEntry.account == self.account)
+                                      .where(QuotaLedgerEntry.user_id == user_id))
+                active_users = db.scalar(select(func.count(distinct(QuotaLedgerEntry.user_id)))
+                                         .where(QuotaLedgerEntry.created_at >= day_start)
+                                         .where(QuotaLedgerEntry.account == self.account)
+                                         .where(QuotaLedgerEntry.user_id != user_id))
+                fair_share = min(self.bulk_budget // (active_users + 1), self.bulk_user_cap)
+                if user_used + units > fair_share:
+                    raise QuotaExceededError("Your share of today's YouTube quota for bulk work is exhausted",
+                                             seconds_left)
+
+            db.add(QuotaLedgerEntry(
+                user_id = user_id,
+                account = self.account,
+                method = method,
+                units = units,
+                priority = priority,
+                created_at = datetime.datetime.now(datetime.UTC).replace(tzinfo = None)
+            ))
+            db.commit()
+
+        return units
+
+    def usage(self, user_id: int | None = None):
+        """
+        Summarizes today's usage overall and, optionally, for a given user
+        """
+        day_start, seconds_left = _quota_day_bounds()
+
+        with SessionLocal() as db:
+            used = db.scalar(select(func.coalesce(func.sum(QuotaLedgerEntry.units), 0))
+                             .where(QuotaLedgerEntry.created_at >= day_start)
+                             .where(QuotaLedgerEntry.account == self.account))
+            user_used = db.scalar(select(func.coalesce(func.sum(QuotaLedgerEntry.units), 0))
+                                  .where(QuotaLedgerEntry.created_at >= day_start)
+                                  .where(QuotaLedgerEntry.account == self.account)
+                                  .where(QuotaLedgerEntry.user_id == user_id))
+
+        return {'daily_budget': self.daily_budget,
+                'bulk_budget': self.bulk_budget,
+                'used': used,
+                'remaining': max(self.daily_budget - used, 0),
+                'user_used': user_used,
+                'resets_in': seconds_left}
+
+    def remaining(self):
+        """
+        Returns the number of units left today
+        """
+        day_start, seconds_left = _quota_day_bounds()
+
+        with SessionLocal() as db:
+            used = db.scalar(select(func.coalesce(func.sum(QuotaLedgerEntry.units), 0))
+                             .where(QuotaLedgerEntry.created_at >= day_start)
+                             .where(QuotaLedgerEntry.account == self.account))
+        
+        return max(self.daily_budget - used, 0)
+
+schedulers = dict()     # maps account names to their schedulers
+
+def get_scheduler(account: str = DEFAULT_ACCOUNT, daily_budget: int | None = None):
+    """
+    Returns the scheduler of an account, creating it on first use.
+    Args:
+        daily_budget: the account's daily quota. Defaults to `YT_DAILY_QUOTA`.
+    """
+    if account not in schedulers or (daily_budget is not None and schedulers[account].daily_budget != daily_budget):
+        schedulers[account] = QuotaScheduler(daily_budget or settings.YT_DAILY_QUOTA,
+                                             settings.YT_INTERACTIVE_QUOTA_RESERVE, 
+                                             settings.YT_BULK_QUOTA_USER_CAP,
+                                             account = account)
+    return schedulers[account]
+
+class QuotaLedger:
+    """
+    Charges calls to the scheduler on behalf of a single caller
+    """
+    def __init__(self, user_id: int | None = None, priority: Priority = 'interactive'):
+        self.user_id = user_id
+        self.priority = priority
+
+    def charge(self, method: str, account: str = DEFAULT_ACCOUNT):
+        return get_scheduler(account).charge(method, self.user_id, self.priority)
+
+def get_quota_ledger(x_quota_priority: Priority = Header('interactive'),
+                     current_user = Depends(auth_utils.get_current_user)):
+    """
+    Dependency providing a ledger for the current user. Clients doing bulk work should send
+    the header `X-Quota-Priority: bulk`.
+    """
+    return QuotaLedger(user_id = current_user.id, priority = x_quota_priority)
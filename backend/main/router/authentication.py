@@ -3,8 +3,8 @@ from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
 from ..database import get_db
-from ..schema import UserLogin, Token
-from .. import auth_utils, models
+from ..schema import UserLogin, Token, TokenRefresh
+from .. import auth_utils, models, passwords
 
 router = APIRouter(
     prefix = '/authentication',
@@ -13,9 +13,16 @@ router = APIRouter(
 
 @router.post('/', response_model = Token)
 def login(user_credentials: OAuth2PasswordRequestForm = Depends(), 
+          service: models.ServiceKey | None = Depends(auth_utils.get_current_service),
           db: Session = Depends(get_db)):
     """
-    Login and generate JWT token
+    Login and generate JWT token, along with a refresh token which can be exchanged for new JWT tokens
+    without logging in again (see `POST /authentication/refresh`).
+    A service logging in (i.e. with a service key) may adopt the user by requesting the 'adopt' scope, after
+    which it may act as the user without logging in. This is for users the service used before it had a key;
+    users the service creates are its own already (see `POST /users`). A user can only be adopted by one 
+    service, and never without the 'adopt' scope, so knowing a user's password alone doesn't grant a service
+    lasting access
     """
     user = db.query(models.User).filter(
         models.User.username == user_credentials.username).first()
@@ -24,14 +31,45 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(),
         raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
                             detail = f'Invalid Credentials')
     
-    if not auth_utils.verify_password(user_credentials.password, user.password):
+    valid, updated_hash = auth_utils.verify_and_update_password(user_credentials.password, user.password)
+    if not valid:
         raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
                             detail = 'Invalid Credentials')
     
+    # the argon2 parameters changed since the password was hashed
+    if updated_hash is not None:
+        user.password = updated_hash
+        db.commit()
+
+    if service is not None and 'adopt' in user_credentials.scopes and user.created_by_service_id is None:
+        user.created_by_service_id = service.id
+        db.commit()
+    
     access_token = auth_utils.create_access_token(data = {'user_id': user.id})
+    refresh_token = auth_utils.create_refresh_token(db, user.id)
+
+    return {'access_token': access_token,
+            'token_type': 'bearer',
+            'refresh_token': refresh_token}
+
+@router.post('/refresh', response_model = Token)
+def refresh(token_refresh: TokenRefresh,
+            db: Session = Depends(get_db)):
+    """
+    Exchange a refresh token for a new JWT token. The refresh token is used up, and a new one is returned
+    in its place
+    """
+    credentials_exception = HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
+                                          detail = 'Invalid or expired refresh token',
+                                          headers = {'WWW-Authenticate': 'Bearer'})
+    user_id = auth_utils.redeem_refresh_token(db, token_refresh.refresh_token, credentials_exception)
+
+    access_token = auth_utils.create_access_token(data = {'user_id': user_id})
+    refresh_token = auth_utils.create_refresh_token(db, user_id)
 
     return {'access_token': access_token,
-            'token_type': 'bearer'}
+            'token_type': 'bearer',
+            'refresh_token': refresh_token}
 
 @router.get('/')
 def auth_ping(current_user = Depends(auth_utils.get_current_user)):
@@ -39,4 +77,14 @@ def auth_ping(current_user = Depends(auth_utils.get_current_user)):
     Check that current user is valid
     """
     return {"detail": "success"}
-    
\ No newline at end of file
+
+@router.get('/stats')
+def hash_pool_stats(service: models.ServiceKey | None = Depends(auth_utils.get_current_service)):
+    """
+    Load on the password hashing pool: hashes queued and running now, and recent wait times (in seconds).
+    Only available to services, since the pool is shared by all users
+    """
+    if service is None:
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
+                            detail = 'Only services may view hash pool stats')
+    return passwords.pool.stats()
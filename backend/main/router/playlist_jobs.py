@@ -0,0 +1,72 @@
+from fastapi import status, HTTPException, Depends, APIRouter, BackgroundTasks
+from fastapi.responses import StreamingResponse
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..schema import PlaylistJobCreate, PlaylistJobResponse
+from ..models import PlaylistJob
+from .. import auth_utils, jobs
+
+router = APIRouter(
+    prefix = "/playlist-jobs",
+    tags = ['Playlist Jobs']
+)
+
+@router.post("/", response_model = PlaylistJobResponse, status_code = status.HTTP_202_ACCEPTED)
+def create_playlist_job(details: PlaylistJobCreate,
+                        background_tasks: BackgroundTasks,
+                        db: Session = Depends(get_db),
+                        current_user = Depends(auth_utils.get_current_user)):
+    """
+    Start building a playlist from a list of song titles. Responds immediately; poll 
+    GET /playlist-jobs/{id} for progress.
+    """
+    song_titles = [title.strip() for title in details.song_titles if title.strip() != ""]
+    if not song_titles:
+        raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST,
+                            detail = "At least one song title is required")
+
+    job = jobs.create_playlist_job(db, current_user.id, details.title, details.privacy_status, song_titles)
+    background_tasks.add_task(jobs.run_playlist_job, job.id)
+
+    return jobs.summarize_job(job)
+
+@router.get("/{id}", response_model = PlaylistJobResponse)
+def get_playlist_job(id: int,
+                     db: Session = Depends(get_db),
+                     current_user = Depends(auth_utils.get_current_user)):
+    """
+    Get the progress of a playlist job, song by song
+    """
+    job = db.scalar(select(PlaylistJob).where(PlaylistJob.id == id))
+    if not job:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND,
+                            detail = f"Playlist job not found")
+    if job.user_id != current_user.id:
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
+                            detail = f"You do not have access to this playlist job")
+    
+    return jobs.summarize_job(job)
+
+@router.get("/{id}/events")
+def stream_playlist_job_events(id: int,
+                               db: Session = Depends(get_db),
+                               current_user = Depends(auth_utils.get_current_user)):
+    """
+    Stream the progress of a playlist job as Server-Sent Events. `item` events report the progress of 
+    a song and `job` events report the status of the job. The stream closes once the job finishes.
+    """
+    job = db.scalar(select(PlaylistJob).where(PlaylistJob.id == id))
+    if not job:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND,
+                            detail = f"Playlist job not found")
+    if job.user_id != current_user.id:
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
+                            detail = f"You do not have access to this playlist job")
+    
+    return StreamingResponse(jobs.stream_job_events(id), 
+                             media_type = "text/event-stream",
+                             headers = {'Cache-Control': 'no-cache',
+                                        'X-Accel-Buffering': 'no'})    # stop nginx from buffering the stream
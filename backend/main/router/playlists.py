@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter
+from fastapi import FastAPI, Response, status, HTTPException, Depends, APIRouter, Header
 
 from sqlalchemy import select, desc
 from sqlalchemy.orm import Session
@@ -14,19 +14,40 @@ from ..database import get_db
 from ..schema import (PlaylistCreate, PlaylistEdit, PlaylistResponse, 
                       PlaylistItemInsert, PlaylistItemRemove, 
                       PlaylistItemMove, PlaylistItemReplace, 
-                      PlaylistItemEdit, PlaylistItemResponse)
+                      PlaylistItemEdit, PlaylistItemResponse, PlaylistOrder)
 from ..models import Playlist
-from .. import auth_utils, youtube
+from .. import auth_utils, youtube, mirror, quota, accounts, idempotency
 
 router = APIRouter(
     prefix = "/playlists",
     tags = ['Playlists']
 )
 
+def _yt_write_failed(db: Session, record, e: Exception):
+    """
+    Settles the idempotency record of a request whose YouTube write failed, and returns the HTTPException to raise.
+    If the write may have been applied anyway (see `youtube.is_uncertain_write`), the error is stored as the
+    response of the key, so that a retry with the same key can't apply it a second time. Otherwise the key is 
+    released, so that a retry is carried out.
+    """
+    if isinstance(e, HttpError):
+        http_exception = youtube.http_exception_from(e)
+    elif youtube.is_uncertain_write(e):
+        http_exception = youtube.uncertain_write_exception()
+    else:
+        idempotency.abandon(db, record)
+        return e
+
+    if youtube.is_uncertain_write(e):
+        idempotency.complete(db, record, {'detail': http_exception.detail}, http_exception.status_code)
+    else:
+        idempotency.abandon(db, record)
+    return http_exception
+
 @router.get("/", response_model = List[PlaylistResponse])
-async def get_all_playlists(query_str: str = None,
-                            db: Session = Depends(get_db),
-                            current_user = Depends(auth_utils.get_current_user)):
+def get_all_playlists(query_str: str = None,
+                      db: Session = Depends(get_db),
+                      current_user = Depends(auth_utils.get_current_user)):
     """
     Get all playlists from database.
     """
@@ -44,8 +65,8 @@ async def get_all_playlists(query_str: str = None,
     return result
 
 @router.get("/latest", response_model = PlaylistResponse)
-async def get_recent_playlist(db: Session = Depends(get_db),
-                              current_user = Depends(auth_utils.get_current_user)):
+def get_recent_playlist(db: Session = Depends(get_db),
+                        current_user = Depends(auth_utils.get_current_user)):
     """
     Get most recent playlist accessible to the user
     """
@@ -65,8 +86,8 @@ async def get_recent_playlist(db: Session = Depends(get_db),
     return playlist
 
 @router.get("/{id}", response_model = PlaylistResponse)
-async def get_playlist(id: str, db: Session = Depends(get_db),
-                       current_user = Depends(auth_utils.get_current_user)):
+def get_playlist(id: str, db: Session = Depends(get_db),
+                 current_user = Depends(auth_utils.get_current_user)):
     """
     Get a specified playlist from database
     """
@@ -84,23 +105,34 @@ async def get_playlist(id: str, db: Session = Depends(get_db),
     return playlist
 
 @router.post("/", response_model = PlaylistResponse)
-async def create_playlist(details: PlaylistCreate, db: Session = Depends(get_db),
-                          yt_service: Resource = Depends(youtube.get_yt_service),
-                          current_user = Depends(auth_utils.get_current_user)):
+def create_playlist(details: PlaylistCreate, db: Session = Depends(get_db),
+                    ledger: quota.QuotaLedger = Depends(quota.get_quota_ledger),
+                    idempotency_key: str | None = Header(None, max_length = 128),
+                    current_user = Depends(auth_utils.get_current_user)):
     """
-    Create a playlist
+    Create a playlist. Retries sending the same Idempotency-Key header get the original response 
+    instead of creating another playlist.
     """
-    # create blank playlist through YT API
+    record = idempotency.begin(db, current_user.id, idempotency_key, "POST /playlists", details.model_dump())
+    if record is not None and record.status_code is not None:
+        return idempotency.replay(record)
+
+    # create blank playlist through YT API, with the account that has the most quota left.
+    # the playlist stays bound to that account, since only it can edit the playlist
+    account = accounts.pool.select()
     try:
-        playlist_editor = youtube.PlaylistEditor(
-            mode = 'create_new', 
-            title = details.title,
-            privacy_status = details.privacy_status,
-            yt_service = yt_service
-        )
-    except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
+        with youtube.build_yt_service(ledger, account) as yt_service:
+            playlist_editor = youtube.PlaylistEditor(
+                mode = 'create_new', 
+                title = details.title,
+                privacy_status = details.privacy_status,
+                yt_service = yt_service
+            )
+    except (HttpError, TimeoutError, ConnectionError) as e:
+        raise _yt_write_failed(db, record, e)
+    except (quota.QuotaExceededError, youtube.CircuitOpenError):
+        idempotency.abandon(db, record)
+        raise
 
     # record playlist details in database
     new_playlist = Playlist(
@@ -108,7 +140,9 @@ async def create_playlist(details: PlaylistCreate, db: Session = Depends(get_db)
         playlist_title = details.title,
         link = playlist_editor.link,
         user_id = current_user.id,
-        created_at = datetime.datetime.now()
+        created_at = datetime.datetime.now(),
+        account = account.name,
+        items_synced_at = datetime.datetime.now()     # new playlist is empty, so mirror is trivially in sync
     )
 
     db.add(new_playlist)
@@ -116,16 +150,18 @@ async def create_playlist(details: PlaylistCreate, db: Session = Depends(get_db)
         db.commit()
     except Exception as e:
         db.rollback()
+        idempotency.abandon(db, record)
         raise e
     
     db.refresh(new_playlist)
+    idempotency.complete(db, record, PlaylistResponse.model_validate(new_playlist, from_attributes = True))
     return new_playlist
 
 @router.patch("/{id}", response_model = PlaylistResponse)
-async def edit_playlist(id: str, edit_details: PlaylistEdit,
-                        db: Session = Depends(get_db),
-                        yt_service: Resource = Depends(youtube.get_yt_service),
-                        current_user = Depends(auth_utils.get_current_user)):
+def edit_playlist(id: str, edit_details: PlaylistEdit,
+                  db: Session = Depends(get_db),
+                  yt_service: Resource = Depends(youtube.get_playlist_yt_service),
+                  current_user = Depends(auth_utils.get_current_user)):
     """
     Edit a playlist's title (mandatory per the YouTube Data API) and/or privacy status (optional)
     """
@@ -154,8 +190,7 @@ async def edit_playlist(id: str, edit_details: PlaylistEdit,
         )
         response = request.execute()
     except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
+        raise youtube.http_exception_from(e)
 
     # record changes in db
     playlist.playlist_title = edit_details.title
@@ -165,9 +200,9 @@ async def edit_playlist(id: str, edit_details: PlaylistEdit,
     return playlist
 
 @router.delete("/{id}")
-async def delete_playlist(id: str, db: Session = Depends(get_db),
-                          yt_service: Resource = Depends(youtube.get_yt_service),
-                          current_user = Depends(auth_utils.get_current_user)):
+def delete_playlist(id: str, db: Session = Depends(get_db),
+                    yt_service: Resource = Depends(youtube.get_playlist_yt_service),
+                    current_user = Depends(auth_utils.get_current_user)):
     """
     Delete a specified playlist
     """
@@ -185,18 +220,17 @@ async def delete_playlist(id: str, db: Session = Depends(get_db),
     # delete actual playlist through YT API
     try:
         response = youtube.delete_playlist(id, yt_service)
-    # if YT API throws error, convert to Exception type native to FastAPI
+    # if YT API throws error (after retrying transient errors), convert to Exception type native to FastAPI
     except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
+        raise youtube.http_exception_from(e)
 
     return Response(status_code = status.HTTP_204_NO_CONTENT)
 
 @router.get("/{id}/items", response_model = List[PlaylistItemResponse])
-async def get_playlist_items(id: str,
-                             db: Session = Depends(get_db),
-                             yt_service: Resource = Depends(youtube.get_yt_service),
-                             current_user = Depends(auth_utils.get_current_user)):
+def get_playlist_items(id: str,
+                       db: Session = Depends(get_db),
+                       yt_service: Resource = Depends(youtube.get_playlist_yt_service),
+                       current_user = Depends(auth_utils.get_current_user)):
     """
     Get items (i.e. videos) from specified playlist
     """
@@ -209,25 +243,48 @@ async def get_playlist_items(id: str,
         raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
                             detail = f"You do not have access to this playlist")
     
-    # initialize editor
+    # serve from local mirror. Only calls YT API if the playlist hasn't been mirrored yet
     try:
-        playlist_editor = youtube.PlaylistEditor(mode = 'from_existing', playlist_id = id, yt_service = yt_service)
+        response = mirror.get_items(db, playlist, yt_service)
     except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
-
-    response = playlist_editor.items
+        raise youtube.http_exception_from(e)
 
     return response
 
+@router.post("/{id}/items/sync", response_model = List[PlaylistItemResponse])
+def sync_playlist_items(id: str,
+                        db: Session = Depends(get_db),
+                        yt_service: Resource = Depends(youtube.get_playlist_yt_service),
+                        current_user = Depends(auth_utils.get_current_user)):
+    """
+    Reconcile the local mirror of a playlist's items with YouTube (e.g. after editing the playlist on YouTube directly)
+    """
+    # check that playlist exists in db and that user has access to it
+    playlist = db.scalar(select(Playlist).where(Playlist.id == id))
+    if not playlist:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND,
+                            detail = f"Playlist not found")
+    if playlist.user_id != current_user.id:
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
+                            detail = f"You do not have access to this playlist")
+    
+    try:
+        mirror.reconcile_playlist(db, playlist, yt_service)
+    except HttpError as e:
+        raise youtube.http_exception_from(e)
+
+    return mirror.get_items(db, playlist, yt_service)
+
 @router.post("/{id}/items", response_model = PlaylistItemResponse)
-async def insert_video(id: str,
-                       details: PlaylistItemInsert, 
-                       db: Session = Depends(get_db),
-                       yt_service: Resource = Depends(youtube.get_yt_service),
-                       current_user = Depends(auth_utils.get_current_user)):
+def insert_video(id: str,
+                 details: PlaylistItemInsert,
+                 db: Session = Depends(get_db),
+                 yt_service: Resource = Depends(youtube.get_playlist_yt_service),
+                 idempotency_key: str | None = Header(None, max_length = 128),
+                 current_user = Depends(auth_utils.get_current_user)):
     """
-    Insert video into playlist at an optional pos. If no pos specified, video is inserted at end
+    Insert video into playlist at an optional pos. If no pos specified, video is inserted at end.
+    Retries sending the same Idempotency-Key header get the original response instead of inserting again.
     """
     # check that playlist exists in db and that user has access to it
     playlist = db.scalar(select(Playlist).where(Playlist.id == id))
@@ -238,12 +295,22 @@ async def insert_video(id: str,
         raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
                             detail = f"You do not have access to this playlist")
     
-    # initialize editor
+    record = idempotency.begin(db, current_user.id, idempotency_key, f"POST /playlists/{id}/items", details.model_dump())
+    if record is not None and record.status_code is not None:
+        return idempotency.replay(record)
+
+    # initialize editor from local mirror. The playlist stays locked until the edit is recorded
     try:
-        playlist_editor = youtube.PlaylistEditor(mode = 'from_existing', playlist_id = id, yt_service = yt_service)
+        playlist_editor = youtube.PlaylistEditor(mode = 'from_items', 
+                                                 playlist_id = id, 
+                                                 title = playlist.playlist_title,
+                                                 items = mirror.lock_items(db, playlist, yt_service))
     except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
+        idempotency.abandon(db, record)
+        raise youtube.http_exception_from(e)
+    except (quota.QuotaExceededError, youtube.CircuitOpenError):
+        idempotency.abandon(db, record)
+        raise
 
     # insert video
     try:
@@ -251,23 +318,30 @@ async def insert_video(id: str,
                                     pos = details.pos,
                                     yt_service = yt_service)
     except ValueError as e:
+        idempotency.abandon(db, record)
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST,
                             detail = str(e))
-    except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
+    except (HttpError, TimeoutError, ConnectionError) as e:
+        mirror.mark_stale(db, playlist)
+        raise _yt_write_failed(db, record, e)
+    except (quota.QuotaExceededError, youtube.CircuitOpenError):
+        idempotency.abandon(db, record)
+        raise
         
+    # record change in local mirror
+    mirror.write_items(db, playlist, playlist_editor.items)
     
     response = playlist_editor.items[details.pos if details.pos is not None else -1]
+    idempotency.complete(db, record, response)
 
     return response
 
 @router.patch("/{id}/items", response_model = PlaylistItemResponse)
-async def edit_playlist_item(id: str,
-                             details: PlaylistItemEdit, 
-                             db: Session = Depends(get_db),
-                             yt_service: Resource = Depends(youtube.get_yt_service),
-                             current_user = Depends(auth_utils.get_current_user)):
+def edit_playlist_item(id: str,
+                       details: PlaylistItemEdit,
+                       db: Session = Depends(get_db),
+                       yt_service: Resource = Depends(youtube.get_playlist_yt_service),
+                       current_user = Depends(auth_utils.get_current_user)):
     """
     Replace or move video within a playlist
     """
@@ -280,12 +354,14 @@ async def edit_playlist_item(id: str,
         raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
                             detail = f"You do not have access to this playlist")
     
-    # initialize editor
+    # initialize editor from local mirror. The playlist stays locked until the edit is recorded
     try:
-        playlist_editor = youtube.PlaylistEditor(mode = 'from_existing', playlist_id = id, yt_service = yt_service)
+        playlist_editor = youtube.PlaylistEditor(mode = 'from_items', 
+                                                 playlist_id = id, 
+                                                 title = playlist.playlist_title,
+                                                 items = mirror.lock_items(db, playlist, yt_service))
     except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
+        raise youtube.http_exception_from(e)
     
     response = None
     if details.mode == "Move":
@@ -297,8 +373,12 @@ async def edit_playlist_item(id: str,
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST,
                                 detail = str(e))
         except HttpError as e:
-            raise HTTPException(status_code = e.status_code,
-                                detail = e.error_details[0]['message'])
+            mirror.mark_stale(db, playlist)
+            raise youtube.http_exception_from(e)
+        except (TimeoutError, ConnectionError):
+            # the move may have been applied before YouTube stopped responding
+            mirror.mark_stale(db, playlist)
+            raise youtube.uncertain_write_exception()
         response = playlist_editor.items[details.sub_details.target_pos]
     elif details.mode == "Replace":
         try:
@@ -309,18 +389,29 @@ async def edit_playlist_item(id: str,
             raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST,
                                 detail = str(e))
         except HttpError as e:
-            raise HTTPException(status_code = e.status_code,
-                                detail = e.error_details[0]['message'])
+            mirror.mark_stale(db, playlist)
+            raise youtube.http_exception_from(e)
+        except (TimeoutError, ConnectionError):
+            # the delete, and maybe the insert, may have been applied before YouTube stopped responding
+            mirror.mark_stale(db, playlist)
+            raise youtube.uncertain_write_exception()
+        except (quota.QuotaExceededError, youtube.CircuitOpenError):
+            # the delete may have gone through before the insert was rejected
+            mirror.mark_stale(db, playlist)
+            raise
         response = playlist_editor.items[details.sub_details.pos]
 
+    # record change in local mirror
+    mirror.write_items(db, playlist, playlist_editor.items)
+
     return response
 
 @router.delete("/{id}/items")
-async def remove_playlist_item(id: str,
-                               details: PlaylistItemRemove, 
-                               db: Session = Depends(get_db),
-                               yt_service: Resource = Depends(youtube.get_yt_service),
-                               current_user = Depends(auth_utils.get_current_user)):
+def remove_playlist_item(id: str,
+                         details: PlaylistItemRemove,
+                         db: Session = Depends(get_db),
+                         yt_service: Resource = Depends(youtube.get_playlist_yt_service),
+                         current_user = Depends(auth_utils.get_current_user)):
     """
     Remove a video within a specified playlist
     """
@@ -333,12 +424,14 @@ async def remove_playlist_item(id: str,
         raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
                             detail = f"You do not have access to this playlist")
     
-    # initialize editor
+    # initialize editor from local mirror. The playlist stays locked until the edit is recorded
     try:
-        playlist_editor = youtube.PlaylistEditor(mode = 'from_existing', playlist_id = id, yt_service = yt_service)
+        playlist_editor = youtube.PlaylistEditor(mode = 'from_items', 
+                                                 playlist_id = id, 
+                                                 title = playlist.playlist_title,
+                                                 items = mirror.lock_items(db, playlist, yt_service))
     except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
+        raise youtube.http_exception_from(e)
     
     try:
         playlist_editor.delete_video(pos = details.pos, yt_service = yt_service)
@@ -346,7 +439,61 @@ async def remove_playlist_item(id: str,
         raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST,
                             detail = str(e))
     except HttpError as e:
-        raise HTTPException(status_code = e.status_code,
-                            detail = e.error_details[0]['message'])
+        mirror.mark_stale(db, playlist)
+        raise youtube.http_exception_from(e)
+    except (TimeoutError, ConnectionError):
+        # the delete may have been applied before YouTube stopped responding
+        mirror.mark_stale(db, playlist)
+        raise youtube.uncertain_write_exception()
+
+    # record change in local mirror
+    mirror.write_items(db, playlist, playlist_editor.items)
 
     return Response(status_code = status.HTTP_204_NO_CONTENT)
+
+@router.put("/{id}/order", response_model = List[PlaylistItemResponse])
+def reorder_playlist(id: str,
+                     details: PlaylistOrder,
+                     db: Session = Depends(get_db),
+                     yt_service: Resource = Depends(youtube.get_playlist_yt_service),
+                     current_user = Depends(auth_utils.get_current_user)):
+    """
+    Rearrange a playlist to match a sequence of video ids. Only the minimal set of moves is issued, 
+    videos not in the sequence are removed, and videos missing from the playlist are inserted
+    """
+    # check that playlist exists in db and that user has access to it
+    playlist = db.scalar(select(Playlist).where(Playlist.id == id))
+    if not playlist:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND,
+                            detail = f"Playlist not found")
+    if playlist.user_id != current_user.id:
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
+                            detail = f"You do not have access to this playlist")
+    
+    # initialize editor from local mirror. The playlist stays locked until the edit is recorded
+    try:
+        playlist_editor = youtube.PlaylistEditor(mode = 'from_items', 
+                                                 playlist_id = id, 
+                                                 title = playlist.playlist_title,
+                                                 items = mirror.lock_items(db, playlist, yt_service))
+    except HttpError as e:
+        raise youtube.http_exception_from(e)
+    
+    try:
+        playlist_editor.reorder(video_ids = details.video_ids, yt_service = yt_service)
+    except HttpError as e:
+        mirror.mark_stale(db, playlist)
+        raise youtube.http_exception_from(e)
+    except (TimeoutError, ConnectionError):
+        # some of the changes may have been applied before YouTube stopped responding
+        mirror.mark_stale(db, playlist)
+        raise youtube.uncertain_write_exception()
+    except (quota.QuotaExceededError, youtube.CircuitOpenError):
+        # some of the changes may have gone through before the rest were rejected
+        mirror.mark_stale(db, playlist)
+        raise
+
+    # record changes in local mirror
+    mirror.write_items(db, playlist, playlist_editor.items)
+
+    return playlist_editor.items
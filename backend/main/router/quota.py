@@ -0,0 +1,17 @@
+from fastapi import Depends, APIRouter
+
+from .. import auth_utils, accounts
+from ..schema import QuotaUsageResponse
+
+router = APIRouter(
+    prefix = "/quota",
+    tags = ['Quota']
+)
+
+@router.get("/", response_model = QuotaUsageResponse)
+def get_quota_usage(current_user = Depends(auth_utils.get_current_user)):
+    """
+    Get today's YouTube Data API quota usage across all YouTube accounts, overall and for the current user
+    """
+    return accounts.pool.usage(current_user.id)
+
@@ -14,15 +14,19 @@ router = APIRouter(
 )
 
 @router.post("/", status_code = status.HTTP_201_CREATED, response_model = UserResponse)
-def create_user(user_input: UserCreate, db: Session = Depends(get_db)):
+def create_user(user_input: UserCreate, 
+                service: models.ServiceKey | None = Depends(auth_utils.get_current_service),
+                db: Session = Depends(get_db)):
     """
-    Create a user
+    Create a user. If created by a service (i.e. with a service key), then the service may act as the user
     """
     # hash the password
     hashed_password = auth_utils.hash(user_input.password)
     user_input.password = hashed_password
     
     new_user = models.User(**user_input.model_dump())
+    if service is not None:
+        new_user.created_by_service_id = service.id
     
     db.add(new_user)
     try:
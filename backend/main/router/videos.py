@@ -0,0 +1,56 @@
+from fastapi import status, HTTPException, Depends, APIRouter, Query
+
+from sqlalchemy.orm import Session
+
+from googleapiclient.discovery import Resource
+from googleapiclient.errors import HttpError
+
+from typing import List
+
+from ..database import get_db
+from ..schema import VideoResponse, VideoSearchResponse
+from .. import auth_utils, youtube, cache
+
+router = APIRouter(
+    prefix = "/videos",
+    tags = ['Videos']
+)
+
+@router.get("/search", response_model = VideoSearchResponse)
+def search_videos(q: str = Query(min_length = 1, max_length = 255),
+                  db: Session = Depends(get_db),
+                  yt_service: Resource = Depends(youtube.get_yt_service),
+                  current_user = Depends(auth_utils.get_current_user)):
+    """
+    Search YouTube for videos. Results are cached across all users, so repeated searches 
+    for the same query cost no quota until the cached results expire.
+    """
+    try:
+        entry, cached = cache.search_videos(db, q, yt_service)
+    except HttpError as e:
+        raise youtube.http_exception_from(e)
+    
+    if not entry.results:
+        raise HTTPException(status_code = status.HTTP_404_NOT_FOUND,
+                            detail = f"No videos found for '{q}'")
+
+    return {'query': entry.query,
+            'cached': cached,
+            'fetched_at': entry.fetched_at,
+            'results': entry.results}
+
+@router.get("/", response_model = List[VideoResponse])
+def get_videos(ids: List[str] = Query(min_length = 1, max_length = youtube.MAX_VIDEO_IDS_PER_CALL),
+               db: Session = Depends(get_db),
+               yt_service: Resource = Depends(youtube.get_yt_service),
+               current_user = Depends(auth_utils.get_current_user)):
+    """
+    Get the title and channel of up to 50 videos, e.g. /videos?ids=abc&ids=def. Videos seen before
+    by any user are answered without calling YouTube. Ids of videos which don't exist are omitted.
+    """
+    try:
+        videos = cache.get_videos(db, ids, yt_service)
+    except HttpError as e:
+        raise youtube.http_exception_from(e)
+
+    return [videos[video_id] for video_id in dict.fromkeys(ids) if video_id in videos]
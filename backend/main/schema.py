@@ -22,6 +22,10 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class TokenRefresh(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     id: Optional[int] = None
@@ -81,6 +85,16 @@ class VideoResponse(BaseModel):
     link: str
 
 
+class VideoSearchResponse(BaseModel):
+    """
+    API response for a YouTube search
+    """
+    query: str
+    cached: bool                    # True if the results were served without calling YouTube
+    fetched_at: datetime
+    results: List[VideoResponse]
+
+
 # FULL SONG RESOURCE
 class SongCreate(CanonicalCreate):
     """
@@ -181,4 +195,54 @@ class PlaylistItemRemove(BaseModel):
     """
     User input for removing a video from a playlist
     """
-    pos: int
\ No newline at end of file
+    pos: int
+
+class PlaylistOrder(BaseModel):
+    """
+    User input for rearranging a playlist to match a sequence of videos
+    """
+    video_ids: List[str]
+
+# PLAYLIST JOBS
+class PlaylistJobCreate(PlaylistCreate):
+    """
+    User input for building a playlist in the background from a list of song titles
+    """
+    song_titles: List[str]
+
+class PlaylistJobItemResponse(BaseModel):
+    """
+    API response for sending the progress of a song within a playlist job
+    """
+    position: int
+    song_title: str
+    status: str
+    detail: str | None = None
+    video_id: str | None = None
+    video_title: str | None = None
+
+class PlaylistJobResponse(BaseModel):
+    """
+    API response for sending the progress of a playlist job
+    """
+    id: int
+    title: str
+    status: str
+    detail: str | None = None
+    playlist_id: str | None = None
+    link: str | None = None
+    created_at: datetime
+    finished_at: datetime | None = None
+    items: List[PlaylistJobItemResponse]
+
+# QUOTA
+class QuotaUsageResponse(BaseModel):
+    """
+    API response summarizing today's YouTube Data API quota usage
+    """
+    daily_budget: int
+    bulk_budget: int
+    used: int
+    remaining: int
+    user_used: int
+    resets_in: int
@@ -0,0 +1,87 @@
+"""
+API keys for trusted services (e.g. the Discord bot) which act on behalf of many users over one connection.
+A request authenticated with a service key names the user it acts as in the `X-Act-As-User` header, and a
+service may only act as users it created (or adopted, by logging in as them once with the 'adopt' scope).
+
+Keys have the form `psk_<key id>_<secret>`. Only an HMAC of the secret is stored, and it is compared in
+constant time, so checking a key is cheap compared to verifying a password.
+
+Keys are issued from the command line:
+    python -m main.service_keys create <name>
+    python -m main.service_keys revoke <name>
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import argparse
+import datetime
+import hashlib
+import hmac
+import secrets
+
+from .config import settings
+from .models import ServiceKey
+
+KEY_PREFIX = 'psk'
+_HMAC_KEY = settings.SECRET_KEY.get_secret_value().encode()
+
+def _digest(secret: str):
+    return hmac.new(_HMAC_KEY, secret.encode(), hashlib.sha256).hexdigest()
+
+def create_service_key(db: Session, name: str):
+    """
+    Issues a key for a new service
+    Returns:
+        str: the key. It cannot be recovered later, since only its HMAC is stored
+    """
+    key_id = secrets.token_hex(8)
+    secret = secrets.token_urlsafe(32)
+    db.add(ServiceKey(id = key_id, 
+                      name = name, 
+                      key_hash = _digest(secret), 
+                      created_at = datetime.datetime.now()))
+    db.commit()
+    return f"{KEY_PREFIX}_{key_id}_{secret}"
+
+def verify_service_key(db: Session, key: str):
+    """
+    Returns the ServiceKey a key belongs to, or None if the key is malformed, unknown or revoked
+    """
+    # secrets are urlsafe base64, which can contain '_', so only the first two separators are split on
+    parts = key.split('_', 2)
+    if len(parts) != 3 or parts[0] != KEY_PREFIX:
+        return None
+    _, key_id, secret = parts
+
+    service = db.get(ServiceKey, key_id)
+    if service is None or service.revoked_at is not None:
+        return None
+    if not hmac.compare_digest(_digest(secret), service.key_hash):
+        return None
+    return service
+
+def revoke_service_key(db: Session, name: str):
+    """
+    Revokes the key of a service. Returns False if there is no active key with that name
+    """
+    service = db.scalar(select(ServiceKey).where(ServiceKey.name == name))
+    if service is None or service.revoked_at is not None:
+        return False
+    service.revoked_at = datetime.datetime.now()
+    db.commit()
+    return True
+
+if __name__ == '__main__':
+    from .database import Session as SessionLocal
+
+    parser = argparse.ArgumentParser(description = "Manage API keys of trusted services")
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    subparsers.add_parser('create', help = "issue a key for a new service").add_argument('name')
+    subparsers.add_parser('revoke', help = "revoke the key of a service").add_argument('name')
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == 'create':
+            print(create_service_key(db, args.name))
+        elif not revoke_service_key(db, args.name):
+            parser.exit(1, f"No active key for service '{args.name}'\n")
@@ -1,67 +1,484 @@
-from fastapi import Depends
+from fastapi import Depends, HTTPException, status
 
-from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import Resource, build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+import google_auth_httplib2
+import httplib2
 
-from typing import Literal
+from sqlalchemy.orm import Session
+
+from typing import Literal, List
 import os
 import ast
 import pickle
+import hashlib
+import bisect
+import functools
+import random
+import time
+import datetime
+import email.utils
+import logging
+import threading
+import asyncio
+from collections import defaultdict, deque
 
 from .config import settings
 from .schema import PlaylistCreate
+from .quota import QuotaLedger, get_quota_ledger, DEFAULT_ACCOUNT
+from .accounts import pool as account_pool, YouTubeAccount
+from .database import get_db
+from .models import Playlist
+
+logger = logging.getLogger(__name__)
+
+# retry policy for calls to the YT API
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5          # seconds
+RETRY_MAX_DELAY = 8.0           # cap on the backoff between two attempts
+RETRY_AFTER_LIMIT = 30          # if YouTube asks us to wait longer than this, fail instead of blocking the request
+
+# errors which YouTube documents as transient. 403s with these reasons are rate limits rather than permission
+# errors, and 409 SERVICE_UNAVAILABLE is returned when concurrent writes to the same playlist collide
+RETRYABLE_REASONS = {'backendError', 'internalError', 'rateLimitExceeded', 'userRateLimitExceeded', 'SERVICE_UNAVAILABLE'}
+
+# for these methods, a 5xx doesn't tell us whether the write went through, so retrying could duplicate it
+NON_IDEMPOTENT_METHODS = {'youtube.playlists.insert', 'youtube.playlistItems.insert'}
+
+def _error_reasons(e: HttpError):
+    """
+    Returns the set of `reason` fields of the errors in a YT API error response
+    """
+    if not isinstance(e.error_details, list):
+        return set()
+    return {detail.get('reason') for detail in e.error_details if isinstance(detail, dict)}
+
+def _retry_after(e: HttpError):
+    """
+    Returns the number of seconds requested by the Retry-After header of a response, or None if absent
+    """
+    value = e.resp.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        # HTTP-date form
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(int((retry_at - datetime.datetime.now(datetime.UTC)).total_seconds()), 0)
+        except (TypeError, ValueError):
+            return None
+
+def is_rate_limited(e: HttpError):
+    """
+    Returns True if the request was rejected before being applied (i.e. it is always safe to retry)
+    """
+    return (e.status_code == 429 
+            or (e.status_code in (403, 409) and bool(_error_reasons(e) & RETRYABLE_REASONS)))
+
+def is_retryable(e: HttpError, method_id: str | None = None):
+    """
+    Returns True if a failed call may succeed when retried
+    """
+    if is_rate_limited(e):
+        return True
+    if e.status_code >= 500:
+        return method_id not in NON_IDEMPOTENT_METHODS
+    return False
+
+def is_uncertain_write(e: Exception, method_id: str | None = None):
+    """
+    Returns True if a failed call to a non-idempotent method may have been applied anyway, i.e. YouTube failed 
+    (5xx) or stopped responding after receiving it. Such a call must not be repeated blindly.
+    Args:
+        method_id: the method of the failed call. Defaults to the method recorded on the error by `YouTubeRequest`
+    """
+    if method_id is None:
+        method_id = getattr(e, 'method_id', None)
+    if method_id not in NON_IDEMPOTENT_METHODS:
+        return False
+    if isinstance(e, HttpError):
+        return e.status_code >= 500
+    return isinstance(e, (TimeoutError, ConnectionError))
+
+def uncertain_write_exception(detail: str = ""):
+    """
+    Returns the HTTPException reported for a write which may or may not have been applied (see `is_uncertain_write`)
+    """
+    return HTTPException(status_code = status.HTTP_502_BAD_GATEWAY,
+                         detail = f"YouTube failed while applying the change, which may or may not have "
+                                  f"been applied. {detail}".strip())
+
+def http_exception_from(e: HttpError, method_id: str | None = None):
+    """
+    Converts an error raised by the YT API into an HTTPException. Transient errors (which have already 
+    been retried by `YouTubeRequest`) are reported as 503 so that clients know they may try again later.
+    A 5xx from a non-idempotent call is reported as 502 instead, since the write may have been applied and
+    retrying it could duplicate it.
+    Args:
+        method_id: the method of the failed call (e.g. 'youtube.playlistItems.insert'). Defaults to the method
+            recorded on the error by `YouTubeRequest`
+    """
+    if method_id is None:
+        method_id = getattr(e, 'method_id', None)
+
+    if isinstance(e.error_details, list) and e.error_details and isinstance(e.error_details[0], dict):
+        detail = e.error_details[0].get('message', e.reason)
+    else:
+        detail = e.reason
+
+    if is_uncertain_write(e, method_id):
+        return uncertain_write_exception(detail)
+
+    if is_retryable(e, method_id):
+        retry_after = _retry_after(e)
+        return HTTPException(status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+                             detail = detail,
+                             headers = {'Retry-After': str(retry_after if retry_after is not None else 1)})
+
+    return HTTPException(status_code = e.status_code,
+                         detail = detail)
+
+# circuit breaker policy. The breaker looks at the calls made in the last BREAKER_WINDOW seconds
+BREAKER_WINDOW = 60
+BREAKER_MIN_CALLS = 10              # don't judge YouTube's health on fewer calls than this
+BREAKER_FAILURE_RATE = 0.5          # trip if at least this fraction of calls failed transiently...
+BREAKER_SLOW_CALL_RATE = 0.5        # ...or at least this fraction were slow
+BREAKER_SLOW_CALL_SECONDS = 5.0
+BREAKER_OPEN_SECONDS = 30           # how long to fail fast before letting a trial call through
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling YouTube while it is known to be failing"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds until a trial call will be let through
+
+class CircuitBreaker:
+    """
+    Stops calls to YouTube while it is failing or slow, so that requests fail fast instead of waiting on
+    timeouts, and so that we don't add load to a struggling service. 
 
-API_KEY = settings.YT_API_KEY.get_secret_value()
-
-# initialize credentials for building yt_service
-credentials = Credentials(
-    token = settings.GOOGLE_TOKEN.get_secret_value(),
-    refresh_token = settings.GOOGLE_REFRESH_TOKEN.get_secret_value(),
-    token_uri = settings.GOOGLE_TOKEN_URI.get_secret_value(),
-    client_id = settings.GOOGLE_CLIENT_ID.get_secret_value(),
-    client_secret = settings.GOOGLE_CLIENT_SECRET.get_secret_value(),
-    scopes = ["https://www.googleapis.com/auth/youtubepartner", 
-              "https://www.googleapis.com/auth/youtube", 
-              "https://www.googleapis.com/auth/youtube.force-ssl"]
-)
-
-# Don't need to worry about refreshing credentials. 
-# This is done by googleapiclient in the backend when making requests
-# if not credentials.valid:
-#     credentials.refresh(Request())
-
-def get_yt_service():
-    yt_service = build('youtube', 'v3', 
-                       credentials = credentials, 
-                       developerKey = API_KEY)
+    Closed: calls go through and their outcomes are recorded. Trips to open when, among the calls in the window,
+    the rate of transient failures or of slow calls crosses its threshold.
+    Open: calls raise CircuitOpenError without being sent. After `BREAKER_OPEN_SECONDS`, becomes half-open.
+    Half-open: a single trial call goes through. If it succeeds the breaker closes, otherwise it opens again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = deque()       # (finished_at, failed, slow) of recent calls
+        self.state = 'closed'
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.trip_count = 0
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError if a call may not be made now
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return
+            
+            remaining = BREAKER_OPEN_SECONDS - (time.monotonic() - self._opened_at)
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            
+            raise CircuitOpenError("YouTube is currently unavailable. Please retry later", 
+                                   max(int(remaining) + 1, 1))
+
+    def cancel(self):
+        """
+        Signals that a call let through by `before_call` was not made after all
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, failed: bool, latency: float):
+        """
+        Records the outcome of a call let through by `before_call`
+        Args:
+            failed: True if the call failed in a way that suggests YouTube is unhealthy (5xx, rate limit, timeout)
+            latency: seconds the call took
+        """
+        now = time.monotonic()
+        slow = latency >= BREAKER_SLOW_CALL_SECONDS
+
+        with self._lock:
+            if self.state == 'half_open':
+                self._trial_in_flight = False
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self.state = 'closed'
+                    self._calls.clear()
+                    logger.info("Circuit breaker closed: YouTube trial call succeeded")
+                return
+            
+            self._calls.append((now, failed, slow))
+            while self._calls and self._calls[0][0] < now - BREAKER_WINDOW:
+                self._calls.popleft()
+
+            if self.state != 'closed' or len(self._calls) < BREAKER_MIN_CALLS:
+                return
+            
+            failure_rate = sum(call[1] for call in self._calls) / len(self._calls)
+            slow_rate = sum(call[2] for call in self._calls) / len(self._calls)
+            if failure_rate >= BREAKER_FAILURE_RATE or slow_rate >= BREAKER_SLOW_CALL_RATE:
+                logger.warning(f"Circuit breaker opened: {failure_rate:.0%} of recent YouTube calls failed, "
+                               f"{slow_rate:.0%} were slow")
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = 'open'
+        self._opened_at = now
+        self.trip_count += 1
+
+    def stats(self):
+        """
+        Summarizes the breaker's state and the calls in its window
+        """
+        with self._lock:
+            calls = list(self._calls)
+            return {'state': self.state,
+                    'trips': self.trip_count,
+                    'recent_calls': len(calls),
+                    'recent_failures': sum(call[1] for call in calls),
+                    'recent_slow_calls': sum(call[2] for call in calls)}
+
+breaker = CircuitBreaker()     # shared by all yt_services, since an outage affects every account alike
+
+class YouTubeRequest(HttpRequest):
+    """
+    An HttpRequest which:
+    - charges its cost to a quota ledger before each attempt, so that every call made through a yt_service 
+      is accounted for
+    - retries transient errors with bounded exponential backoff and full jitter, honoring Retry-After. 
+      Non-retryable errors are raised immediately.
+    - goes through the circuit breaker, raising CircuitOpenError instead of calling YouTube while it is failing
+    """
+    def __init__(self, *args, ledger: QuotaLedger | None = None, account: str = DEFAULT_ACCOUNT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ledger = ledger
+        self.account = account      # the YouTube account whose quota is charged
+
+    def execute(self, http = None, num_retries = 0):
+        for attempt in range(RETRY_MAX_ATTEMPTS):
+            # raise CircuitOpenError or QuotaExceededError before anything is sent to YouTube
+            breaker.before_call()
+            if self.ledger is not None:
+                try:
+                    self.ledger.charge(self.methodId, self.account)
+                except Exception:
+                    breaker.cancel()
+                    raise
+
+            start = time.perf_counter()
+            try:
+                response = super().execute(http = http, num_retries = num_retries)
+                breaker.record(failed = False, latency = time.perf_counter() - start)
+                return response
+            except HttpError as e:
+                e.method_id = self.methodId     # lets http_exception_from tell whether the call can be retried
+                breaker.record(failed = is_retryable(e), latency = time.perf_counter() - start)
+                if not is_retryable(e, self.methodId) or attempt == RETRY_MAX_ATTEMPTS - 1:
+                    raise
+
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+                elif delay > RETRY_AFTER_LIMIT:
+                    raise
+                
+                logger.info(f"Retrying {self.methodId} in {delay:.2f}s after HTTP {e.status_code} (attempt {attempt + 1})")
+            except (TimeoutError, ConnectionError) as e:
+                e.method_id = self.methodId     # lets is_uncertain_write tell whether the call may have been applied
+                breaker.record(failed = True, latency = time.perf_counter() - start)
+                if self.methodId in NON_IDEMPOTENT_METHODS or attempt == RETRY_MAX_ATTEMPTS - 1:
+                    raise
+                
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+                logger.info(f"Retrying {self.methodId} in {delay:.2f}s after {type(e).__name__} (attempt {attempt + 1})")
+            except Exception:
+                # any other failure (e.g. DNS, TLS, credential refresh) still has to settle the call, 
+                # otherwise a half-open breaker would wait for its trial call forever
+                breaker.record(failed = True, latency = time.perf_counter() - start)
+                raise
+
+            time.sleep(delay)
+
+def build_yt_service(ledger: QuotaLedger | None = None, account: YouTubeAccount | None = None):
+    """
+    Builds a client for the YouTube Data API. Used directly by code running outside of a request 
+    (e.g. background jobs); routes should depend on `get_yt_service` or `get_playlist_yt_service` instead.
+    Args:
+        ledger: the ledger each call is charged to. If `None`, calls are charged as bulk system work.
+        account: the YouTube account to make calls with. If `None`, the account with the most quota left is used.
+    """
+    if ledger is None:
+        ledger = QuotaLedger(user_id = None, priority = 'bulk')
+    if account is None:
+        account = account_pool.select()
+
+    client_options = None
+    if settings.YT_API_ENDPOINT is not None:
+        client_options = {'api_endpoint': settings.YT_API_ENDPOINT}
+
+    # bound how long a slow YouTube can hold a request (googleapiclient waits indefinitely by default)
+    http = httplib2.Http(timeout = settings.YT_HTTP_TIMEOUT_SECONDS)
+    if account.credentials is not None:
+        http = google_auth_httplib2.AuthorizedHttp(account.credentials, http = http)
+
+    return build('youtube', 'v3', 
+                 http = http,
+                 developerKey = account.api_key,
+                 client_options = client_options,
+                 requestBuilder = functools.partial(YouTubeRequest, ledger = ledger, account = account.name))
+
+def get_yt_service(ledger: QuotaLedger = Depends(get_quota_ledger)):
+    """
+    Dependency providing a client for new work (e.g. searches, new playlists), made with the account 
+    with the most quota left
+    """
+    yt_service = build_yt_service(ledger)
+    try:
+        yield yt_service
+    finally:
+        yt_service.close()
+
+def get_playlist_account(playlist: Playlist):
+    """
+    Returns the account which owns a playlist. Only it can edit the playlist.
+    """
+    try:
+        return account_pool.get(playlist.account)
+    except KeyError:
+        raise HTTPException(status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail = f"The YouTube account owning this playlist is not configured")
+
+def get_playlist_yt_service(id: str, 
+                            ledger: QuotaLedger = Depends(get_quota_ledger),
+                            db: Session = Depends(get_db)):
+    """
+    Dependency providing a client for editing the playlist with id `id`, made with the account which owns it.
+    If the playlist doesn't exist, any account is used (the route is expected to respond with 404).
+    """
+    playlist = db.get(Playlist, id)
+    account = get_playlist_account(playlist) if playlist is not None else None
+    
+    yt_service = build_yt_service(ledger, account)
     try:
         yield yt_service
     finally:
         yt_service.close()
 
-def search_video(query_string: str, yt_service: Resource = Depends(get_yt_service)):
+def search_videos(query_string: str, yt_service: Resource = Depends(get_yt_service), max_results: int = 5):
+    """
+    Searches for YouTube videos via the search endpoint. Costs 100 quota units regardless of `max_results`.
+    Args:
+        query_string: the string passed to the YouTube Data API for searching
+        max_results: the number of results to return, between 1 and 50
+    Returns:
+        list: the top results, as dicts of form {'id': ..., 'video_title': ..., 'channel_name': ..., 'link': ...}
+    """
     root = 'http://youtu.be/'
 
     request = yt_service.search().list(
         part = "snippet",
         q = query_string,
-        type = "video"
+        type = "video",
+        maxResults = max_results
     )
     response = request.execute()
     
-    top_vid = response['items'][0]
+    results = []
+    for vid in response['items']:
+        id = vid['id']['videoId']
+        results.append({'id': id,
+                        'video_title': vid['snippet']['title'],
+                        'channel_name': vid['snippet']['channelTitle'],
+                        'link': root + id})
+    
+    return results
+
+MAX_VIDEO_IDS_PER_CALL = 50     # max number of ids accepted by videos.list
 
-    id = top_vid['id']['videoId']
-    title = top_vid['snippet']['title']
-    channel = top_vid['snippet']['channelTitle']
-    link = root + id
+def fetch_videos(video_ids: List[str], yt_service: Resource = Depends(get_yt_service)):
+    """
+    Fetches the title and channel of up to 50 videos with a single call to the videos endpoint. Costs 1 quota unit.
+    Args:
+        video_ids: a list of at most 50 YouTube video ids
+    Returns:
+        list: a dict of form {'id': ..., 'video_title': ..., 'channel_name': ..., 'link': ...} for each video found. 
+        Ids of videos which don't exist are omitted.
+    """
+    if len(video_ids) > MAX_VIDEO_IDS_PER_CALL:
+        raise ValueError(f"At most {MAX_VIDEO_IDS_PER_CALL} video ids can be fetched at once, but received {len(video_ids)}")
     
-    return {'id': id,
-            'title': title,
-            'channel': channel,
-            'link': link}
+    root = 'http://youtu.be/'
+
+    request = yt_service.videos().list(
+        part = 'id,snippet',
+        id = ','.join(video_ids),
+        maxResults = MAX_VIDEO_IDS_PER_CALL
+    )
+    response = request.execute()
+
+    return [{'id': item['id'],
+             'video_title': item['snippet']['title'],
+             'channel_name': item['snippet']['channelTitle'],
+             'link': root + item['id']}
+            for item in response['items']]
+
+def parse_playlist_item(item: dict):
+    """
+    Converts a playlistItem resource returned by the YouTube Data API into the 
+    dict format used throughout this module
+    """
+    return {'kind': item['kind'], 
+            'etag': item['etag'], 
+            'item_id': item['id'],
+            'video_id': item['snippet']['resourceId']['videoId'], 
+            'title': item['snippet']['title']}
+
+def fetch_playlist_items(playlist_id: str, yt_service: Resource = Depends(get_yt_service)):
+    """
+    Fetches every item in a playlist, following pagination (the API returns at most 50 items per page).
+    Args:
+        playlist_id: a string representing the playlist_id of an existing YouTube playlist
+    Returns:
+        tuple: the etag of the items (a single etag summarizing all pages), and a list of dicts of 
+        form {'kind': ..., 'etag': ..., 'item_id': ..., 'video_id': ..., 'title': ...}
+    """
+    items = []
+    etags = []
+    page_token = None
+    while True:
+        request = yt_service.playlistItems().list(
+            part = "id,snippet",
+            playlistId = playlist_id,
+            maxResults = 50,
+            pageToken = page_token
+        )
+        response = request.execute()
+
+        etags.append(response['etag'])
+        items.extend(parse_playlist_item(item) for item in response['items'])
+
+        page_token = response.get('nextPageToken')
+        if page_token is None:
+            break
+
+    # each page has its own etag, so combine them if the playlist spans several pages
+    etag = etags[0] if len(etags) == 1 else hashlib.sha1(','.join(etags).encode()).hexdigest()
+
+    return etag, items
 
 def delete_playlist(playlist_id: str, yt_service: Resource = Depends(get_yt_service)):
     request = yt_service.playlists().delete(
@@ -71,12 +488,44 @@ def delete_playlist(playlist_id: str, yt_service: Resource = Depends(get_yt_serv
 
     return response
 
+def longest_increasing_subsequence(seq: List[int]):
+    """
+    Finds a longest strictly increasing subsequence of `seq` in O(n log n) time.
+    Args:
+        seq: a list of ints
+    Returns:
+        list: the indices (in increasing order) of the elements of `seq` making up the subsequence
+    """
+    tail_values = []            # tail_values[k] is the smallest tail of an increasing subsequence of length k+1
+    tail_indices = []           # index in seq of each element of tail_values
+    prev = [None] * len(seq)    # prev[i] is the index preceding i in the best subsequence ending at i
+
+    for i, value in enumerate(seq):
+        k = bisect.bisect_left(tail_values, value)
+        if k > 0:
+            prev[i] = tail_indices[k - 1]
+        if k == len(tail_values):
+            tail_values.append(value)
+            tail_indices.append(i)
+        else:
+            tail_values[k] = value
+            tail_indices[k] = i
+
+    # walk back from the tail of the longest subsequence
+    result = []
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        result.append(i)
+        i = prev[i]
+
+    return result[::-1]
+
 class PlaylistEditor:
     """
     A class representing YouTube playlists. Instances of this class maintain information concerning the playlist 
     (i.e. its title, id, and link) and the items within the playlist (i.e. their kind, etag, id, and title).
     """
-    def __init__(self, mode = Literal['create_new', 'from_existing'], **kwargs):
+    def __init__(self, mode = Literal['create_new', 'from_existing', 'from_items'], **kwargs):
         """
         Initializes object in one of two ways by calling one of two helper methods.
         Args:
@@ -85,10 +534,13 @@ class PlaylistEditor:
             contain `title` and `privacy_status` arguments.
             If 'from_existing', then the object is initialized by fetching data through the YouTube Data API 
             concerning an existing playlist. In this case, kwargs should contain a `playlist_id` argument.  
+            If 'from_items', then the object is initialized from already known items (e.g. the local mirror 
+            in the database) without calling the YouTube Data API. In this case, kwargs should contain 
+            `playlist_id`, `title`, and `items` arguments.
             kwargs: arguments passed to the chosen initializer helper method.
         """
-        if mode not in ['create_new', 'from_existing']:
-            raise ValueError(f"mode must be one of 'create_new', 'from_existing', but received {mode}")
+        if mode not in ['create_new', 'from_existing', 'from_items']:
+            raise ValueError(f"mode must be one of 'create_new', 'from_existing', 'from_items', but received {mode}")
         
         self.title = None   # string title of playlist
         self.link = None    # link to playlist
@@ -99,6 +551,8 @@ class PlaylistEditor:
             self._init_create_new(**kwargs)
         elif mode == 'from_existing':
             self._init_from_existing(**kwargs)
+        elif mode == 'from_items':
+            self._init_from_items(**kwargs)
 
     def _init_create_new(self, title: str, 
                          privacy_status: Literal["public", "private", "unlisted"] = "private",
@@ -161,19 +615,23 @@ class PlaylistEditor:
             raise e
         
         # get items in existing playlist
-        request = yt_service.playlistItems().list(
-            part = "id,snippet",
-            playlistId = playlist_id
-        )
-        playlist_items_response = request.execute()
-        
-        # get relevant items from response
-        self.items = [{'kind': item['kind'], 
-                       'etag': item['etag'], 
-                       'item_id': item['id'],
-                       'video_id': item['snippet']['resourceId']['videoId'], 
-                       'title': item['snippet']['title']} 
-                       for item in playlist_items_response['items']]
+        etag, self.items = fetch_playlist_items(playlist_id, yt_service)
+
+    def _init_from_items(self, playlist_id: str, title: str, items: List[dict]):
+        """
+        Helper function for __init__ which initializes instance from already known playlist items, 
+        without making any calls to the YouTube Data API
+        Args:
+            playlist_id: a string representing the playlist_id of an existing YouTube playlist
+            title: the title of the playlist
+            items: a list of dicts of form {'kind': ..., 'etag': ..., 'item_id': ..., 'video_id': ..., 'title': ...}
+        """
+        root = "https://youtube.com/playlist?list="
+
+        self.title = title
+        self.link = root + playlist_id
+        self.id = playlist_id
+        self.items = list(items)
 
     def insert_video(self, video_id: str, pos: int = None, yt_service: Resource = Depends(get_yt_service)):
         """
@@ -282,6 +740,69 @@ class PlaylistEditor:
         self.delete_video(pos, yt_service)
         self.insert_video(video_id, pos, yt_service)
 
+    def reorder(self, video_ids: List[str], yt_service: Resource = Depends(get_yt_service)):
+        """
+        Rearranges the playlist so that its videos match `video_ids`, using as few calls to the YouTube Data API
+        as possible. Items whose video is not in `video_ids` are deleted and videos not yet in the playlist are inserted. 
+        Of the remaining items, those along a longest increasing subsequence (i.e. the largest set of items already 
+        in the correct relative order) stay put, and only the others are moved.
+        Args:
+            video_ids: the desired sequence of video ids. A video may appear more than once.
+        Returns:
+            dict: the number of API calls made for each operation, of the form {'deleted': ..., 'moved': ..., 'inserted': ...}
+        """
+        counts = {'deleted': 0, 'moved': 0, 'inserted': 0}
+
+        # pair each current item with a slot in video_ids. Repeated videos are paired in order of appearance
+        slots = defaultdict(deque)
+        for i, video_id in enumerate(video_ids):
+            slots[video_id].append(i)
+        item_slots = [slots[item['video_id']].popleft() if slots[item['video_id']] else None 
+                      for item in self.items]
+
+        # delete unpaired items, back to front so that pending positions aren't shifted
+        for pos in reversed(range(len(self.items))):
+            if item_slots[pos] is None:
+                self.delete_video(pos, yt_service)
+                counts['deleted'] += 1
+        item_slots = [slot for slot in item_slots if slot is not None]
+        slot_item_ids = {slot: item['item_id'] for slot, item in zip(item_slots, self.items)}
+
+        # items along the LIS of their slots are already in order relative to each other
+        placed = {item_slots[i] for i in longest_increasing_subsequence(item_slots)}
+
+        # walk the desired order, placing every other slot directly after its (already placed) predecessor
+        for slot, video_id in enumerate(video_ids):
+            if slot in placed:
+                continue
+
+            target_pos = 0 if slot == 0 else self._find_item(slot_item_ids[slot - 1]) + 1
+            if slot in slot_item_ids:
+                init_pos = self._find_item(slot_item_ids[slot])
+                if init_pos < target_pos:
+                    # removing the item from its current position shifts its predecessor back by one
+                    target_pos -= 1
+                if init_pos != target_pos:
+                    self.move_video(init_pos, target_pos, yt_service)
+                    counts['moved'] += 1
+            else:
+                self.insert_video(video_id, target_pos, yt_service)
+                slot_item_ids[slot] = self.items[target_pos]['item_id']
+                counts['inserted'] += 1
+
+            placed.add(slot)
+
+        return counts
+
+    def _find_item(self, item_id: str):
+        """
+        Returns the current position of the item with the given playlist item id
+        """
+        for pos, item in enumerate(self.items):
+            if item['item_id'] == item_id:
+                return pos
+        raise ValueError(f"No item with id {item_id} in playlist")
+
     def __str__(self):
         return f"Playlist({self.title})"
 
@@ -295,3 +816,22 @@ class PlaylistEditor:
             print(f"\t({i}) {item['title']}")
         print(f"Link: {self.link}")
 
+def log_stats():
+    """
+    Logs the circuit breaker's stats and each account's credential refresh stats
+    """
+    logger.info(f"YouTube circuit breaker: {breaker.stats()}")
+    for account in account_pool:
+        if account.credential_manager is not None:
+            logger.info(f"YouTube credentials of account '{account.name}': {account.credential_manager.stats()}")
+
+async def run_stats_log_loop():
+    """
+    Runs `log_stats` every `YT_STATS_LOG_MINUTES` until cancelled
+    """
+    while True:
+        await asyncio.sleep(settings.YT_STATS_LOG_MINUTES * 60)
+        try:
+            log_stats()
+        except Exception as e:
+            logger.exception(f"Could not log YouTube stats: {e}")
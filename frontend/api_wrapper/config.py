@@ -4,6 +4,12 @@ from pydantic import SecretStr
 class Settings(BaseSettings):
     BASE_URL: str
 
+    # connection pool shared by API clients (see endpoints.create_shared_client)
+    HTTP2: bool = False                     # multiplex requests over HTTP/2 connections. Requires the h2 package
+    MAX_CONNECTIONS: int = 20
+    MAX_KEEPALIVE_CONNECTIONS: int = 10
+    KEEPALIVE_EXPIRY: float = 30.0          # seconds an idle connection is kept open
+
     model_config = SettingsConfigDict(env_file = '.env.dev', env_file_encoding = 'utf-8',
                                       extra = 'ignore')
 
@@ -1,25 +1,193 @@
 import httpx
+import asyncio
+import json
 import warnings
+from contextlib import asynccontextmanager
 from typing import List, Optional, Literal
 
 from .config import settings
+from . import tracing
 from .exceptions import (AuthenticationError, AuthorizationError, NotFoundError, YTServiceError,
-                         ConflictError, VideoLinkParserError, PartialOperationWarning)
+                         ConflictError, VideoLinkParserError, PartialOperationWarning, QuotaExceededError,
+                         UncertainWriteError)
 
 BASE_URL = settings.BASE_URL
 
+def _idempotency_headers(idempotency_key: str | None):
+    return {'Idempotency-Key': idempotency_key} if idempotency_key is not None else {}
+
+class TokenAuth(httpx.Auth):
+    """
+    Attaches the access token to every request. If a request is rejected with 401 and a refresh token is known,
+    the token pair is renewed with `POST /authentication/refresh` and the request is sent again, so expired
+    access tokens don't require logging in again.
+    """
+    def __init__(self, url = BASE_URL):
+        self.auth_url = url + '/authentication'
+        self.access_token = None
+        self.refresh_token = None
+        self.on_tokens_changed = None   # called with no arguments whenever new tokens are set, e.g. to save them
+        self._lock = asyncio.Lock()     # concurrent 401s share one refresh, since refresh tokens are single-use
+
+    def set_tokens(self, access_token: str, refresh_token: str | None = None):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        if self.on_tokens_changed is not None:
+            self.on_tokens_changed()
+
+    def _authorize(self, request: httpx.Request):
+        if self.access_token is not None:
+            request.headers['Authorization'] = f"Bearer {self.access_token}"
+
+    async def async_auth_flow(self, request: httpx.Request):
+        self._authorize(request)
+        sent_token = self.access_token
+        response = yield request
+
+        # login and refresh requests are never retried
+        if response.status_code != 401 or str(request.url).startswith(self.auth_url):
+            return
+        
+        async with self._lock:
+            # skip refreshing if another request already did while this one waited
+            if self.access_token == sent_token and self.refresh_token is not None:
+                refresh_response = yield httpx.Request('POST', self.auth_url + '/refresh',
+                                                       json = {'refresh_token': self.refresh_token})
+                await refresh_response.aread()
+                if refresh_response.status_code == 200:
+                    tokens = refresh_response.json()
+                    self.set_tokens(tokens['access_token'], tokens.get('refresh_token'))
+                else:
+                    # expired or already used
+                    self.refresh_token = None
+            
+            # no new token to send, so the 401 goes back to the caller as it is
+            if self.access_token == sent_token:
+                return
+        
+        self._authorize(request)
+        yield request
+
+class ServiceAuth(httpx.Auth):
+    """
+    Authenticates requests with the API key of a trusted service. The service acts as the user whose id is
+    in `act_as_user_id`, which must be a user the service created or adopted (see `APIWrapper.login`).
+    """
+    def __init__(self, service_key: str):
+        self.service_key = service_key
+        self.act_as_user_id = None
+
+    def auth_flow(self, request: httpx.Request):
+        request.headers['X-API-Key'] = self.service_key
+        if self.act_as_user_id is not None:
+            request.headers['X-Act-As-User'] = str(self.act_as_user_id)
+        yield request
+
+def create_shared_client(http2: bool = settings.HTTP2):
+    """
+    Creates an HTTP client which many API clients (e.g. one per guild) can share, so that they reuse one
+    pool of connections. Requests are authenticated individually (see `AuthenticatedClient`), so the client
+    itself holds no credentials.
+    """
+    if http2:
+        try:
+            import h2
+        except ImportError:
+            warnings.warn("HTTP2 is enabled but the h2 package is not installed. Falling back to HTTP/1.1")
+            http2 = False
+    
+    return httpx.AsyncClient(follow_redirects = True,
+                             timeout = 60.0,
+                             http2 = http2,
+                             limits = httpx.Limits(max_connections = settings.MAX_CONNECTIONS,
+                                                   max_keepalive_connections = settings.MAX_KEEPALIVE_CONNECTIONS,
+                                                   keepalive_expiry = settings.KEEPALIVE_EXPIRY))
+
+class AuthenticatedClient():
+    """
+    Sends requests through a (possibly shared) httpx.AsyncClient, authenticating each one with its own `auth`.
+    Each request is timed as a span of the current trace, if any (see `api_wrapper.tracing`)
+    """
+    def __init__(self, client: httpx.AsyncClient, auth: httpx.Auth | None, 
+                 span_kind: str = 'api', youtube_methods: tuple = ()):
+        """
+        Args:
+            span_kind: the kind of span requests are timed as
+            youtube_methods: HTTP methods whose requests make the API call YouTube, which are timed as 'youtube'
+        """
+        self.client = client
+        self.auth = auth
+        self.span_kind = span_kind
+        self.youtube_methods = youtube_methods
+
+    def _auth(self):
+        # an explicit None would disable any auth set on the client itself
+        return self.auth if self.auth is not None else httpx.USE_CLIENT_DEFAULT
+
+    def _span_kind(self, method: str):
+        return 'youtube' if method.upper() in self.youtube_methods else self.span_kind
+
+    async def request(self, method: str, url: str, **kwargs):
+        with tracing.span(self._span_kind(method)):
+            response = await self.client.request(method, url, auth = self._auth(), **kwargs)
+        
+        # 4xx responses are mostly a user's mistakes, but rate limits and server errors are worth counting
+        trace = tracing.current_trace()
+        if trace is not None and (response.status_code == 429 or response.status_code >= 500):
+            trace.errors.append(f"{self._span_kind(method)}: HTTP {response.status_code}")
+        return response
+
+    async def get(self, url: str, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def put(self, url: str, **kwargs):
+        return await self.request('PUT', url, **kwargs)
+
+    async def patch(self, url: str, **kwargs):
+        return await self.request('PATCH', url, **kwargs)
+
+    async def delete(self, url: str, **kwargs):
+        return await self.request('DELETE', url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        # the span covers the whole stream, since streams wait on work done by the API
+        with tracing.span(self._span_kind(method)):
+            async with self.client.stream(method, url, auth = self._auth(), **kwargs) as response:
+                yield response
+
 class Endpoint():
-    def __init__(self, client, url = BASE_URL):
+    SPAN_KIND = 'api'       # kind of span this endpoint's requests are timed as (see `api_wrapper.tracing`)
+    YOUTUBE_METHODS = ()    # HTTP methods whose requests make the API call YouTube
+
+    def __init__(self, client: httpx.AsyncClient, auth: httpx.Auth | None = None, url = BASE_URL):
+        """
+        Args:
+            client: the HTTP client to send requests with. May be shared with other endpoints and users
+            auth: authenticates each request, e.g. `TokenAuth` or `ServiceAuth`
+        """
         self.base_url = url
-        self.client: httpx.AsyncClient = client
+        self.client = AuthenticatedClient(client, auth, 
+                                          span_kind = self.SPAN_KIND, 
+                                          youtube_methods = self.YOUTUBE_METHODS)
 
     def _check_common_exceptions(self, response):
         if response.status_code == 500:
             raise RuntimeError("Unexpected server error")
+        elif response.status_code == 502:
+            # not retried, since retrying could apply the write twice
+            raise UncertainWriteError(response.json()['detail'])
         elif response.status_code == 503:
-            raise YTServiceError("YT service momentarily unavailable. Please retry")
+            retry_after = response.headers.get('retry-after')
+            raise YTServiceError("YT service momentarily unavailable. Please retry", 
+                                 int(retry_after) if retry_after is not None else None)
         elif response.status_code == 429:
-            raise RuntimeError("API received too many requests")
+            retry_after = response.headers.get('retry-after')
+            raise QuotaExceededError(response.json()['detail'], 
+                                     int(retry_after) if retry_after is not None else None)
         elif response.status_code == 422:
             # type validation error
             error_message = ""
@@ -30,8 +198,10 @@ class Endpoint():
             raise AuthenticationError(response.json()['detail'])
         
 class Authentication(Endpoint):
-    def __init__(self, client):
-        super().__init__(client)
+    SPAN_KIND = 'auth'
+
+    def __init__(self, client, auth = None):
+        super().__init__(client, auth)
         self.url = self.base_url + '/authentication'
 
     async def get(self):
@@ -39,11 +209,17 @@ class Authentication(Endpoint):
         self._check_common_exceptions(response)
         return response
 
-    async def post(self, username: str, password: str):
+    async def post(self, username: str, password: str, adopt: bool = False):
+        """
+        Logs in. With a service key, `adopt` makes the service act as the user from then on
+        """
+        data = {'username': username,
+                'password': password}
+        if adopt:
+            data['scope'] = 'adopt'
         response = await self.client.post(
             self.url,
-            data = {'username': username,
-                    'password': password})
+            data = data)
         
         self._check_common_exceptions(response)
         
@@ -53,9 +229,18 @@ class Authentication(Endpoint):
         
         return response
 
+    async def refresh(self, refresh_token: str):
+        # raises AuthenticationError (401) if the refresh token is invalid, expired or already used
+        response = await self.client.post(
+            self.url + '/refresh',
+            json = {'refresh_token': refresh_token})
+        
+        self._check_common_exceptions(response)
+        return response
+
 class Users(Endpoint):
-    def __init__(self, client):
-        super().__init__(client)
+    def __init__(self, client, auth = None):
+        super().__init__(client, auth)
         self.url = self.base_url + '/users'
 
     async def post(self, username: str, password: str):
@@ -71,8 +256,8 @@ class Users(Endpoint):
         return response
 
 class AltNames(Endpoint):
-    def __init__(self, client):
-        super().__init__(client)
+    def __init__(self, client, auth = None):
+        super().__init__(client, auth)
         self.url = self.base_url + '/alt-names'
 
     async def post(self, title: str, canonical_id: int):
@@ -154,8 +339,8 @@ class AltNames(Endpoint):
         return response
 
 class Songs(Endpoint):
-    def __init__(self, client):
-        super().__init__(client)
+    def __init__(self, client, auth = None):
+        super().__init__(client, auth)
         self.url = self.base_url + '/songs'
 
     async def post(self, title: str):
@@ -290,19 +475,75 @@ class Songs(Endpoint):
             raise AuthorizationError(response.json()['detail'])
         return response
 
+class Quota(Endpoint):
+    def __init__(self, client, auth = None):
+        super().__init__(client, auth)
+        self.url = self.base_url + '/quota'
+
+    async def get(self):
+        response = await self.client.get(self.url)
+        self._check_common_exceptions(response)
+        return response
+
+class Videos(Endpoint):
+    YOUTUBE_METHODS = ('GET',)
+
+    def __init__(self, client, auth = None):
+        super().__init__(client, auth)
+        self.url = self.base_url + '/videos'
+
+    async def get(self, video_ids: List[str], priority: Literal["interactive", "bulk"] = "interactive"):
+        """
+        Fetches the title and channel of up to 50 videos. Videos seen before by any user cost no quota.
+        Args:
+            video_ids: a list of at most 50 YouTube video ids
+            priority: 'interactive' for calls a user is waiting on, 'bulk' for imports
+        """
+        response = await self.client.get(
+            self.url,
+            params = {'ids': video_ids},
+            headers = {'X-Quota-Priority': priority})
+        self._check_common_exceptions(response)
+        return response
+
+    async def search(self, query_str: str):
+        """
+        Searches YouTube for videos. Results are cached by the API, so repeated searches are free.
+        """
+        response = await self.client.get(
+            self.url + '/search',
+            params = {'q': query_str})
+        self._check_common_exceptions(response)
+        if response.status_code == 404:
+            # no videos found
+            raise NotFoundError(response.json()['detail'])
+        
+        return response
+
 class Playlists(Endpoint):
-    def __init__(self, client):
-        super().__init__(client)
+    # playlists are read from the API's database, but changes are made on YouTube
+    YOUTUBE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+    def __init__(self, client, auth = None):
+        super().__init__(client, auth)
         self.url = self.base_url + '/playlists'
 
-    async def post(self, title: str, privacy_status: str): 
+    async def post(self, title: str, privacy_status: str, idempotency_key: str | None = None): 
+        """
+        Creates a playlist. Pass the same `idempotency_key` when retrying a call, so that the playlist 
+        is only created once.
+        """
         response = await self.client.post(
             self.url,
             json = {'title': title,
-                    'privacy_status': privacy_status})
+                    'privacy_status': privacy_status},
+            headers = _idempotency_headers(idempotency_key))
         self._check_common_exceptions(response)
         if response.status_code == 409:
-            raise YTServiceError("YT service momentarily unavailable. Please retry")
+            # the same idempotency key is still being processed
+            retry_after = response.headers.get('retry-after')
+            raise YTServiceError("YT service momentarily unavailable. Please retry", 
+                                 int(retry_after) if retry_after is not None else None)
         
         return response
 
@@ -382,18 +623,26 @@ class Playlists(Endpoint):
         
         return response
 
-    async def post_item(self, id: str, video_id: str, pos: int | None = None):
+    async def post_item(self, id: str, video_id: str, pos: int | None = None, idempotency_key: str | None = None):
+        """
+        Inserts a video into a playlist. Pass the same `idempotency_key` when retrying a call, so that the video 
+        is only inserted once.
+        """
         response = await self.client.post(
             self.url + f'/{id}' + '/items',
             json = {'video_id': video_id,
-                    'pos': pos})
+                    'pos': pos},
+            headers = _idempotency_headers(idempotency_key))
         self._check_common_exceptions(response)
         if response.status_code == 404:
             raise NotFoundError(response.json()['detail'])
         elif response.status_code == 403:
             raise AuthorizationError(response.json()['detail'])
         elif response.status_code == 409:
-            raise YTServiceError("YT service momentarily unavailable. Please retry")
+            # the same idempotency key is still being processed
+            retry_after = response.headers.get('retry-after')
+            raise YTServiceError("YT service momentarily unavailable. Please retry", 
+                                 int(retry_after) if retry_after is not None else None)
         
         return response
 
@@ -442,3 +691,90 @@ class Playlists(Endpoint):
         
         return response
 
+    async def put_order(self, id: str, video_ids: List[str]):
+        """
+        Calls put method at /playlist/{id}/order route. This rearranges a playlist to match `video_ids`,
+        removing and inserting videos as needed.
+        Args:
+            id: id of playlist
+            video_ids: the desired sequence of video ids
+        """
+        response = await self.client.put(
+            self.url + f'/{id}' + '/order',
+            json = {'video_ids': video_ids})
+        self._check_common_exceptions(response)
+        if response.status_code == 404:
+            raise NotFoundError(response.json()['detail'])
+        elif response.status_code == 403:
+            raise AuthorizationError(response.json()['detail'])
+        elif response.status_code == 400:
+            raise ValueError(response.json()['detail'])
+        elif response.status_code == 409:
+            raise YTServiceError("YT service momentarily unavailable. Please retry")
+        
+        return response
+
+class PlaylistJobs(Endpoint):
+    # waiting on a job is waiting on the YouTube calls it makes
+    YOUTUBE_METHODS = ('GET', 'POST')
+
+    def __init__(self, client, auth = None):
+        super().__init__(client, auth)
+        self.url = self.base_url + '/playlist-jobs'
+
+    async def post(self, title: str, privacy_status: str, song_titles: List[str]):
+        """
+        Starts building a playlist from a list of song titles in the background. The response describes the job;
+        poll `get` with its id for progress.
+        """
+        response = await self.client.post(
+            self.url,
+            json = {'title': title,
+                    'privacy_status': privacy_status,
+                    'song_titles': song_titles})
+        self._check_common_exceptions(response)
+        if response.status_code == 400:
+            raise ValueError(response.json()['detail'])
+        
+        return response
+
+    async def get(self, id: int):
+        response = await self.client.get(self.url + f'/{id}')
+        self._check_common_exceptions(response)
+        if response.status_code == 404:
+            raise NotFoundError(response.json()['detail'])
+        elif response.status_code == 403:
+            raise AuthorizationError(response.json()['detail'])
+        
+        return response
+
+    async def events(self, id: int):
+        """
+        Streams the progress of a job. Yields dicts of form {'event': ..., 'data': ...}, where 'event' is 'item' 
+        (the progress of a song) or 'job' (the status of the job). Stops once the job finishes.
+        """
+        async with self.client.stream('GET', self.url + f'/{id}' + '/events') as response:
+            if response.status_code != 200:
+                await response.aread()
+                self._check_common_exceptions(response)
+                if response.status_code == 404:
+                    raise NotFoundError(response.json()['detail'])
+                elif response.status_code == 403:
+                    raise AuthorizationError(response.json()['detail'])
+            
+            # parse the Server-Sent Events format: fields on separate lines, events separated by blank lines
+            event, data = 'message', []
+            async for line in response.aiter_lines():
+                if line == '':
+                    if data:
+                        yield {'event': event, 'data': json.loads('\n'.join(data))}
+                    event, data = 'message', []
+                elif line.startswith(':'):
+                    continue    # keep-alive comment
+                else:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'event':
+                        event = value
+                    elif field == 'data':
+                        data.append(value)
@@ -11,8 +11,20 @@ class NotFoundError(Exception):
 class ConflictError(Exception):
     """Corresponds to 409 response (i.e. resource already exists)"""
 
+class QuotaExceededError(Exception):
+    """Corresponds to 429 response (i.e. the user's share of the YouTube Data API quota is used up)"""
+    def __init__(self, message: str, retry_after: int | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds until quota resets, if known
+
 class YTServiceError(Exception):
     """Corresponds to 503 response or 409 response (i.e. YT service unavailable)"""
+    def __init__(self, message: str, retry_after: int | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds the API asked us to wait before retrying, if known
+
+class UncertainWriteError(Exception):
+    """Corresponds to 502 response (i.e. YouTube failed during a write, which may or may not have been applied)"""
 
 class VideoLinkParserError(Exception):
     """Raised when `utils.extract_video_id` cannot identify video id from a link"""
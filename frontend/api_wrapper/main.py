@@ -3,14 +3,18 @@ import pandas as pd
 import httpx
 import asyncio
 import jwt
+import logging
 import time
+import uuid
 from typing import List, Optional, Tuple
 
 
-from .endpoints import BASE_URL, Endpoint, Authentication, Users, AltNames, Songs, Playlists
+from .endpoints import BASE_URL, Endpoint, TokenAuth, ServiceAuth, create_shared_client, Authentication, Users, AltNames, Songs, Playlists, PlaylistJobs, Quota, Videos
 from .exceptions import *
 from . import utils
 
+logger = logging.getLogger(__name__)
+
 
 def ping():
     """
@@ -25,26 +29,61 @@ def ping():
     except:
         return False
 
+async def async_ping(timeout: float = 5.0):
+    """
+    Same as `ping`, but doesn't block the event loop. Returns False if the API doesn't respond within `timeout` seconds
+    """
+    try:
+        async with httpx.AsyncClient(timeout = timeout) as client:
+            response = await client.get(BASE_URL)
+        return response.status_code == 200
+    except httpx.HTTPError:
+        return False
+
+IMPORT_CHUNK_SIZE = 200     # rows of an imported .csv file read at a time
+IMPORT_CONCURRENCY = 4      # songs of an import created at once
+
 class APIWrapper():
-    def __init__(self, YT_API_KEY: str = None):
-        self.client = httpx.AsyncClient(follow_redirects = True,
-                                        timeout = 60.0)
-        self.authentication = Authentication(self.client)
-        self.users = Users(self.client)
-        self.alt_names = AltNames(self.client)
-        self.songs = Songs(self.client)
-        self.playlists = Playlists(self.client)
-        self.YT_API_KEY = YT_API_KEY
-
-    def _check_yt_api_key(self):
-        if self.YT_API_KEY is None:
-            raise ValueError("Method requires a YouTube Data API key!")
-
-    def set_yt_api_key(self, key: str):
-        self.YT_API_KEY = key
-
-    async def _request_with_retry(self, async_func, expected_exceptions: Tuple[Exception] = None, **kwargs):
-        max_attempts = 5
+    def __init__(self, service_key: str = None, client: httpx.AsyncClient = None):
+        """
+        Args:
+            service_key: API key of a trusted service. If given, requests act as the user set by `act_as` 
+                (or by `create_user`/`login`) instead of using a JWT
+            client: an HTTP client shared with other wrappers (see `create_shared_client`). If not given, 
+                the wrapper creates its own
+        """
+        self.auth = ServiceAuth(service_key) if service_key is not None else TokenAuth()
+        self._owns_client = client is None
+        self.client = client if client is not None else create_shared_client()
+        self.authentication = Authentication(self.client, self.auth)
+        self.users = Users(self.client, self.auth)
+        self.alt_names = AltNames(self.client, self.auth)
+        self.songs = Songs(self.client, self.auth)
+        self.playlists = Playlists(self.client, self.auth)
+        self.quota = Quota(self.client, self.auth)
+        self.videos = Videos(self.client, self.auth)
+        self.playlist_jobs = PlaylistJobs(self.client, self.auth)
+
+    async def aclose(self):
+        """
+        Closes the underlying HTTP client and its connections, unless it is shared with other wrappers.
+        The wrapper can't be used afterwards
+        """
+        if self._owns_client:
+            await self.client.aclose()
+
+    def open_connections(self):
+        """
+        Returns the number of connections in the HTTP client's pool
+        """
+        # httpx doesn't expose its pool, so this relies on the default transport's internals
+        pool = getattr(self.client._transport, '_pool', None)
+        return len(getattr(pool, 'connections', ()))
+
+    async def _request_with_retry(self, async_func, expected_exceptions: Tuple[Exception] = None, 
+                                  max_attempts: int = 2, **kwargs):
+        # the API already retries transient YouTube errors call by call, so a failure reaching this point 
+        # means YouTube is persistently unavailable. Retry once by default, after the delay the API asked for
         base_delay = 0.5
         
         if expected_exceptions is None:
@@ -59,6 +98,8 @@ class APIWrapper():
                     raise e
 
                 delay = base_delay * (2 ** attempt)
+                if getattr(e, 'retry_after', None) is not None:
+                    delay = max(delay, e.retry_after)
                 await asyncio.sleep(delay)
 
     # AUTH
@@ -69,22 +110,98 @@ class APIWrapper():
             return {'status': False}
         return {'status': True}
 
-    async def login(self, username: str, password: str):
+    async def login(self, username: str, password: str, adopt: bool = False):
         # raises AuthenticationError if user doesn't exist or bad credentials
-        response = await self.authentication.post(username, password)
+        if isinstance(self.auth, ServiceAuth) and not adopt:
+            raise ValueError("A service can only log in by adopting the user. Pass adopt = True")
+        response = await self.authentication.post(username, password, adopt = adopt)
+        
+        if isinstance(self.auth, ServiceAuth):
+            # logging in adopts the user, so the service can act as them from now on
+            payload = jwt.decode(response.json()['access_token'], options = {'verify_signature': False})
+            self.act_as(payload['user_id'])
+            return {'detail': 'Successfully logged in',
+                    'exp_time': None}
+        return self._store_tokens(response.json(), 'Successfully logged in')
+
+    def act_as(self, user_id: int):
+        """
+        Sets the user a service acts as. Only available when the wrapper was created with a service key
+        """
+        if not isinstance(self.auth, ServiceAuth):
+            raise ValueError("Acting as a user requires a service key!")
+        self.auth.act_as_user_id = user_id
+
+    async def refresh_login(self):
+        """
+        Renews the access token with the refresh token obtained at login, which is much cheaper for the API
+        than logging in again. Requests also do this automatically when the access token has expired.
+        Raises AuthenticationError if there is no usable refresh token, in which case `login` must be called.
+        """
+        # service keys don't expire, so there is nothing to refresh
+        if isinstance(self.auth, ServiceAuth):
+            return {'detail': 'Service key does not need refreshing',
+                    'exp_time': None}
+        
+        if self.auth.refresh_token is None:
+            raise AuthenticationError("No refresh token. Please log in")
+        
+        try:
+            response = await self.authentication.refresh(self.auth.refresh_token)
+        except AuthenticationError:
+            self.auth.refresh_token = None
+            raise
+        return self._store_tokens(response.json(), 'Successfully refreshed login')
+
+    def export_login(self):
+        """
+        Returns what is needed to resume this wrapper's login in another wrapper (e.g. in another process)
+        with `restore_login`, without logging in again. The result contains credentials, so store it securely
+        """
+        if isinstance(self.auth, ServiceAuth):
+            return {'access_token': None,
+                    'refresh_token': None,
+                    'act_as_user_id': self.auth.act_as_user_id}
+        return {'access_token': self.auth.access_token,
+                'refresh_token': self.auth.refresh_token,
+                'act_as_user_id': None}
+
+    def restore_login(self, access_token: str = None, refresh_token: str = None, act_as_user_id: int = None):
+        """
+        Resumes a login saved by `export_login`. The access token may have expired since, in which case
+        `refresh_login` renews it (or raises AuthenticationError if the refresh token has expired too)
+        Returns:
+            dict: same form as `login`
+        """
+        if isinstance(self.auth, ServiceAuth):
+            if act_as_user_id is None:
+                raise AuthenticationError("No user to act as. Please log in")
+            self.act_as(act_as_user_id)
+            return {'detail': 'Successfully restored login',
+                    'exp_time': None}
         
-        token = response.json()['access_token']
+        if access_token is None:
+            raise AuthenticationError("No access token. Please log in")
+        return self._store_tokens({'access_token': access_token, 'refresh_token': refresh_token}, 
+                                  'Successfully restored login')
+
+    def _store_tokens(self, tokens: dict, detail: str):
+        token = tokens['access_token']
         payload = jwt.decode(token, options = {'verify_signature': False})
         exp_time = payload['exp']
-        
-        self.client.headers["authorization"] = f"Bearer {token}"     
-        return {'detail': 'Successfully logged in',
+
+        self.auth.set_tokens(token, tokens.get('refresh_token'))
+        return {'detail': detail,
                 'exp_time': exp_time}
 
     async def create_user(self, username: str, password: str):
         # raises ConflictError if username is taken
         response = await self.users.post(username, password)
-        return {'detail': 'User successfully created'}
+        user_id = response.json()['id']
+        if isinstance(self.auth, ServiceAuth):
+            self.act_as(user_id)
+        return {'detail': 'User successfully created',
+                'user_id': user_id}
 
     # READ
     async def get_all_songs(self, exact_match: bool = False, query_str: str = None):
@@ -123,16 +240,7 @@ class APIWrapper():
                 return {"detail": output_str}
         
         for song in all_songs:
-            canonical_title = song['title']
-            alt_names = [f"{item['title']}" for item in song['alt_names'] if item['title'] != canonical_title]
-            link = song['link']
-
-            output_str += f"**Song**: {canonical_title} \n" 
-            if len(alt_names) > 0 and include_alts:
-                output_str += "- *Alternate titles*: " + ", ".join(alt_names) + "\n"
-            if link is not None and include_links:
-                output_str += f"- *Video*: {link} \n"
-            output_str += "\n"
+            output_str += utils.format_song_summary(song, include_alts = include_alts, include_links = include_links)
 
         if print_result:
             print(output_str)
@@ -183,11 +291,20 @@ class APIWrapper():
         return response.json()[0]
 
     async def _yt_search_video(self, query_str: str):
-        # Search with YT Data API. Throw error if no YT_API_KEY 
-        self._check_yt_api_key()
-        new_video = utils.search_video(query_str, self.YT_API_KEY) 
+        # Search YouTube through the API, which caches results across users. Returns the top result
+        response = await self.videos.search(query_str)
+        new_video = response.json()['results'][0]
         return new_video
 
+    async def _yt_get_video_details(self, video_id: str):
+        # Fetch video details through the API, which caches them across users
+        response = await self.videos.get([video_id])
+        if not response.json():
+            # the link parsed, but doesn't point to an existing video
+            raise VideoLinkParserError(f"No YouTube video found with id '{video_id}'")
+        video = response.json()[0]
+        return video
+
     # AGGREGATES
     async def smart_search_video(self, song_title: str, 
                           insert_song_if_na: bool = False,
@@ -253,49 +370,76 @@ class APIWrapper():
                 response['detail'] = 'Fetched from YouTube'
                 return response 
     
-    async def generate_playlist(self, title: str, privacy_status: str, song_titles: List[str]):
-        response = {'content': None, 'detail': []}
-        
-        # ensure that all videos can be obtained without error before creating playlist
-        videos = []
-        for song_title in song_titles:
-            await asyncio.sleep(1)   # pause before each iter to prevent excessive calls to YouTube data api
-            search_response = await self.smart_search_video(
-                song_title = song_title,
-                insert_song_if_na = True,
-                insert_video_if_na = True)
-            videos.append(search_response['content']
-                          )
-
-            response['detail'].append(search_response['detail'])
-
-        # if no error, then create playlist
-        playlist_response = await self.playlists.post(title, privacy_status)    
-        response['content'] = playlist_response.json()
-
-        for video in videos:
-            await asyncio.sleep(1)   # pause before each iter to prevent excessive calls to YouTube data api
-            insert_response = await self._request_with_retry(
-                async_func = self.playlists.post_item,
-                expected_exceptions = (YTServiceError),
-                id = playlist_response.json()['id'],
-                video_id = video['id']
-            )
-            
+    async def start_playlist_job(self, title: str, privacy_status: str, song_titles: List[str]):
+        """
+        Starts building a playlist from a list of song titles. The API does the work in the background.
+        Returns:
+            dict: a representation of the job, including its 'id'
+        """
+        response = await self.playlist_jobs.post(title, privacy_status, song_titles)
+        return response.json()
+
+    async def stream_playlist_job(self, job_id: int):
+        """
+        Async iterator over the progress events of a playlist job, ending when the job finishes. Each event
+        is a dict of form {'event': 'item' | 'job', 'data': {...}}. 'item' events carry the 'position', 'song_title',
+        'status', and 'detail' of a song, and 'job' events carry the 'status' and 'detail' of the job.
+        """
+        async for event in self.playlist_jobs.events(job_id):
+            yield event
+
+    async def get_playlist_job_result(self, job_id: int, poll_interval: float = 1.0):
+        """
+        Waits for a playlist job to finish, polling every `poll_interval` seconds.
+        Returns:
+            dict: {'content': ..., 'detail': [...], 'job_detail': ...}, where 'content' is the created playlist 
+            (or None if the playlist could not be created, in which case 'job_detail' says why) and 'detail' 
+            has one message per song
+        """
+        job_response = await self.playlist_jobs.get(job_id)
+        job = job_response.json()
+        while job['status'] in ('pending', 'running'):
+            await asyncio.sleep(poll_interval)
+            job_response = await self.playlist_jobs.get(job_id)
+            job = job_response.json()
+
+        response = {'content': None, 
+                    'detail': [item['detail'] for item in job['items']],
+                    'job_detail': job['detail']}
+        if job['playlist_id'] is not None:
+            response['content'] = {'id': job['playlist_id'],
+                                   'playlist_title': job['title'],
+                                   'link': job['link']}
         return response
+
+    async def generate_playlist(self, title: str, privacy_status: str, song_titles: List[str]):
+        """
+        Builds a playlist from a list of song titles and waits for it to finish. See `get_playlist_job_result` for
+        the return value. Use `start_playlist_job` and `stream_playlist_job` directly to report progress.
+        """
+        job = await self.start_playlist_job(title, privacy_status, song_titles)
+        try:
+            async for event in self.stream_playlist_job(job['id']):
+                pass
+        except httpx.HTTPError:
+            pass    # stream dropped; fall back to polling
+        return await self.get_playlist_job_result(job['id'])
     
     async def create_song(self, title: str, alt_names: Optional[List[str]] = None, 
                           video_link: str = None,
                           video_id: str = None, video_title: str = None, channel_name: str = None):
-        final_response = {'detail': []}
+        # 'conflicts' lists titles which weren't saved because another song already has them
+        final_response = {'detail': [], 'created': False, 'conflicts': []}
         # insert new song resource
         new_song_response = None
         try:
             new_song_response = await self.songs.post(title)
         except ConflictError:
             final_response['detail'].append(f"Operation aborted. There is already a song with the title '{title}'!")
+            final_response['conflicts'].append(f"'{title}' already exists")
             return final_response
         final_response['detail'].append(f"Song '{title}' created!")
+        final_response['created'] = True
 
         # insert alt names
         if alt_names is None:
@@ -307,6 +451,7 @@ class APIWrapper():
                     canonical_id = new_song_response.json()['id'])
             except ConflictError:
                 final_response['detail'].append(f"'{alt_name}' not added as an alt title because it exists as a title for another song! \n")
+                final_response['conflicts'].append(f"'{alt_name}' (alt title of '{title}') belongs to another song")
 
         # insert video
         try:
@@ -319,8 +464,7 @@ class APIWrapper():
                 )
             elif video_link is not None:
                 video_id = utils.extract_video_id(video_link)
-                self._check_yt_api_key()
-                video = utils.get_video_details(video_id, self.YT_API_KEY) 
+                video = await self._yt_get_video_details(video_id)
                 await self.songs.put_video(
                     id = new_song_response.json()['id'],
                     video_id = video['id'],
@@ -332,22 +476,100 @@ class APIWrapper():
                     f"""Video not inserted. Please provide either 
                     i) a 'video_link', 
                     or ii) 'id', 'video_title', and 'channel_name'""")
-        except VideoLinkParserError as e:
+        except (VideoLinkParserError, QuotaExceededError) as e:
             final_response["detail"].append(f"Video not inserted. {e}")
         except ValueError as e:
             final_response["detail"].append(f"Video not inserted. {e}")
         
         return final_response
 
-    async def import_songs(self, raw_df: pd.DataFrame):
-        self._check_yt_api_key()
-        grouped_df = utils.process_songs_df(raw_df, self.YT_API_KEY)
-        for i in range(len(grouped_df)):
-            song_details = dict(grouped_df.iloc[i])
-            await self.create_song(**song_details)
-        return {'detail': 'Successfully imported songs!'}
+    async def import_songs(self, source, progress_callback = None, 
+                           chunk_size: int = IMPORT_CHUNK_SIZE, concurrency: int = IMPORT_CONCURRENCY):
+        """
+        Creates the songs of an imported .csv file. The file is read in chunks, and the songs of each chunk
+        are created `concurrency` at a time.
+        Args:
+            source: a path or file-like object of a .csv file with the columns 'Song', 'Alt Names', and 'Link'
+                (raises ValueError otherwise), or a dataframe read from one
+            progress_callback: an async function called as `progress_callback(processed, report)` after each song,
+                where `report` is the report so far (see below)
+        Returns:
+            dict: {'detail': ..., 'created': number of songs created, 'conflicts': a list of every title which 
+            wasn't saved because another song has it, 'failed': a list of songs which failed for other reasons}
+        """
+        if isinstance(source, pd.DataFrame):
+            chunks = [utils.process_songs_df(source)]
+        else:
+            chunks = utils.read_songs_csv(source, chunk_size = chunk_size)
+        
+        report = {'created': 0, 'conflicts': [], 'failed': []}
+        processed = 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def import_song(song_details: dict):
+            nonlocal processed
+            async with semaphore:
+                try:
+                    response = await self.create_song(**song_details)
+                    report['created'] += response['created']
+                    report['conflicts'] += response['conflicts']
+                except Exception as e:
+                    report['failed'].append(f"'{song_details['title']}': {e}")
+            processed += 1
+            if progress_callback is not None:
+                # a failing callback (e.g. its progress message was deleted) mustn't cut the import short
+                try:
+                    await progress_callback(processed, report)
+                except Exception:
+                    logger.warning("Import progress callback failed", exc_info = True)
+
+        for grouped_df in chunks:
+            await self._add_video_details(grouped_df)
+            await asyncio.gather(*[import_song(dict(grouped_df.iloc[i])) for i in range(len(grouped_df))])
+        
+        report['detail'] = f"Imported {report['created']} of {processed} songs"
+        if report['conflicts']:
+            report['detail'] += f". {len(report['conflicts'])} titles were already taken"
+        if report['failed']:
+            report['detail'] += f". {len(report['failed'])} songs failed"
+        return report
+
+    async def _add_video_details(self, grouped_df: pd.DataFrame):
+        # fetch details of linked videos in chunks. Imports are charged as bulk work so that 
+        # a large import can't use up the quota needed for other users' interactive commands
+        all_video_ids = grouped_df['video_id'].dropna().unique().tolist()
+        chunk_size = utils.MAX_VIDEO_IDS_PER_CALL
+        video_details = dict()
+        for i in range(0, len(all_video_ids), chunk_size):
+            response = await self.videos.get(all_video_ids[i: i + chunk_size], priority = 'bulk')
+            video_details.update({video['id']: video for video in response.json()})
+
+        # videos that couldn't be found are imported without a video
+        found = [video_details.get(video_id) for video_id in grouped_df['video_id']]
+        grouped_df['video_id'] = pd.Series([video['id'] if video else None for video in found], dtype = object)
+        grouped_df['video_title'] = pd.Series([video['video_title'] if video else None for video in found], dtype = object)
+        grouped_df['channel_name'] = pd.Series([video['channel_name'] if video else None for video in found], dtype = object)
 
     # PLAYLIST OPERATIONS
+    async def create_playlist(self, title: str, privacy_status: str):
+        # creates an empty playlist. Like add_to_playlist, every attempt carries the same key, 
+        # so a retry after a timeout can't create the playlist twice
+        try:
+            response = await self._request_with_retry(
+                self.playlists.post,
+                (YTServiceError, httpx.TimeoutException),
+                max_attempts = 3,
+                title = title,
+                privacy_status = privacy_status,
+                idempotency_key = str(uuid.uuid4())
+            )
+            return {"detail": f"Successfully created playlist '{title}'!", "playlist": response.json()}
+        except UncertainWriteError:
+            return {"detail": f"YouTube failed while creating the playlist, so it may or may not have been created. "
+                              f"Please check your playlists before trying again."}
+        except:
+            return {"detail": f"Operation aborted. Unexpected error while calling YouTube Data API"}
+
     async def edit_playlist_title(self, old_title: str, new_title: str):
         try:
             playlist = await self._db_search_playlist(old_title)
@@ -382,7 +604,6 @@ class APIWrapper():
             return {"detail": f"Operation aborted. Unexpected error while calling YouTube Data API"}
 
     async def add_to_playlist(self, playlist_title: str, video_link: str, record_in_db: bool = False):
-        self._check_yt_api_key()
         # fetch playlist id by searching db by name
         try:
             playlist = await self._db_search_playlist(playlist_title)
@@ -392,8 +613,8 @@ class APIWrapper():
         # get yt video by calling yt data api
         try:
             video_id = utils.extract_video_id(video_link)
-            video = utils.get_video_details(video_id, self.YT_API_KEY)
-        except VideoLinkParserError as e:
+            video = await self._yt_get_video_details(video_id)
+        except (VideoLinkParserError, QuotaExceededError) as e:
             return {"detail": f"Aborted operation. {e}"}
             
         except:
@@ -401,12 +622,19 @@ class APIWrapper():
         
         # insert into playlist
         try:
+            # a timed out request may still be applied by the API, so it is retried with the same key: 
+            # the API then replays its outcome, or answers 409 while it is still in progress
             await self._request_with_retry(
                 self.playlists.post_item,
-                (YTServiceError),
+                (YTServiceError, httpx.TimeoutException),
+                max_attempts = 3,
                 id = playlist['id'],
-                video_id = video['id']
+                video_id = video['id'],
+                idempotency_key = str(uuid.uuid4())     # same key on every attempt, so a retry can't insert twice
                 )
+        except UncertainWriteError:
+            return {"detail": f"YouTube failed while adding the video, so it may or may not have been added. "
+                              f"Please check '{playlist_title}' before trying again."}
         except:
             return {"detail": "Unexpected error occured while calling YouTube Data API"}
         
@@ -432,7 +660,6 @@ class APIWrapper():
         return {"detail": "Successfully added video!"}
 
     async def replace_vid_in_playlist(self, playlist_title: str, pos: int, video_link: str, record_in_db: bool = False):
-        self._check_yt_api_key()
         # fetch playlist id by searching db by name
         try:
             playlist = await self._db_search_playlist(playlist_title)
@@ -442,8 +669,8 @@ class APIWrapper():
         # get yt video by calling yt data api
         try:
             video_id = utils.extract_video_id(video_link)
-            video = utils.get_video_details(video_id, self.YT_API_KEY)
-        except VideoLinkParserError as e:
+            video = await self._yt_get_video_details(video_id)
+        except (VideoLinkParserError, QuotaExceededError) as e:
             return {"detail": f"Aborted operation. {e}"}
             
         except:
@@ -511,6 +738,34 @@ class APIWrapper():
         
         return {"detail": f"Successfully moved video in '{playlist_title}'!"}
 
+    async def reorder_playlist(self, playlist_title: str, song_titles: List[str]):
+        """
+        Rearranges an existing playlist to match a setlist. Songs are resolved to videos in the same way 
+        as in `generate_playlist`. Videos not in the setlist are removed, and missing ones are inserted.
+        Args:
+            playlist_title: the title of the playlist to rearrange
+            song_titles: the titles of the songs, in the desired order
+        """
+        try:
+            playlist = await self._db_search_playlist(playlist_title)
+        except NotFoundError:
+            return {"detail": f"Aborted operation. Could not find playlist titled '{playlist_title}'!"}
+        
+        video_ids = []
+        for song_title in song_titles:
+            search_response = await self.smart_search_video(
+                song_title = song_title,
+                insert_song_if_na = True,
+                insert_video_if_na = True)
+            video_ids.append(search_response['content']['id'])
+
+        try:
+            await self.playlists.put_order(playlist['id'], video_ids)
+        except YTServiceError:
+            return {"detail": "Unexpected error occured while calling YouTube Data API"}
+        
+        return {"detail": f"Successfully reordered '{playlist_title}'!"}
+
     async def remove_from_playlist(self, playlist_title: str, pos: int):
         try:
             playlist = await self._db_search_playlist(playlist_title)
@@ -618,7 +873,7 @@ class APIWrapper():
         try:
             song = await self._db_search_song(song_title)          # raises NotFoundError if song not found
             video_id = utils.extract_video_id(video_link)   # raises VideoLinkParserError if can't find video_id
-            video = utils.get_video_details(video_id, self.YT_API_KEY)
+            video = await self._yt_get_video_details(video_id)
             await self.songs.put_video(
                 song['id'], 
                 video['id'],
@@ -0,0 +1,89 @@
+"""
+Timing of the work done for one unit of work (e.g. a bot command), split into spans by kind: 'auth' for
+logins and token refreshes, 'api' for other requests to the main API, and 'youtube' for requests which make
+the API call YouTube. The current trace is held in a context variable, so it follows the work through the
+wrapper's calls (and into tasks started by it) without being passed around. Spans outside a trace cost nothing.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+import time
+
+SPAN_KINDS = ('auth', 'api', 'youtube')
+
+_current_trace = ContextVar('current_trace', default = None)
+_current_span = ContextVar('current_span', default = None)
+
+class Trace:
+    """
+    The time spent in each kind of span during a unit of work. Time in a nested span only counts towards the
+    innermost span, e.g. a login's requests count as 'auth' rather than 'api'. Spans which run concurrently
+    all count in full, so their sum can exceed the trace's duration.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.spans = defaultdict(float)     # keys are span kinds, values are seconds
+        self.errors = []                    # '<kind>: <exception type>' for every span which raised
+        self.failed = False                 # set by `mark_failed`, for work which handles its own failure
+        self._started_at = time.perf_counter()
+        self.duration = None                # seconds, set by `finish`
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started_at
+        return self
+
+class _SpanTimer:
+    __slots__ = ('child_time',)
+
+    def __init__(self):
+        self.child_time = 0.0
+
+def begin_trace(name: str):
+    """
+    Starts a trace which spans in the current context (and in tasks created from it) are recorded in
+    Returns:
+        Trace: the trace, to be ended with `Trace.finish`
+    """
+    trace = Trace(name)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+def current_trace():
+    return _current_trace.get()
+
+def mark_failed():
+    """
+    Marks the current trace as failed, if a trace is active. For work which catches its own errors 
+    (e.g. a command which replies with the error), since its failure is otherwise never seen
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.failed = True
+
+@contextmanager
+def span(kind: str):
+    """
+    Records the time spent in the block as a span of the given kind, if a trace is active
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    parent = _current_span.get()
+    timer = _SpanTimer()
+    token = _current_span.set(timer)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        trace.errors.append(f"{kind}: {type(e).__name__}")
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_span.reset(token)
+        trace.spans[kind] += max(elapsed - timer.child_time, 0.0)
+        if parent is not None:
+            parent.child_time += elapsed
@@ -1,40 +1,28 @@
-from googleapiclient.discovery import build
 from urllib.parse import urlparse, parse_qs, unquote
 from .exceptions import VideoLinkParserError
 import pandas as pd
-import numpy as np
 
-def search_video(query_string: str, api_key: str):
+MAX_VIDEO_IDS_PER_CALL = 50     # max number of ids accepted by videos.list (and by the API's GET /videos)
+
+def format_song_summary(song: dict, include_alts: bool = True, include_links: bool = True):
     """
-    Searches for a YouTube video via the YouTube Data API search endpoint.
+    Formats a song (as returned by the main API) as a Discord markdown entry, ending with a blank line
     Args:
-        query_str: the string passed to the YouTube Data API for searching
-        api_key: an API key for the YouTube Data API
-    Returns:
-        dict: a representation of the video resource corresponding to the top search result. This has
-        the keys 'id', 'video_title', 'channel_name', and 'link'
+        include_alts: whether to list the song's alternate titles
+        include_links: whether to include the song's video link
     """
-    root = 'http://youtu.be/'
-    with build('youtube', 'v3', developerKey = api_key) as yt_service:
-        request = yt_service.search().list(
-            part = "snippet",
-            q = query_string,
-            type = "video"
-        )
-        response = request.execute()
-        
-        top_vid = response['items'][0]
+    canonical_title = song['title']
+    alt_names = [f"{item['title']}" for item in song['alt_names'] if item['title'] != canonical_title]
+    link = song['link']
+
+    output_str = f"**Song**: {canonical_title} \n" 
+    if len(alt_names) > 0 and include_alts:
+        output_str += "- *Alternate titles*: " + ", ".join(alt_names) + "\n"
+    if link is not None and include_links:
+        output_str += f"- *Video*: {link} \n"
+    output_str += "\n"
+    return output_str
 
-        id = top_vid['id']['videoId']
-        title = top_vid['snippet']['title']
-        channel = top_vid['snippet']['channelTitle']
-        link = root + id
-        
-        return {'id': id,
-                'video_title': title,
-                'channel_name': channel,
-                'link': link}
-    
 YOUTUBE_NETLOCS = {
     "youtube.com",
     "www.youtube.com",
@@ -113,32 +101,13 @@ def extract_video_id(url: str, fallback_to_none: bool = False):
     else:
         raise VideoLinkParserError(f"Please try a different link format")
 
-def get_video_details(video_id: str, api_key: str):
+def process_songs_df(raw_df: pd.DataFrame):
     """
-    Given a YouTube video id, this method fetches the video title and channel name from YouTube Data API.
+    Groups the rows of an imported .csv file into one row per song. Video details are not fetched here;
+    the returned frame has a 'video_id' column which callers can use to fill in 'video_title' and 'channel_name'.
     Args:
-        video_id: the video's YouTube video id
-        api_key: an API key for the YouTube Data API
-    Returns:
-        dict: a representation of the video resource corresponding to the top search result. This has
-        the keys 'id', 'video_title', 'channel_name', and 'link'
+        raw_df: a dataframe with the columns 'Song', 'Alt Names', and 'Link'
     """
-    with build('youtube', 'v3', developerKey = api_key) as yt_service:
-        request = yt_service.videos().list(
-            part = 'id,snippet',
-            id = video_id
-        )
-        response = request.execute()
-
-    result = {'id': video_id,
-              'link': 'https://youtu.be' + f'/{video_id}',
-              'video_title': response['items'][0]['snippet']['title'],
-              'channel_name': response['items'][0]['snippet']['channelTitle']
-              }
-    
-    return result
-
-def process_songs_df(raw_df: pd.DataFrame, api_key: str):
     # rename cols to match param names expected by APIWrapper.create_song()
     raw_df.rename(columns = {'Song': 'title', 'Alt Names': 'alt_names', 'Link': 'video_link'}, inplace = True)
     raw_df.dropna(how = 'all', inplace = True)
@@ -151,36 +120,44 @@ def process_songs_df(raw_df: pd.DataFrame, api_key: str):
 
     # group based on title
     grouped_info = raw_df.groupby('title')[['alt_names', 'video_id']].agg({
-        'alt_names': lambda x: list(x,) if any(pd.notna(val) for val in x) else None,
+        'alt_names': lambda x: [val for val in x if pd.notna(val)] or None,
         'video_id': lambda x: x.dropna().iloc[0] if x.dropna().any() else None,
     })
     grouped_info.reset_index(inplace = True)
 
-    # take non-None video ids, and get details from YouTube Data API
-    # make calls in chunks to prevent rate limiting
-    indices = np.array(range(len(grouped_info)))
-    mask = grouped_info['video_id'].notna().values
-    non_none_indices = indices[mask]
-    all_video_ids = grouped_info[mask]['video_id'].values
-
-    video_titles = []
-    channel_names = []
-    chunk_size = 20
-    for i in range((len(all_video_ids) // chunk_size) + 1):
-        current_id_chunk = ','.join(all_video_ids[i*chunk_size: (i+1)*chunk_size])
-        with build('youtube', 'v3', developerKey = api_key) as yt_service:
-            request = yt_service.videos().list(
-                part = 'id,snippet',
-                id = current_id_chunk
-            )
-            response = request.execute()
-            for item in response['items']:
-                video_titles.append(item['snippet']['title'])
-                channel_names.append(item['snippet']['channelTitle'])
-
-    grouped_info['video_title'] = None
-    grouped_info.loc[non_none_indices, 'video_title'] = video_titles
-    grouped_info['channel_name'] = None
-    grouped_info.loc[non_none_indices, 'channel_name'] = channel_names
-
     return grouped_info
+
+IMPORT_COLUMNS = ['Song', 'Alt Names', 'Link']
+
+def read_songs_csv(source, chunk_size: int = 200):
+    """
+    Reads an imported .csv file a chunk of rows at a time, yielding each chunk in the form returned by
+    `process_songs_df`, so that large files don't have to be processed all at once.
+    A song's rows (its title row followed by rows of alt names) can straddle two chunks, so the rows of the
+    last song in each chunk are held back and processed with the next chunk.
+    Args:
+        source: a path or file-like object
+        chunk_size: number of rows read at a time
+    Raises:
+        ValueError: if the file doesn't have the columns 'Song', 'Alt Names', and 'Link'
+    """
+    carry = None
+    for chunk in pd.read_csv(source, chunksize = chunk_size):
+        if list(chunk.columns) != IMPORT_COLUMNS:
+            raise ValueError(f"Expected the column titles {', '.join(IMPORT_COLUMNS)}, "
+                             f"but instead got {', '.join(chunk.columns)}")
+        
+        chunk = chunk.dropna(how = 'all')
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        
+        title_rows = chunk['Song'].notna().to_numpy().nonzero()[0]
+        if len(title_rows) == 0:
+            carry = chunk
+            continue
+        complete, carry = chunk.iloc[:title_rows[-1]], chunk.iloc[title_rows[-1]:]
+        if len(complete) > 0:
+            yield process_songs_df(complete.copy())
+    
+    if carry is not None and len(carry) > 0:
+        yield process_songs_df(carry.copy())
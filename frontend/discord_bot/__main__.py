@@ -0,0 +1,10 @@
+"""
+Starts the bot: `python -m discord_bot DEV` or `python -m discord_bot PROD`.
+Export workers are spawned processes, which re-import the module the parent was started from. Multiprocessing
+skips this for a package's `__main__` module, so starting the bot from here means workers only import what
+rendering an export needs (`discord_bot.utils`), instead of building a bot of their own.
+"""
+from .main import client, TOKEN
+
+if __name__ == '__main__':
+    client.run(TOKEN)
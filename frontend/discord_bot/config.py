@@ -1,10 +1,23 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import SecretStr
+from typing import List
 
 class Settings(BaseSettings):
     DISCORD_TOKEN: SecretStr
     DISCORD_DEV_SERVER_ID: SecretStr
-    YT_API_KEY: SecretStr
+    MAX_GUILD_SESSIONS: int = 500               # max guilds with an open API client at once
+    GUILD_SESSION_IDLE_MINUTES: int = 30        # how long a guild's API client is kept open without use
+    SESSION_STORE_PATH: str = 'bot_sessions.sqlite3'    # guild logins and activity, shared by all shard processes
+    WARM_GUILD_SESSIONS: int = 50               # how many recently active guilds are logged in at startup
+    WARM_CONCURRENCY: int = 2                   # max logins at once while warming sessions
+    EXPORT_WORKERS: int = 2                     # max /export-songs files rendered at once, each in its own process
+    SERVICE_API_KEY: SecretStr | None = None    # if set, the bot acts for every guild with this key instead of per-guild logins
+    METRICS_LOG_PATH: str = 'bot_metrics.log'  # command latency summaries. Give each shard process its own file
+    METRICS_LOG_MAX_BYTES: int = 1_000_000      # size at which the metrics log is rotated
+    METRICS_LOG_BACKUPS: int = 3                # rotated metrics logs kept
+    METRICS_LOG_MINUTES: int = 5                # how often command latency summaries are written
+    SHARD_COUNT: int | None = None              # total shards across all processes. If not set, Discord's recommendation is used
+    SHARD_IDS: List[int] | None = None          # shards run by this process (e.g. [0,1]). If not set, this process runs all of them
 
     model_config = SettingsConfigDict(env_file = '.env.dev', env_file_encoding = 'utf-8',
                                       extra = 'ignore')
@@ -0,0 +1,58 @@
+"""
+Tracks whether the main API is up, so that commands don't have to probe it before every request.
+A background task pings the API on an interval, and the state only flips after several consecutive
+probes agree, so that a single slow or dropped ping doesn't mark the API down (or a single lucky one up).
+"""
+import asyncio
+import logging
+import time
+
+from api_wrapper.main import async_ping
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 15         # seconds between probes while the API is up
+DOWN_CHECK_INTERVAL = 5     # seconds between probes while the API is down, so recovery is noticed quickly
+FAILURE_THRESHOLD = 2       # consecutive failed probes before the API is considered down
+SUCCESS_THRESHOLD = 2       # consecutive successful probes before the API is considered up again
+
+class ApiHealthMonitor:
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, success_threshold: int = SUCCESS_THRESHOLD):
+        self.failure_threshold = failure_threshold
+        self.success_threshold = success_threshold
+        self.is_up = True           # assume up until probes say otherwise
+        self.last_checked_at = None
+        self.last_changed_at = None
+        self._streak = 0            # consecutive probes disagreeing with `is_up`
+
+    async def check(self):
+        """
+        Probes the API once and updates the state
+        """
+        healthy = await async_ping()
+        self.last_checked_at = time.time()
+
+        if healthy == self.is_up:
+            self._streak = 0
+            return
+        
+        self._streak += 1
+        threshold = self.failure_threshold if self.is_up else self.success_threshold
+        if self._streak >= threshold:
+            self.is_up = healthy
+            self.last_changed_at = self.last_checked_at
+            self._streak = 0
+            logger.warning(f"Main API is {'up' if healthy else 'down'}")
+
+    async def run(self):
+        """
+        Probes the API on an interval until cancelled
+        """
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Unexpected error in API health monitor: {e}")
+            await asyncio.sleep(CHECK_INTERVAL if self.is_up else DOWN_CHECK_INTERVAL)
@@ -1,24 +1,42 @@
 import discord
+from discord import app_commands
 from discord.ext import commands
 
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
 import io
+import math
+import multiprocessing
+import os
 import sys
-from typing import Optional, Literal
+import tempfile
+from typing import Optional, Literal, List
 import datetime as dt
 import time
 import httpx
 
 from .config import settings
 from . import utils
-from api_wrapper.main import APIWrapper, ping
+from api_wrapper.main import APIWrapper
+from api_wrapper.endpoints import create_shared_client, TokenAuth
+from .health import ApiHealthMonitor
+from .sessions import GuildSession, SessionRegistry, RecentGuilds
+from .session_store import SessionStore
+from .title_index import TitleIndex, MAX_CHOICES
+from .pagination import SongPages, SongPaginator, MAX_PAGES
+from .metrics import CommandMetrics, InstrumentedCommandTree, create_metrics_logger, format_summary
+from api_wrapper import tracing
 from api_wrapper.exceptions import AuthenticationError
 
 TOKEN = settings.DISCORD_TOKEN.get_secret_value()
-YT_API_KEY = settings.YT_API_KEY.get_secret_value()
+SERVICE_API_KEY = settings.SERVICE_API_KEY.get_secret_value() if settings.SERVICE_API_KEY is not None else None
 SERVER_ID = settings.DISCORD_DEV_SERVER_ID.get_secret_value()
 BUFFER = 300
+PROGRESS_EDIT_INTERVAL = 1.5     # min seconds between edits of a progress message
+TITLE_INDEX_TTL = 600           # seconds after which a guild's title index is rebuilt in the background
+TITLE_INDEX_BUILD_TIMEOUT = 2.0 # max seconds an autocomplete waits for a guild's first index (Discord allows 3)
 
 if len(sys.argv) < 2:
     print("Error: No arguments provided.")
@@ -36,77 +54,339 @@ else:
     sys.exit(1)
 
 
-class Client(commands.Bot):
+class Client(commands.AutoShardedBot):
+    """
+    The bot can be split across processes, each running some of the shards (see SHARD_COUNT and SHARD_IDS).
+    A guild's events all go to one shard, so each process only holds sessions for its own guilds. Logins are
+    saved to a store shared by every process, so a guild which moves to another process (e.g. on a restart
+    or when resharding) resumes its login instead of logging in again.
+    """
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.api_clients = dict()       # keys are guild id's, values are instances of APIWrapper
-        self.guild_credentials = dict() # keys are guild id's, values are dict of form {'username': ..., 'password': ...}
-        self.token_exp_times = dict()   # keys are guild id's, values are expiry times 
-        self._YT_API_KEY = YT_API_KEY
+        self.sessions = SessionRegistry(max_sessions = settings.MAX_GUILD_SESSIONS,
+                                        idle_timeout = settings.GUILD_SESSION_IDLE_MINUTES * 60)
+        self.http_client = create_shared_client()  # one connection pool for every guild's API client
+        self.session_store = SessionStore(settings.SESSION_STORE_PATH)
+        # the shard processes share the store, so it keeps the recent guilds of each of them
+        self._processes = 1 if settings.SHARD_IDS is None else math.ceil(settings.SHARD_COUNT / len(settings.SHARD_IDS))
+        self.recent_guilds = RecentGuilds(self.session_store, max_guilds = settings.MAX_GUILD_SESSIONS * self._processes)
+        self._session_tasks = dict()    # keys are guild id's, values are the task logging in or refreshing the guild
+        self._index_tasks = dict()      # keys are guild id's, values are the task building the guild's title index
+        self._warmed = False
+
+        # exports are rendered in other processes, since building a large PDF takes seconds of CPU. Workers
+        # are spawned rather than forked, since forking a process with running threads can deadlock the child.
+        # The bot is started from discord_bot/__main__.py, so that workers don't re-import this module
+        self.export_pool = ProcessPoolExecutor(max_workers = settings.EXPORT_WORKERS,
+                                               mp_context = multiprocessing.get_context('spawn'))
+        self.health = ApiHealthMonitor()
+        self._health_task = None
+        self._eviction_task = None
+
+        # command latencies, written periodically to a rotating log (see /bot-stats)
+        self.metrics = CommandMetrics()
+        self.metrics_logger = create_metrics_logger(settings.METRICS_LOG_PATH, 
+                                                    max_bytes = settings.METRICS_LOG_MAX_BYTES,
+                                                    backup_count = settings.METRICS_LOG_BACKUPS)
+        self._metrics_task = None
 
     async def setup_hook(self):
         """
         Start up function called only once.
         """
+        # learn the API's state before the first command, then keep it up to date in the background
+        await self.health.check()
+        self._health_task = asyncio.create_task(self.health.run())
+        self._eviction_task = asyncio.create_task(self.sessions.run_eviction_loop())
+        self._metrics_task = asyncio.create_task(self.metrics.run_log_loop(self.metrics_logger, 
+                                                                           settings.METRICS_LOG_MINUTES * 60))
+
+        # commands are global, so only one process needs to sync them
+        if self.shard_ids is not None and 0 not in self.shard_ids:
+            return
         try:
             synced = await self.tree.sync(guild = GUILD_ID)
             print(f'Synced {len(synced)} commands')
         except Exception as e:
             print(f'Error syncing commands: {e}')
     
+    async def close(self):
+        for task in (self._health_task, self._eviction_task, self._metrics_task):
+            if task is not None:
+                task.cancel()
+        self.metrics.write(self.metrics_logger)
+        await self.sessions.close_all()
+        await self.http_client.aclose()
+        await self.recent_guilds.save()
+        await self.session_store.close()
+        self.export_pool.shutdown(wait = False, cancel_futures = True)
+        await super().close()
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        # commands which raise are recorded by the command tree's on_error instead. Commands which reply
+        # with their own error message mark their trace as failed (see `tracing.mark_failed`)
+        trace = interaction.extras.get('trace')
+        if trace is not None:
+            self.metrics.record(trace)
+
     async def on_ready(self):
         """
         Start up function. Called after initialization (after steup_hook) 
         and after reconnects 
         """        
-        print(f"Logged on as {self.user}!")
+        print(f"Logged on as {self.user}! Running shards {sorted(self.shards)} of {self.shard_count}")
+
+        # guild names are only known once connected, so sessions are warmed here rather than in setup_hook
+        if not self._warmed:
+            self._warmed = True
+            asyncio.create_task(self.warm_sessions())
+
+    async def warm_sessions(self):
+        """
+        Logs in the guilds which used the bot most recently before it restarted, a few at a time, so their
+        first commands don't wait on a login
+        """
+        if not self.health.is_up:
+            return
+        
+        semaphore = asyncio.Semaphore(settings.WARM_CONCURRENCY)
+        async def warm(guild: discord.Guild):
+            async with semaphore:
+                try:
+                    await self._single_flight(guild.id, lambda: self._open_session(guild))
+                except Exception as e:
+                    print(f"Could not warm session for guild {guild.id}: {e}")
+        
+        # the store holds the recent guilds of every shard process. Only this process's guilds are found here, 
+        # and the bot may have left some guilds
+        recent = await self.recent_guilds.most_recent(settings.WARM_GUILD_SESSIONS * self._processes)
+        guilds = [self.get_guild(guild_id) for guild_id in recent]
+        guilds = [guild for guild in guilds if guild is not None][:settings.WARM_GUILD_SESSIONS]
+        await asyncio.gather(*[warm(guild) for guild in guilds])
+        print(f"Warmed {len(guilds)} guild sessions")
+
+    async def _single_flight(self, guild_id: int, make_coroutine):
+        """
+        Runs `make_coroutine()` as the guild's login or refresh, unless one is already in flight, in which case
+        its result is awaited instead. This way concurrent commands in a guild share one login.
+        """
+        task = self._session_tasks.get(guild_id)
+        if task is None:
+            task = asyncio.create_task(make_coroutine())
+            self._session_tasks[guild_id] = task
+            task.add_done_callback(lambda _: self._session_tasks.pop(guild_id, None))
+        # a command being cancelled shouldn't cancel the login other commands are waiting on
+        return await asyncio.shield(task)
+
+    async def _open_session(self, guild: discord.Guild) -> GuildSession:
+        """
+        Creates a guild's session by resuming its saved login, or else by either logging in or by creating a user
+        """
+        # another command may have finished logging in just before this task started
+        if guild.id in self.sessions:
+            return self.sessions.get(guild.id)
+        
+        new_credentials = {'username': f'{guild.name} {str(guild.id)[-4:]}',
+                           'password': str(guild.id)}
+        new_client = APIWrapper(service_key = SERVICE_API_KEY, client = self.http_client)
+        try:
+            exp_time = await self._restore_login(guild.id, new_client)
+            if exp_time is False:
+                exp_time = await self._login(new_client, new_credentials)
+        except BaseException:
+            await new_client.aclose()
+            raise
+        
+        # save tokens renewed from now on (including by requests retried after a 401)
+        if isinstance(new_client.auth, TokenAuth):
+            new_client.auth.on_tokens_changed = lambda: self._save_login(guild.id, new_client)
+        self._save_login(guild.id, new_client)
+        
+        return await self.sessions.add(guild.id, GuildSession(
+            api_client = new_client,
+            username = new_credentials['username'],
+            password = new_credentials['password'],
+            token_exp_time = exp_time,
+            last_used_at = time.monotonic()
+        ))
+
+    async def _restore_login(self, guild_id: int, api_client: APIWrapper):
+        """
+        Resumes the guild's login saved in the session store, refreshing it if it is about to expire
+        Returns:
+            the JWT's expiry time (None with a service key), or False if there is no usable saved login
+        """
+        saved_login = await self.session_store.load_login(guild_id)
+        if saved_login is None:
+            return False
+        try:
+            response = api_client.restore_login(**saved_login)
+            if response['exp_time'] is not None and response['exp_time'] - time.time() < BUFFER:
+                response = await api_client.refresh_login()
+        except AuthenticationError:
+            await self.session_store.delete_login(guild_id)
+            return False
+        return response['exp_time']
+
+    def _save_login(self, guild_id: int, api_client: APIWrapper):
+        # written in the background, in order with the guild's other saves
+        future = self.session_store.save_login(guild_id, **api_client.export_login())
+        future.add_done_callback(lambda f: _report_store_failure(f, f"save login of guild {guild_id}"))
+
+    async def _login(self, api_client: APIWrapper, credentials: dict):
+        """
+        Logs in as a guild's user, creating the user if it doesn't exist
+        Returns:
+            the JWT's expiry time (None with a service key)
+        """
+        try:
+            # try logging in. With a service key, this only happens once per guild, and adopts the guild's user
+            response = await api_client.login(**credentials, adopt = SERVICE_API_KEY is not None)
+            return response['exp_time']
+        except AuthenticationError:
+            # if user doesn't exist in main API, then create new user. A service acts as the users it
+            # creates, so it doesn't need to log in afterwards
+            await api_client.create_user(**credentials)
+            if SERVICE_API_KEY is None:
+                response = await api_client.login(**credentials)
+                return response['exp_time']
+            return None
+
+    async def _renew_session(self, session: GuildSession) -> GuildSession:
+        """
+        Refreshes a session's JWT if it is about to expire. Logging in again is only needed once the
+        refresh token has expired too
+        """
+        # another command may have renewed the session just before this task started
+        if session.expires_within(BUFFER):
+            try:
+                response = await session.api_client.refresh_login()
+            except AuthenticationError:
+                response = await session.api_client.login(**session.credentials)
+            session.token_exp_time = response['exp_time']
+        return session
+
+    async def _build_title_index(self, session: GuildSession):
+        session.title_index_stale = False
+        songs = await session.api_client.get_all_songs()
+        session.title_index = TitleIndex.from_songs(songs)
+        session.title_index_built_at = time.monotonic()
+
+    def _start_title_index_build(self, guild_id: int, session: GuildSession):
+        # at most one build per guild at a time
+        task = self._index_tasks.get(guild_id)
+        if task is None:
+            task = asyncio.create_task(self._build_title_index(session))
+            self._index_tasks[guild_id] = task
+            task.add_done_callback(lambda _: self._index_tasks.pop(guild_id, None))
+        return task
+
+    async def title_choices(self, interaction: discord.Interaction, current: str, 
+                            alt_only: bool = False, multiple: bool = False):
+        """
+        Autocomplete choices for a song title argument, answered from the guild's title index.
+        The index is built from `GET /songs` on the guild's first autocomplete, and rebuilt in the background
+        when it is old or a command may have changed titles, so keystrokes never wait on the API after that.
+        Args:
+            alt_only: only suggest alternate titles
+            multiple: the argument is a semi-colon separated list of titles, of which the last one is completed
+        """
+        try:
+            session = await self._get_session(interaction)
+        except Exception:
+            return []
+        
+        if session.title_index is None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._start_title_index_build(interaction.guild_id, session)),
+                                       TITLE_INDEX_BUILD_TIMEOUT)
+            except Exception:
+                return []
+        elif session.title_index_stale or time.monotonic() - session.title_index_built_at > TITLE_INDEX_TTL:
+            self._start_title_index_build(interaction.guild_id, session)
+        
+        head, text = '', current
+        if multiple and ';' in current:
+            head, text = current.rsplit(';', 1)
+            head += '; '
+        titles = session.title_index.complete(text.strip(), limit = MAX_CHOICES, alt_only = alt_only)
+        
+        # Discord rejects choices longer than 100 characters
+        values = [head + title for title in titles]
+        return [app_commands.Choice(name = value, value = value) for value in values if len(value) <= 100]
+
+    def note_title_changes(self, guild_id: int, added: List[str] = (), removed: List[str] = ()):
+        """
+        Applies titles a command added or removed to the guild's title index right away, and marks the index
+        for a rebuild, since commands don't report everything they changed (or whether they succeeded)
+        """
+        if guild_id not in self.sessions:
+            return
+        session = self.sessions.get(guild_id)
+        if session.title_index is not None:
+            for title in removed:
+                session.title_index.remove(title)
+            for title in added:
+                session.title_index.add(title)
+        session.title_index_stale = True
 
     async def get_api_client(self, interaction: discord.Interaction) -> APIWrapper:
         """
         Fetch an API client specific to a Discord server.
-        If the client exists, then it is fetched from `self.api_clients` and its JWT is refreshed.
-        If the client doesn't exist, then one is created by either logging in or by creating a user. In either case, it will be added to `self.api_clients`
+        If the server has a session, then its client is fetched from `self.sessions` and its JWT is refreshed.
+        Otherwise, a client is created by either logging in or by creating a user. In either case, it will be added to `self.sessions`.
+        Concurrent commands in a server share one login or refresh.
         """
-        # verify that API is up
-        if not ping():
+        session = await self._get_session(interaction)
+        return session.api_client
+
+    async def _get_session(self, interaction: discord.Interaction) -> GuildSession:
+        # verify that API is up, as last seen by the health monitor
+        if not self.health.is_up:
             raise httpx.ConnectError("Main API is down!")
         
         current_guild_id = interaction.guild_id
-        # if api client exists for current guild, then use existing
-        if current_guild_id in self.api_clients:
-            current_client = self.api_clients[current_guild_id]
-
-            # if client's token is expired, then refresh
-            current_time = int(time.time())
-            if current_time >= self.token_exp_times[current_guild_id] - BUFFER:
-                current_credentials = self.guild_credentials[current_guild_id]
-                response = await current_client.login(**current_credentials)
-                self.token_exp_times[current_guild_id] = response['exp_time']
-
-            return current_client
+        self.recent_guilds.touch(current_guild_id)
+
+        # if a session exists for current guild, then use existing (refreshing it if needed)
+        session = self.sessions.get(current_guild_id)
+        if session is not None:
+            if session.expires_within(BUFFER):
+                with tracing.span('auth'):
+                    session = await self._single_flight(current_guild_id, lambda: self._renew_session(session))
         # otherwise, create new api client
         else:
-            new_credentials = {'username': f'{interaction.guild.name} {str(current_guild_id)[-4:]}',
-                               'password': str(current_guild_id)}
-            self.guild_credentials[current_guild_id] = new_credentials
-            new_client = APIWrapper(self._YT_API_KEY)
-            try:
-                # try logging in
-                response = await new_client.login(**new_credentials)
-                self.token_exp_times[current_guild_id] = response['exp_time']
-            except AuthenticationError:
-                # if user doesn't exist in main API, then create new user
-                await new_client.create_user(**new_credentials)
-                response = await new_client.login(**new_credentials)
-                self.token_exp_times[current_guild_id] = response['exp_time']
-            
-            self.api_clients[interaction.guild_id] = new_client
-            return new_client
+            with tracing.span('auth'):
+                session = await self._single_flight(current_guild_id, lambda: self._open_session(interaction.guild))
+            # written in the background, since the command doesn't need it
+            self.recent_guilds.save().add_done_callback(lambda f: _report_store_failure(f, "save recent guilds"))
+        return session
+
+def _report_store_failure(future: asyncio.Future, action: str):
+    # done callback for session store writes which aren't awaited (e.g. the store was locked for too long)
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Could not {action}: {future.exception()}")
 
 intents = discord.Intents.default()
 intents.message_content = True
 
-client = Client(command_prefix = "/", intents = intents)
+# Discord requires the total shard count when a process runs only some of the shards
+if settings.SHARD_IDS is not None and settings.SHARD_COUNT is None:
+    print("Error: SHARD_COUNT must be set when SHARD_IDS is set")
+    sys.exit(1)
+
+client = Client(command_prefix = "/", intents = intents, tree_cls = InstrumentedCommandTree,
+                shard_count = settings.SHARD_COUNT, shard_ids = settings.SHARD_IDS)
+
+# Autocomplete
+async def song_title_autocomplete(interaction: discord.Interaction, current: str):
+    return await client.title_choices(interaction, current)
+
+async def alt_title_autocomplete(interaction: discord.Interaction, current: str):
+    return await client.title_choices(interaction, current, alt_only = True)
+
+async def song_titles_autocomplete(interaction: discord.Interaction, current: str):
+    return await client.title_choices(interaction, current, multiple = True)
 
 # General commands
 @client.tree.command(name = 'help', description = 'Get general info about this bot', guild = GUILD_ID)
@@ -135,29 +415,33 @@ async def summarize_songs(interaction: discord.Interaction,
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
 
     try:
-        response = await api_client.summarize_songs(
-            query_str = query_str,
-            exact_match = exact_match, 
-            include_alts = include_alts,
-            include_links = include_links)
-        output_str = response['detail']
-        if len(output_str) < 2000:
-            await interaction.followup.send(output_str,
-                                            suppress_embeds = True)
+        songs = await api_client.get_all_songs(exact_match = exact_match, query_str = query_str)
+        if len(songs) == 0:
+            await interaction.followup.send("No results!")
             return
         
-        output_chunks = utils.partition_song_summary_str(output_str, slack = 100)
-        for i, chunk in enumerate(output_chunks):
+        # one message whose pages are flipped with buttons, rather than a message per part of the catalog
+        pages = SongPages(songs, include_alts = include_alts, include_links = include_links)
+        if len(pages) > MAX_PAGES:
             await interaction.followup.send(
-                f"**__Part {i+1}/{len(output_chunks)}__** \n{chunk}",
-                suppress_embeds = True
+                f"Found {len(songs)} songs, which is too many to page through, so they are attached as a file.",
+                file = pages.to_file()
             )
+            return
+        
+        view = SongPaginator(pages, owner_id = interaction.user.id)
+        if len(pages) == 1:
+            await interaction.followup.send(embed = view.embed())
+            return
+        view.message = await interaction.followup.send(embed = view.embed(), view = view, wait = True)
 
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'add-song', description = 'Add song to the database.', guild = GUILD_ID)
@@ -174,6 +458,7 @@ async def create_song(interaction: discord.Interaction, title: str,
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -183,6 +468,7 @@ async def create_song(interaction: discord.Interaction, title: str,
             alt_titles = [title.strip() for title in alt_titles.split(';') if title.strip() != ""]
 
         response = await api_client.create_song(title = title, alt_names = alt_titles, video_link = video_link)
+        client.note_title_changes(interaction.guild_id, added = [title] + (alt_titles or []))
         output_str = ""
         for i, item in enumerate(response['detail']):
             if i == 0:
@@ -191,9 +477,11 @@ async def create_song(interaction: discord.Interaction, title: str,
                 output_str += f"- {item} \n"
         await interaction.followup.send(output_str)
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'edit-song-title', description = 'Edit the canonical title of a song.', guild = GUILD_ID)
+@app_commands.autocomplete(old_title = song_title_autocomplete)
 async def modify_title(interaction: discord.Interaction, old_title: str, new_title: str):
     """
     Args:
@@ -204,19 +492,23 @@ async def modify_title(interaction: discord.Interaction, old_title: str, new_tit
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
     try:
         new_title = new_title.strip()
         response = await api_client.modify_title(old_title, new_title)
+        client.note_title_changes(interaction.guild_id, added = [new_title])
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'delete-song', 
                      description = 'Remove a song (along with its associated video and alt titles) from the database.',
                      guild = GUILD_ID)
+@app_commands.autocomplete(title = song_title_autocomplete)
 async def delete_song(interaction: discord.Interaction, title: str):
     """
     Args:
@@ -226,16 +518,20 @@ async def delete_song(interaction: discord.Interaction, title: str):
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
 
     try:
         response = await api_client.delete_song(title)
+        client.note_title_changes(interaction.guild_id, removed = [title])
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'add-alt-titles', description = 'Add alternate titles for to a song resource.', guild = GUILD_ID)
+@app_commands.autocomplete(song_title = song_title_autocomplete)
 async def add_alt_names(interaction: discord.Interaction, song_title: str, alt_titles: str):
     """
     Args: 
@@ -247,6 +543,7 @@ async def add_alt_names(interaction: discord.Interaction, song_title: str, alt_t
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -255,14 +552,17 @@ async def add_alt_names(interaction: discord.Interaction, song_title: str, alt_t
         response = await api_client.add_alt_names(
             target_title = song_title, 
             alt_names = alt_titles)
+        client.note_title_changes(interaction.guild_id, added = alt_titles)
         output_str = ""
         for item in response['detail']:
             output_str += f"- {item} \n"
         await interaction.followup.send(output_str)
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'delete-alt-title', description = 'Delete specified alternate titles.', guild = GUILD_ID)
+@app_commands.autocomplete(alt_title = alt_title_autocomplete)
 async def delete_alt_names(interaction: discord.Interaction, alt_title: str):
     """
     Args: 
@@ -272,19 +572,23 @@ async def delete_alt_names(interaction: discord.Interaction, alt_title: str):
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
     try:
         response = await api_client.delete_alt_name(alt_name = alt_title)
+        client.note_title_changes(interaction.guild_id, removed = [alt_title])
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         raise e
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'merge-songs', 
                      description = 'Take all the alternate titles of second song and assigns them to first song.', 
                      guild = GUILD_ID)
+@app_commands.autocomplete(priority_song = song_title_autocomplete, other_song = song_title_autocomplete)
 async def merge_songs(interaction: discord.Interaction, priority_song: str, other_song: str):
     """
     Args:
@@ -296,16 +600,20 @@ async def merge_songs(interaction: discord.Interaction, priority_song: str, othe
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
     try:
         response = await api_client.merge_songs(priority_song, other_song)
+        client.note_title_changes(interaction.guild_id)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'splinter-song', description = 'Remove an alternate title of a song and create a new song resource from it.', guild = GUILD_ID)
+@app_commands.autocomplete(alt_title = alt_title_autocomplete)
 async def splinter_song(interaction: discord.Interaction, alt_title: str):
     """
     Args:
@@ -315,16 +623,20 @@ async def splinter_song(interaction: discord.Interaction, alt_title: str):
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
     try:
         response = await api_client.splinter_song(target_song = alt_title)
+        client.note_title_changes(interaction.guild_id)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'assign-video', description = 'Assigns a video to a song.', guild = GUILD_ID)
+@app_commands.autocomplete(song_title = song_title_autocomplete)
 async def assign_video(interaction: discord.Interaction, song_title: str, video_link: str):
     """
     Args:
@@ -335,6 +647,7 @@ async def assign_video(interaction: discord.Interaction, song_title: str, video_
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -342,10 +655,12 @@ async def assign_video(interaction: discord.Interaction, song_title: str, video_
         response = await api_client.assign_video(song_title, video_link)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 # Playlist commands
 @client.tree.command(name = 'create-playlist', description = 'Create a playlist', guild = GUILD_ID)
+@app_commands.autocomplete(song_titles = song_titles_autocomplete)
 async def generate_playlist(interaction: discord.Interaction, playlist_title: str, song_titles: str, privacy_status: Literal['public', 'private', 'unlisted'] = 'unlisted',):
     """
     Args:
@@ -358,22 +673,51 @@ async def generate_playlist(interaction: discord.Interaction, playlist_title: st
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
     try:
         song_titles = [title.strip() for title in song_titles.split(';') if title.strip() != ""]
-        response = await api_client.generate_playlist(
+        job = await api_client.start_playlist_job(
             title = playlist_title,
             privacy_status = privacy_status,
             song_titles = song_titles)
-        output_str = f"Title: {response['content']['playlist_title']} \n"
-        output_str += f"Link: {response['content']['link']} \n"
+        # songs not in the database are created by the job
+        client.note_title_changes(interaction.guild_id, added = song_titles)
+        
+        # edit a status message as songs are found and inserted
+        status_message = await interaction.followup.send(f"Building playlist '{playlist_title}'...", wait = True)
+        song_statuses = ['pending'] * len(song_titles)
+        last_edit = 0
+        try:
+            async for event in api_client.stream_playlist_job(job['id']):
+                if event['event'] != 'item':
+                    continue
+                song_statuses[event['data']['position']] = event['data']['status']
+                if time.monotonic() - last_edit < PROGRESS_EDIT_INTERVAL:
+                    continue    # avoid hitting Discord's rate limit on message edits
+                last_edit = time.monotonic()
+                found = sum(status in ('resolved', 'inserted') for status in song_statuses)
+                inserted = song_statuses.count('inserted')
+                await status_message.edit(content = f"Building playlist '{playlist_title}'... "
+                                                    f"found {found}/{len(song_titles)} videos, "
+                                                    f"inserted {inserted}/{len(song_titles)}")
+        except httpx.HTTPError:
+            pass    # stream dropped; the result below is polled instead
+
+        response = await api_client.get_playlist_job_result(job['id'])
+        if response['content'] is not None:
+            output_str = f"Title: {response['content']['playlist_title']} \n"
+            output_str += f"Link: {response['content']['link']} \n"
+        else:
+            output_str = f"Operation aborted. {response['job_detail']} \n"
         output_str += f"Summary: \n"
         for song, message in zip(song_titles, response['detail']):
             output_str += f"- {song}: {message} \n"
-        await interaction.followup.send(output_str)
+        await status_message.edit(content = output_str)
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
     
 
@@ -387,6 +731,7 @@ async def summarize_playlists(interaction: discord.Interaction, mode: Literal['a
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -395,6 +740,7 @@ async def summarize_playlists(interaction: discord.Interaction, mode: Literal['a
         await interaction.followup.send(response['detail'],
                                         suppress_embeds = (mode == 'all'))
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'edit-playlist', description = 'Edit the title of a playlist.', guild = GUILD_ID)
@@ -408,6 +754,7 @@ async def edit_playlist_title(interaction: discord.Interaction, old_title: str,
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -416,6 +763,7 @@ async def edit_playlist_title(interaction: discord.Interaction, old_title: str,
         response = await api_client.edit_playlist_title(old_title, new_title)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'delete-playlist', description = 'Delete a playlist.', guild = GUILD_ID)
@@ -428,6 +776,7 @@ async def delete_playlist(interaction: discord.Interaction, title: str):
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -436,6 +785,7 @@ async def delete_playlist(interaction: discord.Interaction, title: str):
         response = await api_client.delete_playlist(title)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 
@@ -451,6 +801,7 @@ async def add_to_playlist(interaction: discord.Interaction, playlist_title: str,
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -461,6 +812,7 @@ async def add_to_playlist(interaction: discord.Interaction, playlist_title: str,
             record_in_db = True)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'replace-playlist-video', description = 'Replace a video in an existing playlist.', guild = GUILD_ID)
@@ -475,6 +827,7 @@ async def replace_vid_in_playlist(interaction: discord.Interaction, playlist_tit
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -486,6 +839,7 @@ async def replace_vid_in_playlist(interaction: discord.Interaction, playlist_tit
             video_link = video_link)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
     
 @client.tree.command(name = 'move-in-playlist', description = 'Move a video within existing playlist.', guild = GUILD_ID)
@@ -502,6 +856,7 @@ async def move_vid_in_playlist(interaction: discord.Interaction, playlist_title:
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -513,6 +868,34 @@ async def move_vid_in_playlist(interaction: discord.Interaction, playlist_title:
             target_pos = final_position - 1)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
+        await interaction.followup.send(f"Unexpected error occurred. {e}")
+
+@client.tree.command(name = 'reorder-playlist', description = 'Rearrange an existing playlist to match a setlist.', guild = GUILD_ID)
+@app_commands.autocomplete(song_titles = song_titles_autocomplete)
+async def reorder_playlist(interaction: discord.Interaction, playlist_title: str, song_titles: str):
+    """
+    Args:
+        playlist_title: The title of the playlist you want to edit.
+        song_titles: A semi-colon separated list of titles of the songs, in the desired order
+            (e.g. Title 1; Title 2; Title 3). Videos not in this list are removed from the playlist.
+    """
+    await interaction.response.defer(thinking = True)
+    try:
+        api_client = await client.get_api_client(interaction)
+    except httpx.ConnectError as e:
+        tracing.mark_failed()
+        await interaction.followup.send(f"Operation aborted. {e}")
+        return 
+    
+    try:
+        song_titles = [title.strip() for title in song_titles.split(';') if title.strip() != ""]
+        response = await api_client.reorder_playlist(
+            playlist_title = playlist_title,
+            song_titles = song_titles)
+        await interaction.followup.send(response['detail'])
+    except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 @client.tree.command(name = 'remove-from-playlist', description = 'Remove a video from an existing playlist.', guild = GUILD_ID)
@@ -526,6 +909,7 @@ async def remove_from_playlist(interaction: discord.Interaction, playlist_title:
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -536,6 +920,7 @@ async def remove_from_playlist(interaction: discord.Interaction, playlist_title:
             pos = position - 1)
         await interaction.followup.send(response['detail'])
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Unexpected error occurred. {e}")
 
 # Import/export commands
@@ -550,6 +935,7 @@ async def import_csv(interaction: discord.Interaction, file: discord.Attachment)
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -563,21 +949,40 @@ async def import_csv(interaction: discord.Interaction, file: discord.Attachment)
     status_msg = await interaction.followup.send("*Processing data. This might take a while :/*",
                                                  suppress_embeds = True)
     
+    last_edit_at = 0
+    async def show_progress(processed: int, report: dict):
+        nonlocal last_edit_at
+        # editing on every song would hit Discord's rate limits
+        if time.monotonic() - last_edit_at < PROGRESS_EDIT_INTERVAL:
+            return
+        last_edit_at = time.monotonic()
+        await status_msg.edit(content = f"*Processing data. {processed} songs done, {report['created']} created, "
+                                        f"{len(report['conflicts'])} conflicts so far...*")
+
     try:
-        # read into df and check col names
+        # the file is read (and its columns checked) a chunk at a time as songs are created
         file_bytes = await file.read()
-        df = pd.read_csv(io.BytesIO(file_bytes))
-        if not all(df.columns == ['Song', 'Alt Names', 'Link']):
-            await status_msg.edit(
-                content = f"""Error: expected the column titles 'Song', 'Alt Names', and 'Link', 
-                but instead got {', '.join(df.columns.to_list())}. 
-                Please refer to the guide at {guide_link}"""
-            )
+        try:
+            response = await api_client.import_songs(io.BytesIO(file_bytes), progress_callback = show_progress)
+        except ValueError as e:
+            await status_msg.edit(content = f"Error: {e}. Please refer to the guide at {guide_link}")
             return
-        
-        response = await api_client.import_songs(df)
+        finally:
+            client.note_title_changes(interaction.guild_id)
         await status_msg.edit(content = f"{response['detail']}")
+
+        problems = [f"- Conflict: {item}" for item in response['conflicts']] + \
+                   [f"- Failed: {item}" for item in response['failed']]
+        if problems:
+            # split into messages Discord accepts
+            output_chunks = utils.partition_song_summary_str("\n\n".join(problems), slack = 100)
+            for i, chunk in enumerate(output_chunks):
+                await interaction.followup.send(
+                    f"**__Import problems {i+1}/{len(output_chunks)}__** \n{chunk}",
+                    suppress_embeds = True
+                )
     except Exception as e:
+        tracing.mark_failed()
         await status_msg.edit(content = f"Unexpected error: {e}")
 
 @client.tree.command(name = 'export-songs', description = 'Export all songs in your database file', guild = GUILD_ID)
@@ -586,6 +991,7 @@ async def export(interaction: discord.Interaction, format: Literal['.csv', '.pdf
     try:
         api_client = await client.get_api_client(interaction)
     except httpx.ConnectError as e:
+        tracing.mark_failed()
         await interaction.followup.send(f"Operation aborted. {e}")
         return 
     
@@ -595,31 +1001,53 @@ async def export(interaction: discord.Interaction, format: Literal['.csv', '.pdf
             await interaction.followup.send(content = "No songs in your database, so no file generated!")
             return
         
-        file = None
-        if format == '.csv':
-            df = utils.json_songs_to_df(songs)
-            csv_string = df.to_csv(index = False)
-            csv_bytes = csv_string.encode('utf-8')
+        # the file is written to disk rather than memory, since large catalogs make large files
+        fd, path = tempfile.mkstemp(suffix = format)
+        os.close(fd)
+        try:
+            # at most EXPORT_WORKERS exports render at once. Others queue in the pool
+            await asyncio.get_running_loop().run_in_executor(
+                client.export_pool, utils.render_songs_export, songs, format, path, interaction.guild.name)
             file = discord.File(
-                io.BytesIO(csv_bytes),
-                filename = f"{interaction.guild.name}_data_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            )
-        elif format == '.pdf':
-            pdf_buffer = io.BytesIO()
-            utils.generate_songs_pdf_table(
-                data = songs,
-                buffer = pdf_buffer,
-                user_name = interaction.guild.name
+                path,
+                filename = f"{interaction.guild.name}_data_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}{format}"
             )
-            file = discord.File(
-                pdf_buffer,
-                filename = f"{interaction.guild.name}_data_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+            await interaction.followup.send(
+                content = f"Your data is ready!",
+                file = file
             )
-        await interaction.followup.send(
-            content = f"Your data is ready!",
-            file = file
-        )
+        finally:
+            os.remove(path)
     except Exception as e:
+        tracing.mark_failed()
         await interaction.followup.send(content = f"Unexpected error occured: {e}")
 
-client.run(TOKEN)
+@client.tree.command(name = 'bot-stats', description = 'Admin only. View command latencies and the state of the bot.', guild = GUILD_ID)
+@app_commands.default_permissions(administrator = True)
+async def bot_stats(interaction: discord.Interaction):
+    """
+    Shows each command's run count, failures, and p50/p95 latency in ms, with the p95 of the time spent
+    logging in, in the main API, on YouTube and on Discord. Covers this process's shards only.
+    The stats cover every guild, so only the bot's owners may view them. Guild admins can change 
+    the default permissions, so these permissions only hide the command
+    """
+    if not await client.is_owner(interaction.user):
+        await interaction.response.send_message("Only the bot's owners can view its stats.", ephemeral = True)
+        return
+
+    sessions = client.sessions.stats()
+    output_str = (f"**Shards**: {sorted(client.shards)} of {client.shard_count} "
+                  f"(gateway latency {client.latency * 1000:.0f} ms)\n"
+                  f"**Main API**: {'up' if client.health.is_up else 'down'}\n"
+                  f"**Sessions**: {sessions['sessions']}/{sessions['max_sessions']} "
+                  f"({sessions['hits']} hits, {sessions['misses']} misses, {sessions['evictions']} evictions, "
+                  f"{sessions['open_connections']} open connections)\n"
+                  f"**Commands** since <t:{int(client.metrics.started_at)}:R> (times in ms):\n")
+    table = format_summary(client.metrics.summary())
+
+    if len(output_str) + len(table) + 8 <= 2000:
+        await interaction.response.send_message(output_str + f"```\n{table}\n```", ephemeral = True)
+    else:
+        await interaction.response.send_message(output_str, ephemeral = True,
+                                                file = discord.File(fp = io.BytesIO(table.encode('utf-8')),
+                                                                    filename = 'bot_stats.txt'))
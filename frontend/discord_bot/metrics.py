@@ -0,0 +1,141 @@
+"""
+Latency and error metrics for the bot's slash commands. Every command runs in a trace (see
+`api_wrapper.tracing`), which splits its time into logging in ('auth'), requests to the main API ('api') and
+requests which make the API call YouTube ('youtube'). The rest ('discord') is spent responding on Discord and
+in the bot itself. Percentiles are computed over each command's most recent runs, and are periodically
+written to a rotating log file.
+"""
+import discord
+from discord import app_commands
+
+from collections import defaultdict, deque, Counter
+import asyncio
+import json
+import logging
+import logging.handlers
+import time
+
+from api_wrapper import tracing
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 500                        # most recent runs of each command which percentiles are computed over
+PHASES = tracing.SPAN_KINDS + ('discord',)
+
+def _percentile(values: list, q: float):
+    # nearest-rank percentile of a sorted list
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+class CommandMetrics:
+    def __init__(self, window: int = WINDOW):
+        self._runs = defaultdict(lambda: deque(maxlen = window))   # keys are command names, values are (duration, phases)
+        self.counts = Counter()     # runs of each command since startup
+        self.failures = Counter()   # runs of each command which raised
+        self.errors = defaultdict(Counter)  # keys are command names, values count errors seen in spans by type
+        self.started_at = time.time()
+
+    def record(self, trace: tracing.Trace, failed: bool = False):
+        """
+        Records a finished command's trace
+        Args:
+            failed: whether the command raised instead of completing. Commands which handled their own failure
+                are counted as failed too (see `tracing.mark_failed`)
+        """
+        trace.finish()
+        phases = {kind: trace.spans.get(kind, 0.0) for kind in tracing.SPAN_KINDS}
+        # concurrent spans can add up to more than the command took
+        phases['discord'] = max(trace.duration - sum(phases.values()), 0.0)
+
+        self._runs[trace.name].append((trace.duration, phases))
+        self.counts[trace.name] += 1
+        if failed or trace.failed:
+            self.failures[trace.name] += 1
+        self.errors[trace.name].update(trace.errors)
+
+    def summary(self):
+        """
+        Summarizes each command's runs. Times are in seconds
+        Returns:
+            dict: keys are command names, values have the keys 'count', 'failures', 'errors', 'p50' and 'p95',
+            and 'p50_<phase>' and 'p95_<phase>' for each phase
+        """
+        summary = dict()
+        for name, runs in self._runs.items():
+            durations = sorted(duration for duration, _ in runs)
+            entry = {'count': self.counts[name],
+                     'failures': self.failures[name],
+                     'errors': dict(self.errors[name]),
+                     'p50': _percentile(durations, 0.5),
+                     'p95': _percentile(durations, 0.95)}
+            for phase in PHASES:
+                times = sorted(phases[phase] for _, phases in runs)
+                entry[f'p50_{phase}'] = _percentile(times, 0.5)
+                entry[f'p95_{phase}'] = _percentile(times, 0.95)
+            summary[name] = entry
+        return summary
+
+    def write(self, metrics_logger: logging.Logger):
+        """
+        Writes the summary to a logger as one JSON line per command
+        """
+        for name, entry in self.summary().items():
+            metrics_logger.info(json.dumps({'time': time.time(), 'command': name, **entry}))
+
+    async def run_log_loop(self, metrics_logger: logging.Logger, interval: float):
+        """
+        Writes the summary every `interval` seconds, until cancelled
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.write(metrics_logger)
+            except Exception as e:
+                logger.exception(f"Could not write command metrics: {e}")
+
+def create_metrics_logger(path: str, max_bytes: int, backup_count: int):
+    """
+    Returns a logger which writes to a file rotated once it reaches `max_bytes`, keeping `backup_count` old files
+    """
+    metrics_logger = logging.getLogger(f'{__name__}.file')
+    metrics_logger.setLevel(logging.INFO)
+    metrics_logger.propagate = False    # keep metrics out of the bot's own log
+    if not metrics_logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes = max_bytes, backupCount = backup_count,
+                                                       encoding = 'utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        metrics_logger.addHandler(handler)
+    return metrics_logger
+
+class InstrumentedCommandTree(app_commands.CommandTree):
+    """
+    A command tree which runs every slash command in a trace, recorded in the client's `metrics` 
+    once the command completes or raises
+    """
+    async def interaction_check(self, interaction: discord.Interaction):
+        # autocompletes and component interactions aren't commands
+        if interaction.type is discord.InteractionType.application_command and interaction.command is not None:
+            # the command runs in this task, so the trace is current for all of it
+            interaction.extras['trace'] = tracing.begin_trace(interaction.command.qualified_name)
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        trace = interaction.extras.get('trace')
+        if trace is not None:
+            self.client.metrics.record(trace, failed = True)
+        await super().on_error(interaction, error)
+
+def format_summary(summary: dict):
+    """
+    Formats the result of `CommandMetrics.summary` as a fixed-width table, busiest commands first
+    """
+    def ms(seconds):
+        return '-' if seconds is None else f"{seconds * 1000:.0f}"
+    
+    lines = [f"{'command':<24}{'runs':>6}{'fail':>5}{'p50':>7}{'p95':>7}" + 
+             "".join(f"{phase[:7]:>8}" for phase in PHASES)]
+    for name, entry in sorted(summary.items(), key = lambda item: item[1]['count'], reverse = True):
+        lines.append(f"{name[:24]:<24}{entry['count']:>6}{entry['failures']:>5}{ms(entry['p50']):>7}{ms(entry['p95']):>7}" +
+                     "".join(f"{ms(entry[f'p95_{phase}']):>8}" for phase in PHASES))
+    return "\n".join(lines)
@@ -0,0 +1,118 @@
+"""
+Paged display of song catalogs for /view-songs. A catalog is split into pages once, by recording which songs
+each page holds, and a page's text is only rendered when it is shown. Pages are then flipped through with
+buttons, which edit a single message instead of sending one message per part of the catalog.
+"""
+import discord
+
+import io
+from typing import List
+
+from api_wrapper.utils import format_song_summary
+
+PAGE_LEN = 4000             # max characters of a page. Embed descriptions hold at most 4096
+MAX_PAGES = 50              # catalogs with more pages than this are sent as a file instead
+PAGINATOR_TIMEOUT = 600     # seconds without a button press after which the buttons are disabled
+
+class SongPages:
+    """
+    A song catalog split into pages of at most `page_len` characters, without splitting a song across pages
+    """
+    def __init__(self, songs: List[dict], include_alts: bool = True, include_links: bool = True,
+                 page_len: int = PAGE_LEN):
+        self.songs = songs
+        self.include_alts = include_alts
+        self.include_links = include_links
+        self.page_len = page_len
+        self._bounds = []       # (start, end) song indices of each page
+        self._rendered = dict() # keys are page numbers, values are rendered pages
+
+        start, length = 0, 0
+        for i, song in enumerate(songs):
+            entry_len = len(self._format(song))
+            if i > start and length + entry_len > page_len:
+                self._bounds.append((start, i))
+                start, length = i, 0
+            length += entry_len
+        if songs:
+            self._bounds.append((start, len(songs)))
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def _format(self, song: dict):
+        return format_song_summary(song, include_alts = self.include_alts, include_links = self.include_links)
+
+    def render(self, page: int):
+        """
+        Returns the text of a page (numbered from 0)
+        """
+        if page not in self._rendered:
+            start, end = self._bounds[page]
+            text = "".join(self._format(song) for song in self.songs[start:end]).strip()
+            # a song with very many alternate titles can be longer than a page on its own
+            if len(text) > self.page_len:
+                text = text[:self.page_len - 3] + "..."
+            self._rendered[page] = text
+        return self._rendered[page]
+
+    def to_file(self, filename: str = 'songs.txt'):
+        """
+        Returns the whole catalog as a text file attachment
+        """
+        text = "".join(self._format(song) for song in self.songs)
+        return discord.File(fp = io.BytesIO(text.encode('utf-8')), filename = filename)
+
+class SongPaginator(discord.ui.View):
+    """
+    Buttons which flip through the pages of a catalog. Only the user who ran the command can use them
+    """
+    def __init__(self, pages: SongPages, owner_id: int, title: str = 'Songs', timeout: float = PAGINATOR_TIMEOUT):
+        super().__init__(timeout = timeout)
+        self.pages = pages
+        self.owner_id = owner_id
+        self.title = title
+        self.page = 0
+        self.message = None     # the message showing the pages, set once it is sent
+        self._update_buttons()
+
+    def embed(self):
+        """
+        Returns the embed showing the current page
+        """
+        embed = discord.Embed(title = self.title, description = self.pages.render(self.page))
+        embed.set_footer(text = f"Page {self.page + 1}/{len(self.pages)} · {len(self.pages.songs)} songs")
+        return embed
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page == len(self.pages) - 1
+
+    async def _show(self, interaction: discord.Interaction, page: int):
+        self.page = page
+        self._update_buttons()
+        await interaction.response.edit_message(embed = self.embed(), view = self)
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("Only the user who ran this command can change pages. "
+                                                    "Run /view-songs to browse your own copy.", ephemeral = True)
+            return False
+        return True
+
+    @discord.ui.button(label = 'Previous', style = discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label = 'Next', style = discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view = self)
+            except discord.HTTPException:
+                pass    # e.g. the message was deleted
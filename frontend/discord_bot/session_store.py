@@ -0,0 +1,103 @@
+"""
+Guild login state shared by every process of a sharded bot (and kept across restarts), in a SQLite file.
+Each guild is served by one shard at a time, but guilds move between processes when the bot restarts or is
+resharded; with their tokens in the store, the process that picks a guild up resumes its login instead of
+logging in again. The store also records when each guild last used the bot, for warming sessions.
+
+The file holds API tokens, so it should only be readable by the bot.
+
+Another shard process may hold the file's lock for up to the connection's timeout, so the store never touches
+the file on the event loop. Every method runs on the store's own thread, in the order the methods were called,
+and returns an awaitable of its result. Writes whose outcome doesn't matter to the caller needn't be awaited.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import sqlite3
+import time
+
+class SessionStore:
+    def __init__(self, path: str):
+        # one thread, so that calls run in order and the connection is never used concurrently
+        self._executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'session-store')
+        # autocommit, since every write is a single statement
+        self._conn = sqlite3.connect(path, timeout = 5.0, isolation_level = None, check_same_thread = False)
+        # WAL lets shard processes read while another writes
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS guild_logins (
+                                  guild_id INTEGER PRIMARY KEY,
+                                  access_token TEXT,
+                                  refresh_token TEXT,
+                                  act_as_user_id INTEGER,
+                                  updated_at REAL NOT NULL)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS recent_guilds (
+                                  guild_id INTEGER PRIMARY KEY,
+                                  last_used_at REAL NOT NULL)""")
+
+    def _submit(self, func, *args, **kwargs):
+        return asyncio.wrap_future(self._executor.submit(func, *args, **kwargs))
+
+    def load_login(self, guild_id: int):
+        """
+        Returns the saved login of a guild, in the form of `APIWrapper.export_login`, or None if there is none
+        """
+        return self._submit(self._load_login, guild_id)
+
+    def _load_login(self, guild_id: int):
+        row = self._conn.execute("SELECT access_token, refresh_token, act_as_user_id FROM guild_logins WHERE guild_id = ?",
+                                 (guild_id,)).fetchone()
+        if row is None:
+            return None
+        return {'access_token': row[0], 'refresh_token': row[1], 'act_as_user_id': row[2]}
+
+    def save_login(self, guild_id: int, access_token: str | None = None, refresh_token: str | None = None,
+                   act_as_user_id: int | None = None):
+        return self._submit(self._save_login, guild_id, access_token, refresh_token, act_as_user_id)
+
+    def _save_login(self, guild_id: int, access_token: str | None, refresh_token: str | None, 
+                    act_as_user_id: int | None):
+        self._conn.execute("""INSERT INTO guild_logins (guild_id, access_token, refresh_token, act_as_user_id, updated_at)
+                              VALUES (?, ?, ?, ?, ?)
+                              ON CONFLICT (guild_id) DO UPDATE SET access_token = excluded.access_token,
+                                                                   refresh_token = excluded.refresh_token,
+                                                                   act_as_user_id = excluded.act_as_user_id,
+                                                                   updated_at = excluded.updated_at""",
+                           (guild_id, access_token, refresh_token, act_as_user_id, time.time()))
+
+    def delete_login(self, guild_id: int):
+        return self._submit(self._conn.execute, "DELETE FROM guild_logins WHERE guild_id = ?", (guild_id,))
+
+    def touch_guilds(self, last_used: dict, keep: int):
+        """
+        Records when guilds last used the bot, keeping only the `keep` most recent guilds
+        Args:
+            last_used: keys are guild ids, values are unix times
+        """
+        return self._submit(self._touch_guilds, last_used, keep)
+
+    def _touch_guilds(self, last_used: dict, keep: int):
+        if not last_used:
+            return
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("""INSERT INTO recent_guilds (guild_id, last_used_at) VALUES (?, ?)
+                                      ON CONFLICT (guild_id) DO UPDATE 
+                                      SET last_used_at = MAX(last_used_at, excluded.last_used_at)""",
+                                   list(last_used.items()))
+            self._conn.execute("""DELETE FROM recent_guilds WHERE guild_id NOT IN 
+                                  (SELECT guild_id FROM recent_guilds ORDER BY last_used_at DESC LIMIT ?)""",
+                               (keep,))
+
+    def most_recent_guilds(self, n: int):
+        """
+        Returns the ids of the `n` guilds which used the bot most recently, most recent first
+        """
+        return self._submit(self._most_recent_guilds, n)
+
+    def _most_recent_guilds(self, n: int):
+        rows = self._conn.execute("SELECT guild_id FROM recent_guilds ORDER BY last_used_at DESC LIMIT ?", (n,))
+        return [row[0] for row in rows]
+
+    async def close(self):
+        await self._submit(self._conn.close)
+        self._executor.shutdown()
@@ -0,0 +1,176 @@
+"""
+The API session of each guild the bot serves: its API client, login credentials and token expiry.
+Sessions are kept in least-recently-used order and capped, and sessions left idle are evicted, so a bot in
+many guilds only keeps state (and, for clients with their own connection pool, connections) for the guilds 
+that are actually active.
+An evicted guild resumes its saved login (see `SessionStore`) on its next command.
+"""
+from dataclasses import dataclass
+from collections import OrderedDict
+import asyncio
+import logging
+import time
+
+from api_wrapper.main import APIWrapper
+from .title_index import TitleIndex
+from .session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+EVICTION_CHECK_INTERVAL = 60    # seconds between sweeps for idle sessions
+
+@dataclass(slots = True)
+class GuildSession:
+    api_client: APIWrapper
+    username: str
+    password: str
+    token_exp_time: int | None      # None with a service key, since it doesn't expire
+    last_used_at: float
+    title_index: TitleIndex | None = None   # built on the guild's first autocomplete
+    title_index_built_at: float = 0.0
+    title_index_stale: bool = False         # set when a command may have changed titles the index doesn't know about
+
+    @property
+    def credentials(self):
+        return {'username': self.username, 'password': self.password}
+
+    def expires_within(self, seconds: float):
+        return self.token_exp_time is not None and time.time() >= self.token_exp_time - seconds
+
+class SessionRegistry:
+    """
+    Maps guild ids to GuildSessions
+    """
+    def __init__(self, max_sessions: int, idle_timeout: float):
+        """
+        Args:
+            max_sessions: max number of sessions kept. Adding one more evicts the least recently used
+            idle_timeout: seconds after which an unused session is evicted
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()      # least recently used first
+
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, guild_id: int):
+        return guild_id in self._sessions
+
+    def get(self, guild_id: int):
+        """
+        Returns the session of a guild, marking it as used, or None if the guild has none
+        """
+        session = self._sessions.get(guild_id)
+        if session is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        session.last_used_at = time.monotonic()
+        self._sessions.move_to_end(guild_id)
+        return session
+
+    async def add(self, guild_id: int, session: GuildSession):
+        """
+        Stores the session of a guild, evicting the least recently used sessions if over capacity.
+        If the guild already has a session (i.e. two commands logged in at once), then the existing one is
+        kept, since it may be in use, and the new one is closed.
+        Returns:
+            GuildSession: the guild's session
+        """
+        existing = self._sessions.get(guild_id)
+        if existing is not None:
+            await session.api_client.aclose()
+            return existing
+        self._sessions[guild_id] = session
+
+        while len(self._sessions) > self.max_sessions:
+            evicted_id = next(iter(self._sessions))
+            await self.evict(evicted_id)
+        return session
+
+    async def evict(self, guild_id: int):
+        """
+        Removes the session of a guild and closes its client
+        """
+        session = self._sessions.pop(guild_id, None)
+        if session is None:
+            return
+        self.evictions += 1
+        await session.api_client.aclose()
+
+    async def evict_idle(self):
+        """
+        Evicts sessions unused for longer than the idle timeout
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [guild_id for guild_id, session in self._sessions.items() if session.last_used_at < cutoff]
+        for guild_id in idle:
+            await self.evict(guild_id)
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle guild sessions, {len(self._sessions)} remain")
+
+    async def run_eviction_loop(self):
+        """
+        Evicts idle sessions on an interval until cancelled
+        """
+        while True:
+            await asyncio.sleep(EVICTION_CHECK_INTERVAL)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.exception(f"Unexpected error while evicting guild sessions: {e}")
+
+    async def close_all(self):
+        for guild_id in list(self._sessions):
+            await self.evict(guild_id)
+
+    def stats(self):
+        """
+        Summarizes the registry's use
+        """
+        # sessions usually share one HTTP client, whose connections must only be counted once
+        clients = {id(session.api_client.client): session.api_client for session in self._sessions.values()}
+        return {'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'open_connections': sum(api_client.open_connections() for api_client in clients.values())}
+
+class RecentGuilds:
+    """
+    Remembers when each guild last used the bot, across restarts (and across shard processes), so that
+    sessions can be warmed at startup for the guilds likely to send commands soon. Uses are collected in
+    memory and written to the session store by `save`, so commands don't each write to disk.
+    Every shard process trims the store to `max_guilds` guilds, so `max_guilds` must leave room for the
+    guilds of the other processes too.
+    """
+    def __init__(self, store: SessionStore, max_guilds: int):
+        self.store = store
+        self.max_guilds = max_guilds
+        self._pending = dict()      # keys are guild ids, values are unix times not yet saved
+
+    def touch(self, guild_id: int):
+        self._pending[guild_id] = time.time()
+
+    async def most_recent(self, n: int):
+        """
+        Returns the ids of the `n` most recently active guilds, most recent first
+        """
+        self.save()
+        return await self.store.most_recent_guilds(n)
+
+    def save(self):
+        """
+        Writes the uses collected so far to the store, in the background. Returns an awaitable which is done
+        once they are written
+        """
+        pending, self._pending = self._pending, dict()
+        return self.store.touch_guilds(pending, keep = self.max_guilds)
@@ -0,0 +1,71 @@
+"""
+An in-memory index of a guild's song titles (canonical and alternate), used to autocomplete title arguments
+of slash commands without calling the API on every keystroke. Titles are kept in a sorted list, so prefix
+lookups are a binary search.
+"""
+from bisect import bisect_left, insort
+from typing import List
+
+MAX_CHOICES = 25    # Discord shows at most 25 autocomplete choices
+
+def normalize(title: str):
+    # case and spacing shouldn't affect matches
+    return ' '.join(title.casefold().split())
+
+class TitleIndex:
+    def __init__(self):
+        self._entries = []          # sorted (normalized title, title, is_canonical) tuples
+
+    @classmethod
+    def from_songs(cls, songs: List[dict]):
+        """
+        Builds an index from songs as returned by `GET /songs`
+        """
+        index = cls()
+        index._entries = sorted({(normalize(item['title']), item['title'], item['title'] == song['title'])
+                                 for song in songs for item in song['alt_names']})
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, title: str, is_canonical: bool = False):
+        entry = (normalize(title), title, is_canonical)
+        i = bisect_left(self._entries, entry)
+        if i == len(self._entries) or self._entries[i] != entry:
+            insort(self._entries, entry)
+
+    def remove(self, title: str):
+        key = normalize(title)
+        i = bisect_left(self._entries, (key,))
+        while i < len(self._entries) and self._entries[i][0] == key:
+            if self._entries[i][1] == title:
+                del self._entries[i]
+            else:
+                i += 1
+
+    def complete(self, text: str, limit: int = MAX_CHOICES, alt_only: bool = False):
+        """
+        Returns up to `limit` titles starting with `text` (ignoring case and spacing). If there are fewer than
+        `limit`, titles containing `text` elsewhere are added after them.
+        Args:
+            alt_only: only return alternate titles (i.e. not the canonical title of a song)
+        """
+        prefix = normalize(text)
+        matches = []
+
+        i = bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and len(matches) < limit and self._entries[i][0].startswith(prefix):
+            key, title, is_canonical = self._entries[i]
+            if not (alt_only and is_canonical):
+                matches.append(title)
+            i += 1
+        
+        if len(matches) < limit and prefix:
+            # a full scan, but indexes hold at most a few thousand titles
+            for key, title, is_canonical in self._entries:
+                if len(matches) >= limit:
+                    break
+                if prefix in key and not key.startswith(prefix) and not (alt_only and is_canonical):
+                    matches.append(title)
+        return matches
@@ -199,3 +199,20 @@ def generate_songs_pdf_table(data: List[Dict], buffer: io.BytesIO, user_name: Op
     doc.build(story)
     buffer.seek(0)
 
+def render_songs_export(songs: List[dict], format: str, path: str, user_name: Optional[str] = None):
+    """
+    Writes songs to a file for the /export-songs command. Runs in a worker process, so that rendering
+    doesn't block the bot's event loop.
+    Args:
+        songs: a list of songs as returned by the main API
+        format: '.csv' or '.pdf'
+        path: the file to write to
+        user_name: Optional user name to include in titles of the PDF
+    """
+    if format == '.csv':
+        json_songs_to_df(songs).to_csv(path, index = False, encoding = 'utf-8')
+    elif format == '.pdf':
+        with open(path, 'wb') as f:
+            generate_songs_pdf_table(data = songs, buffer = f, user_name = user_name)
+    else:
+        raise ValueError(f"Unsupported export format '{format}'")
@@ -9,4 +9,4 @@ until curl -sf "$BASE_URL/"; do
 done
 
 echo "API is up — starting Discord bot"
-exec python -m discord_bot.main PROD
+exec python -m discord_bot PROD